@@ -1,44 +1,122 @@
+import os
 import json
+import time
+import shutil
 import logging
-import PIL.Image
+import tempfile
+import threading
 import gradio as gr
+from concurrent.futures import CancelledError
 
-from utils.prompt_constructor import get_prompt_for_image_gen
-from utils.local_img_generation import generate_img
-from utils.remove_bg import get_bg_removed_img
+from utils.prompt_constructor import stream_prompt_for_image_gen
+from utils.prompt_reader import preload_prompts
+from utils.local_img_generation import submit_img, describe_job, batch_from_job, job_progress, describe_progress, cancel_img
+from utils.remove_bg import remove_backgrounds, background_removal_batch_size, preload_background_removal
+from utils.pipeline_image import PipelineImage
 from utils.log_image import log_image
-from io import BytesIO
+from utils import timing
+
+# seconds the PNGs of a generation are kept for the gallery and for logging
+IMAGE_FILES_TTL = float(os.getenv('IMAGE_FILES_TTL', '3600'))
+
+# created on first use, a spawned background removal worker imports this module as well
+# (which is also why the UI is only built under __main__)
+_image_files = None
+_image_files_lock = threading.Lock()
+
+def _generation_dir() -> str:
+    """
+    Returns a new directory for the PNGs of one generation and removes the directories of
+    generations older than `IMAGE_FILES_TTL`. All of them are removed when the app exits.
+    """
+    global _image_files
+    with _image_files_lock:
+        if _image_files is None:
+            _image_files = tempfile.TemporaryDirectory(prefix='jotform-img-gen-')
+
+    expired = time.time() - IMAGE_FILES_TTL
+    for entry in os.scandir(_image_files.name):
+        try:
+            if entry.stat().st_mtime < expired:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            # removed by another generation at the same time
+            continue
+    return tempfile.mkdtemp(dir=_image_files.name)
 
 def generate_prompt(image_type, form_id, prompt, llm_model):
+    """
+    Yields the prompt generated so far and an error message (None if there is no error),
+    so the prompt can be shown token by token while the LLM writes it.
+    """
     if prompt:
-        return prompt, None
+        yield prompt, None
     elif form_id:
         try:
             form_id = int(form_id)
             if form_id <= 0:
                 raise ValueError("Form ID must be a positive integer.")
             prompt_file_path = f"prompts/{image_type}_img_prompt.txt"
-            return get_prompt_for_image_gen(prompt_file_path, form_id, llm_model), None
+            for partial_prompt in stream_prompt_for_image_gen(prompt_file_path, form_id, llm_model):
+                yield partial_prompt, None
         except ValueError as ve:
-            return None, f"Invalid Form ID for {image_type}: {str(ve)}"
+            yield None, f"Invalid Form ID for {image_type}: {str(ve)}"
     else:
-        return None, "Either prompt or Form ID must be provided."
+        yield None, "Either prompt or Form ID must be provided."
 
 def generate_image(image_type, img_model, prompt, negative_prompt, rmv_bg: bool, **kwargs):
     """
     Takes in image type (Background or Avatar) and model parameters.
 
-    Returns PIL image(used for displaying the image), generation info, and image bytes.
+    While the job waits for and runs on the GPU, yields the job (so it can be cancelled),
+    its queue status or progress, and the latest preview as a PIL image (None if there is none).
+    Then returns every image of the batch and an error message (None if there is no error).
+    Each image is a dict with the path of its PNG file (used for displaying and logging the
+    image, kept for `IMAGE_FILES_TTL` seconds), its seed, its generation info, and the name
+    it is logged under.
     """
     try:
-        image_bytes, info = generate_img(img_model, prompt, negative_prompt, **kwargs)
-        if image_type == 'avatar' and rmv_bg:
-            image_bytes = get_bg_removed_img(image_bytes=image_bytes)
+        started = time.perf_counter()
+        job = submit_img(img_model, prompt, negative_prompt, **kwargs)
+        while not job.wait(timeout=1):
+            progress = job_progress(job)
+            if progress is None:
+                yield job, describe_job(job), None
+                continue
+            preview = progress.get('current_image')
+            preview = PipelineImage.from_base64(preview).pil() if preview else None
+            yield job, describe_progress(progress), preview
+        timing.record('txt2img', time.perf_counter() - started, job.future.exception() is not None)
+        batch = batch_from_job(job)
+
+        remove_bg = image_type == 'avatar' and rmv_bg
+        # the avatars of a chunk go through background removal together, in one batched inference
+        chunk_size = background_removal_batch_size() if remove_bg else 1
+        directory = _generation_dir()
+        images = []
+        for start in range(0, len(batch), chunk_size):
+            chunk = [batch.image(index) for index in range(start, min(start + chunk_size, len(batch)))]
+            if remove_bg:
+                with timing.stage('remove_background'):
+                    chunk = remove_backgrounds(chunk)
 
-        img = PIL.Image.open(BytesIO(image_bytes))
-        return img, info, image_bytes
+            for index, image in enumerate(chunk, start):
+                # Gradio serves the file as is and the browser decodes it, so an image without
+                # background removal is never decoded and only one image (one chunk with
+                # background removal) is in memory at a time
+                path = os.path.join(directory, f"{index + 1}.png")
+                with timing.stage('save_image'), open(path, 'wb') as image_file:
+                    image_file.write(image.encode('PNG'))
+                info = batch.image_info(index)
+                image_name = json.loads(info).get('job_timestamp')
+                if len(batch) > 1:
+                    image_name = f"{image_name}_{index + 1}"
+                images.append({'path': path, 'seed': batch.seed(index), 'info': info, 'name': image_name})
+        return images, None
+    except CancelledError:
+        return [], "Image generation was cancelled."
     except Exception as e:
-        return None, f"Error generating image: {str(e)}", None
+        return [], f"Error generating image: {str(e)}"
 
 def create_image_generation_tab(image_type):
     with gr.Tab(f"{image_type.capitalize()} Generation"):
@@ -73,6 +151,7 @@ def create_image_generation_tab(image_type):
                             rmv_bg_checkbox = gr.Checkbox(value=False, label="Remove background", scale=1)
                     else:
                         rmv_bg_checkbox = gr.Checkbox(value=False, label="Remove background", scale=1, visible=False)
+                    auto_generate_checkbox = gr.Checkbox(value=True, label="Start image generation as soon as the prompt is ready", scale=1)
                 with gr.Row():
                     with gr.Accordion("Generation Parameters", open=False):
                         with gr.Row(equal_height=True):
@@ -102,8 +181,11 @@ def create_image_generation_tab(image_type):
                             use_white_bg_lora = gr.Checkbox(value=False, label="White Background Lora", scale=1)
                             use_sdxl_lightning_4step_lora = gr.Checkbox(value=False, label="SDXL-Lightning 4 Step Lora", scale=1)
                             use_sdxl_lightning_8step_lora = gr.Checkbox(value=False, label="SDXL-Lightning 8 Step Lora", scale=1)
-                generate_button = gr.Button("Generate Image", size='sm')
+                with gr.Row():
+                    generate_button = gr.Button("Generate Image", size='sm', scale=3)
+                    cancel_button = gr.Button("Cancel", size='sm', variant='stop', scale=1)
                 output_prompt = gr.Textbox(label="Generated Prompt", placeholder="Prompt generated by LLM", interactive=False)
+                queue_status = gr.Textbox(label="Queue Status", interactive=False, visible=False)
                 info_output = gr.Textbox(label="Generation Info", visible=False)
                 with gr.Row(visible=False) as rating_row:
                     rating = gr.Slider(label="Image Rating (1-10)", minimum=1, maximum=10, step=0.5, value=5, interactive=True)
@@ -115,10 +197,12 @@ def create_image_generation_tab(image_type):
                     success_text = gr.Textbox(label="Logging Status", placeholder="", interactive=False)
 
             with gr.Column(scale=1):
-                output_image = gr.Image(label="Generated Image", elem_id=f"output-image-{image_type}", type="pil", width=512, height=600)
+                output_image = gr.Gallery(label="Generated Images", elem_id=f"output-image-{image_type}", columns=2, height=600, preview=True)
                 
 
-        image_bytes_state = gr.State(None)
+        images_state = gr.State([])
+        selected_image_state = gr.State(None)
+        job_state = gr.State(None)
 
         def _generate_image(image_type:str, img_model:str, prompt:str, negative_prompt:str, width:int, 
                             height:int, sampling_method:str, schedule_type:str, batch_count:int, batch_size:int, 
@@ -139,29 +223,77 @@ def create_image_generation_tab(image_type):
                 'use_4step_lora': sdxl_light_4s_lora,
                 'use_8step_lora': sdxl_light_8s_lora,
             }
-            pil_image, info, image_bytes = generate_image(image_type, img_model, prompt, negative_prompt, rmv_bg_checkbox, **parameters)
+            images = generate_image(image_type, img_model, prompt, negative_prompt, rmv_bg_checkbox, **parameters)
+            while True:
+                try:
+                    job, status, preview = next(images)
+                except StopIteration as finished:
+                    generated_images, error = finished.value
+                    break
+                gallery = [(preview, "Preview")] if preview is not None else gr.update()
+                yield (gallery,) + (gr.update(),) * 6 + (gr.update(value=status, visible=True), job)
 
-            if pil_image is not None:
-                return pil_image, info, image_bytes, gr.update(visible=True), gr.update(visible=True), gr.update(visible=True) # change the 1st gr.update to make info visible
+            if generated_images:
+                gallery = [(image['path'], f"Seed {image['seed']}") for image in generated_images]
+                first_image = generated_images[0]
+                yield gallery, first_image['info'], generated_images, first_image, gr.update(visible=True), gr.update(visible=True), gr.update(visible=True), gr.update(visible=False), None # change the 1st gr.update to make info visible
             else:
-                return None, info, None, gr.update(visible=False), gr.update(visible=False), gr.update(visible=False)
+                yield None, error, [], None, gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), None
+
+        def _cancel_image(job):
+            """
+            Frees the GPU for the next job: a queued job is dropped, a running one is interrupted
+            and shows what it has generated so far.
+            """
+            if job is None or not cancel_img(job):
+                return gr.update()
+            return gr.update(value="Cancelling...", visible=True)
+
+        def _select_image(generated_images, evt: gr.SelectData):
+            """
+            Makes the image clicked in the gallery the one that is rated and logged.
+            """
+            image = generated_images[evt.index]
+            return image['info'], image, gr.update(visible=False)
+
+        def _generate_prompt_and_image(image_type:str, form_id, prompt:str, llm_model:str, auto_generate:bool,
+                                       img_model:str, negative_prompt:str, *parameters):
+            """
+            Streams the prompt into the prompt text box. With `auto_generate`, the image is 
+            generated right after in the same event instead of a follow-up one.
+            """
+            prompt_text, error = None, None
+            for prompt_text, error in generate_prompt(image_type, form_id, prompt, llm_model):
+                yield prompt_text, gr.update(), error, gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gr.update()
+
+            if auto_generate and prompt_text and prompt_text != "Timeout":
+                for image_updates in _generate_image(image_type, img_model, prompt_text, negative_prompt, *parameters):
+                    yield prompt_text, *image_updates
 
-        def _log_image(image_bytes, rating, info, user, form_id):
+        def _generate_image_unless_done(auto_generate:bool, *inputs):
+            if auto_generate:
+                # the image was already generated together with the prompt
+                yield (gr.update(),) * 9
+                return
+            yield from _generate_image(*inputs)
+
+        def _log_image(selected_image, rating, user, form_id):
             """
-            Takes in image bytes, rating, and JSON formatted generation info.
+            Takes in the image selected in the gallery and its rating.
 
             Returns a string indicating whether or not the logging was successful
             Updates the visibility of log_result text box
             """
-            if image_bytes is None:
+            if selected_image is None:
                 return gr.update(value="No image to log. Please generate an image first.", visible=True)
             
-            image_name = json.loads(info.replace("\n", "\\n")).get('job_timestamp')
             if rating is None:
                 return gr.update(value="Please provide a rating.", visible=True)
 
             try:
-                log_result = log_image(image_bytes, image_name, rating, info, user, form_id=form_id)
+                with open(selected_image['path'], 'rb') as image_file:
+                    image_bytes = image_file.read()
+                log_result = log_image(image_bytes, selected_image['name'], rating, selected_image['info'], user, form_id=form_id)
                 return gr.update(value=log_result, visible=True)
             except Exception as e:
                 return gr.update(value=f"Error logging image: {str(e)}", visible=True)
@@ -223,26 +355,41 @@ def create_image_generation_tab(image_type):
             outputs=[img_width, img_height, sampling_method, schedule_type, cfg_scale, sampling_steps]
         )
 
+        image_parameters = [img_width, img_height, sampling_method, schedule_type, batch_count, batch_size,
+                            cfg_scale, seed, sampling_steps, rmv_bg_checkbox, use_detailed_hands_lora,
+                            use_white_bg_lora, use_sdxl_lightning_4step_lora, use_sdxl_lightning_8step_lora]
+
         generate_button.click(
-            generate_prompt,
+            _generate_prompt_and_image,
 
-            inputs=[gr.Textbox(value=image_type, visible=False), form_id, prompt, llm_model],
+            inputs=[gr.Textbox(value=image_type, visible=False), form_id, prompt, llm_model,
+                    auto_generate_checkbox, img_model, negative_prompt, *image_parameters],
 
-            outputs=[output_prompt, info_output]
+            outputs=[output_prompt, output_image, info_output, images_state, selected_image_state, rating_row, user_row, log_row, queue_status, job_state]
         ).then(
-            _generate_image,
+            _generate_image_unless_done,
 
-            inputs=[gr.Textbox(value=image_type, visible=False), img_model, output_prompt, negative_prompt,
-                    img_width, img_height, sampling_method, schedule_type, batch_count, batch_size,
-                    cfg_scale, seed, sampling_steps, rmv_bg_checkbox, use_detailed_hands_lora,
-                    use_white_bg_lora, use_sdxl_lightning_4step_lora, use_sdxl_lightning_8step_lora],
+            inputs=[auto_generate_checkbox, gr.Textbox(value=image_type, visible=False), img_model,
+                    output_prompt, negative_prompt, *image_parameters],
 
-            outputs=[output_image, info_output, image_bytes_state, rating_row, user_row, log_row]
+            outputs=[output_image, info_output, images_state, selected_image_state, rating_row, user_row, log_row, queue_status, job_state]
+        )
+
+        cancel_button.click(
+            _cancel_image,
+            inputs=[job_state],
+            outputs=[queue_status]
+        )
+
+        output_image.select(
+            _select_image,
+            inputs=[images_state],
+            outputs=[info_output, selected_image_state, success_row]
         )
 
         log_button.click(
             _log_image,
-            inputs=[image_bytes_state, rating, info_output, user, form_id],
+            inputs=[selected_image_state, rating, user, form_id],
             outputs=[success_text]
         ).then(
             lambda: gr.update(visible=True),
@@ -266,11 +413,19 @@ function refresh() {
     }
 }
 """
-with gr.Blocks(css=css, js=js_func, theme="bethecloud/storj_theme") as demo:
-    gr.Markdown("# AI Background and Avatar Generator")
-    
-    create_image_generation_tab("background")
-    create_image_generation_tab("avatar")
+def build_demo() -> gr.Blocks:
+    """
+    Builds the UI. Only called under `__main__`: a spawned background removal worker
+    imports this module as well and must not build every tab or fetch the theme.
+    """
+    with gr.Blocks(css=css, js=js_func, theme="bethecloud/storj_theme") as demo:
+        gr.Markdown("# AI Background and Avatar Generator")
+
+        create_image_generation_tab("background")
+        create_image_generation_tab("avatar")
+    return demo
 
 if __name__ == "__main__":
-    demo.launch(server_port=8080)
\ No newline at end of file
+    preload_prompts("prompts")
+    preload_background_removal()
+    build_demo().launch(server_port=8080)
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""
+Generates image prompts for many JotForm forms at once.
+
+Form IDs are read from a text file (one per line, blank lines and lines starting
+with '#' are skipped) and processed concurrently. Every result is appended to a
+JSONL file as soon as it is ready; form IDs that already have a prompt in that file
+are skipped, so an interrupted run can be resumed, and failed forms retried, by running
+the same command again. A prompt made without the logo colors because the logo chain
+failed is recorded with `"colors": false` and retried as well.
+
+Run from inside the jotform-img-gen directory:
+
+```
+python batch_prompts.py form_ids.txt --output prompts.jsonl --image-type background \
+    --model llama3-8b --concurrency 8 --groq-rpm 30 --openai-rpm 500
+```
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils import rate_limit
+from utils.prompt_constructor import get_prompt_and_colors_for_image_gen, set_stage_workers
+
+logging.basicConfig(level=logging.INFO)
+
+def read_form_ids(path: str) -> list:
+    form_ids = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                form_ids.append(int(line))
+    # keep the order of the file but process every form only once
+    return list(dict.fromkeys(form_ids))
+
+def read_done_form_ids(path: str) -> set:
+    """
+    Returns the form IDs that already have a prompt in the output file. Forms that
+    failed, or whose prompt was made without the logo colors because the logo chain
+    failed (`colors: false`), are retried. A partially written last line (e.g. after a
+    crash) is ignored.
+    """
+    done = set()
+    try:
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    if record.get('prompt') and record.get('colors') is not False:
+                        done.add(int(record['form_id']))
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return done
+
+def _generate(form_id: int, image_type: str, model: str) -> dict:
+    start = time.perf_counter()
+    record = {'form_id': form_id, 'image_type': image_type, 'model': model, 'prompt': None, 'colors': None, 'error': None}
+    try:
+        prompt, colors = get_prompt_and_colors_for_image_gen(f"prompts/{image_type}_img_prompt.txt", form_id, model)
+        if prompt == "Timeout":
+            record['error'] = "Timeout"
+        else:
+            record['prompt'] = prompt
+            record['colors'] = colors
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {str(e)}"
+    record['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('form_ids', help="text file with one form ID per line")
+    parser.add_argument('--output', '-o', required=True, help="JSONL file the results are appended to")
+    parser.add_argument('--image-type', choices=['background', 'avatar'], default='background')
+    parser.add_argument('--model', choices=['gpt-3.5-turbo', 'llama3-8b', 'llama3-70b', 'mixtral-8x7b'], default='llama3-8b')
+    parser.add_argument('--concurrency', type=int, default=8, help="number of forms processed at the same time")
+    parser.add_argument('--groq-rpm', type=float, default=None, help="maximum Groq requests per minute")
+    parser.add_argument('--openai-rpm', type=float, default=None, help="maximum OpenAI requests per minute")
+    parser.add_argument('--burst', type=int, default=1, help="requests allowed back to back before the rate limit applies")
+    args = parser.parse_args(argv)
+
+    rate_limit.set_rate_limit('groq', args.groq_rpm, burst=args.burst)
+    rate_limit.set_rate_limit('openai', args.openai_rpm, burst=args.burst)
+    # the title and the logo chain of every form run at the same time
+    set_stage_workers(2 * args.concurrency)
+
+    form_ids = read_form_ids(args.form_ids)
+    done = read_done_form_ids(args.output)
+    pending = [form_id for form_id in form_ids if form_id not in done]
+    logging.info(f"{len(form_ids)} forms, {len(form_ids) - len(pending)} already done, {len(pending)} to go.")
+
+    # finish a line left incomplete by a crash before appending
+    if os.path.exists(args.output) and os.path.getsize(args.output) > 0:
+        with open(args.output, 'rb+') as output:
+            output.seek(-1, 2)
+            if output.read(1) != b'\n':
+                output.write(b'\n')
+
+    failed = 0
+    with open(args.output, 'a') as output, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(_generate, form_id, args.image_type, args.model) for form_id in pending]
+        for i, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            failed += record['error'] is not None
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            output.flush()
+            if i % 50 == 0 or i == len(futures):
+                logging.info(f"{i}/{len(futures)} forms processed, {failed} failed.")
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Compares the latency of offline color naming against the LLM color description call.
+
+Run from inside the jotform-img-gen directory:
+
+```
+python benchmarks/bench_color_naming.py --runs 1000 --llm-runs 5
+```
+
+The LLM path needs OPENAI_API_KEY in the .env file and is skipped with `--llm-runs 0`.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.color_names import describe_colors_locally
+from utils.llm_inferences import openai_inference
+from utils.prompt_reader import read_prompts_from_file
+
+def _random_palette(rng: random.Random) -> list:
+    return [tuple(rng.randrange(256) for _ in range(3)) for _ in range(3)]
+
+def _report(name: str, timings: list):
+    timings_ms = sorted(t * 1000 for t in timings)
+    p95 = timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * 0.95))]
+    print(f"{name:>6}: runs={len(timings_ms)} p50={statistics.median(timings_ms):.3f}ms "
+          f"p95={p95:.3f}ms mean={statistics.fmean(timings_ms):.3f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=1000, help="number of offline naming runs")
+    parser.add_argument('--llm-runs', type=int, default=5, help="number of LLM naming runs")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    palettes = [_random_palette(rng) for _ in range(max(args.runs, args.llm_runs))]
+
+    timings = []
+    for palette in palettes[:args.runs]:
+        start = time.perf_counter()
+        describe_colors_locally(palette)
+        timings.append(time.perf_counter() - start)
+    _report('local', timings)
+
+    timings = []
+    for palette in palettes[:args.llm_runs]:
+        system_prompt, user_prompt = read_prompts_from_file(
+            "prompts/color_palette_prompt.txt", frequent_colors=palette, num_colors=len(palette)
+        )
+        start = time.perf_counter()
+        openai_inference(
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            model="gpt-3.5-turbo",
+            max_tokens=50,
+            temperature=0,
+            timeout_seconds=30
+        )
+        timings.append(time.perf_counter() - start)
+    if timings:
+        _report('llm', timings)
+
+    for palette in palettes[:3]:
+        print(f"{palette} -> {describe_colors_locally(palette)}")
+
+if __name__ == "__main__":
+    main()
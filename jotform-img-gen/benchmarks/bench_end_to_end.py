@@ -0,0 +1,565 @@
+"""
+Measures where a click on "Generate" spends its time, end to end and per stage, at
+different concurrency levels.
+
+Every simulated user runs the real code paths of the app: `generate_prompt` (JotForm
+title and properties, logo download, Pylette, the color description and prompt LLM
+calls), `generate_image` (txt2img through the scheduler and backend pool, optional
+background removal, writing the PNG) and `log_image` (Google auth, Sheets and Drive).
+The external services are local stand-ins with injected latency, so the numbers show
+the overhead of the app itself plus the latency you configure:
+
+    jotform   JotForm API                    GET  /form/{id}/questions, /form/{id}/properties
+    logo      logo file server               GET  /logo/{id}.png
+    openai    OpenAI chat completions        POST /v1/chat/completions (streamed or not)
+    groq      Groq chat completions          POST /openai/v1/chat/completions
+    a1111     AUTOMATIC1111 web UI           txt2img, progress, options; one generation at a time
+    google    Google OAuth, Sheets, Drive    token, spreadsheets, values, resumable upload
+
+Run from inside the jotform-img-gen directory:
+
+```
+python benchmarks/bench_end_to_end.py --concurrency 1,4,16 --requests 32 --output .cache/bench/e2e.json
+python benchmarks/bench_end_to_end.py --latency openai=800,a1111-image=2000 --image-type avatar --remove-background
+```
+
+Latencies are in milliseconds and vary by up to +-`--jitter`. LLM responses are
+streamed with `token` milliseconds between tokens after the first one. All stores
+(LLM responses, txt2img results, palettes) start empty and every request uses a new
+form, so each request is a cold one; use `--forms` to cycle through fewer forms.
+
+`--output` writes the configuration and, per concurrency level, the throughput and the
+count, errors, mean and p50/p95/p99 in seconds of every stage as JSON, so results of
+different commits can be compared. Logging is skipped with `--no-log` or when the
+Google client libraries are not installed.
+"""
+import os
+import re
+import sys
+import json
+import time
+import base64
+import atexit
+import random
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import PIL.Image
+import PIL.ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.image_backends import FakeBackend
+
+DEFAULT_LATENCY_MS = {
+    'jotform': 120,
+    'logo': 60,
+    'openai': 450,
+    'groq': 180,
+    'token': 10,
+    'a1111-call': 150,
+    'a1111-image': 900,
+    'google': 150,
+}
+
+_PROMPT = ("A friendly minimalist avatar of a smiling support agent, flat vector illustration, "
+           "soft lighting, clean shapes, centered composition, plain background")
+
+class _StubServer:
+    """
+    Base of the stand-ins: a threaded HTTP/1.1 server with keep-alive whose handlers
+    sleep the configured latency before answering.
+    """
+    def __init__(self, latency_ms: dict, jitter: float):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub._count()
+                stub.handle(self, 'GET', None)
+
+            def do_POST(self):
+                stub._count()
+                stub.handle(self, 'POST', self._body())
+
+            def do_PUT(self):
+                stub._count()
+                stub.handle(self, 'PUT', self._body())
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # clients closing keep-alive connections are not errors of the stand-in
+                if not isinstance(sys.exc_info()[1], ConnectionError):
+                    super().handle_error(request, client_address)
+
+        self._lock = threading.Lock()
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _count(self):
+        with self._lock:
+            self.requests += 1
+
+    def delay(self, name: str, factor: float = 1.0):
+        milliseconds = self.latency_ms[name] * factor
+        time.sleep(max(0.0, milliseconds * (1 + random.uniform(-self.jitter, self.jitter))) / 1000)
+
+    @staticmethod
+    def send(handler, body, status: int = 200, content_type: str = 'application/json', headers: dict | None = None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def handle(self, handler, method: str, body: bytes | None):
+        raise NotImplementedError
+
+class JotFormStub(_StubServer):
+    def __init__(self, latency_ms, jitter, logo_url: str):
+        super().__init__(latency_ms, jitter)
+        self.logo_url = logo_url
+
+    def handle(self, handler, method, body):
+        self.delay('jotform')
+        match = re.match(r'/form/(\d+)/(questions|properties)', urlparse(handler.path).path)
+        if not match:
+            return self.send(handler, {'message': 'not found'}, status=404)
+        form_id, resource = match.groups()
+        if resource == 'questions':
+            content = {'1': {'text': f"Customer Feedback Survey {form_id}", 'type': 'control_head'}}
+        else:
+            content = {'styleJSON': str({'@formCoverImg': f"{self.logo_url}/logo/{form_id}.png"})}
+        self.send(handler, {'responseCode': 200, 'content': content})
+
+class LogoStub(_StubServer):
+    """
+    Serves a 256x256 PNG logo in three colors derived from the form ID, so every form
+    has its own palette.
+    """
+    def handle(self, handler, method, body):
+        self.delay('logo')
+        form_id = int(re.sub(r'\D', '', urlparse(handler.path).path) or 0)
+        rng = random.Random(form_id)
+        image = PIL.Image.new('RGB', (256, 256), tuple(rng.randrange(256) for _ in range(3)))
+        image.paste(tuple(rng.randrange(256) for _ in range(3)), (0, 0, 256, 96))
+        image.paste(tuple(rng.randrange(256) for _ in range(3)), (64, 128, 192, 224))
+        # anti-aliased edges, so the logo has more distinct colors than palette entries
+        image = image.filter(PIL.ImageFilter.SMOOTH_MORE)
+        buffer = BytesIO()
+        image.save(buffer, format='PNG')
+        self.send(handler, buffer.getvalue(), content_type='image/png', headers={'ETag': f'"{form_id}"'})
+
+class ChatCompletionsStub(_StubServer):
+    """
+    OpenAI-compatible chat completions. Calls whose system prompt asks for JSON get color
+    descriptions, all others an image prompt, streamed token by token if requested.
+    """
+    def __init__(self, latency_ms, jitter, latency_name: str):
+        super().__init__(latency_ms, jitter)
+        self.latency_name = latency_name
+
+    def handle(self, handler, method, body):
+        request = json.loads(body)
+        if 'JSON' in request['messages'][0]['content']:
+            content = json.dumps({'1': 'Dark blue', '2': 'Warm orange', '3': 'Soft white'})
+        else:
+            content = _PROMPT
+        model = request.get('model')
+        self.delay(self.latency_name)
+
+        if not request.get('stream'):
+            return self.send(handler, {
+                'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+            })
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+
+        def _write(event: str):
+            data = event.encode('utf-8')
+            handler.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            handler.wfile.flush()
+
+        tokens = re.findall(r'\S+\s*', content)
+        for index, token in enumerate(tokens):
+            if index:
+                self.delay('token')
+            chunk = {
+                'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}],
+            }
+            _write(f"data: {json.dumps(chunk)}\n\n")
+        _write("data: [DONE]\n\n")
+        handler.wfile.write(b"0\r\n\r\n")
+
+class A1111Stub(_StubServer):
+    """
+    The txt2img API of the web UI. Generations run one at a time like on a GPU and take
+    `a1111-call` plus `a1111-image` per image; the images are rendered by `FakeBackend`.
+    """
+    def __init__(self, latency_ms, jitter):
+        super().__init__(latency_ms, jitter)
+        self._gpu = threading.Lock()
+        self._images = {}
+        self._images_lock = threading.Lock()
+        self._checkpoint = 'sd_xl_turbo_1.0_fp16.safetensors'
+
+    def _image(self, width: int, height: int) -> str:
+        # rendering every image would measure the stand-in, one image per size is enough
+        with self._images_lock:
+            if (width, height) not in self._images:
+                png = FakeBackend.render(_PROMPT, '', 0, width, height)
+                self._images[(width, height)] = base64.b64encode(png).decode('ascii')
+            return self._images[(width, height)]
+
+    def handle(self, handler, method, body):
+        path = urlparse(handler.path).path
+        if path == '/sdapi/v1/options':
+            return self.send(handler, {'sd_model_checkpoint': self._checkpoint})
+        if path == '/sdapi/v1/progress':
+            return self.send(handler, {'progress': 0, 'eta_relative': 0, 'state': {}, 'current_image': None})
+        if path == '/sdapi/v1/interrupt':
+            return self.send(handler, {})
+        if path != '/sdapi/v1/txt2img':
+            return self.send(handler, {'detail': 'Not Found'}, status=404)
+
+        payload = json.loads(body)
+        images = int(payload.get('batch_size') or 1) * int(payload.get('n_iter') or 1)
+        if payload.get('script_args'):
+            images = len(payload['script_args'][-1].splitlines())
+        with self._gpu:
+            self._checkpoint = payload.get('override_settings', {}).get('sd_model_checkpoint', self._checkpoint)
+            self.delay('a1111-call')
+            self.delay('a1111-image', images)
+
+        seed = payload.get('seed', -1)
+        seed = random.randrange(2 ** 32) if seed is None or seed < 0 else seed
+        width, height = int(payload.get('width', 512)), int(payload.get('height', 512))
+        self.send(handler, {
+            'images': [self._image(width, height)] * images,
+            'info': json.dumps({
+                'prompt': payload.get('prompt'), 'negative_prompt': payload.get('negative_prompt'),
+                'seed': seed, 'all_seeds': [seed + i for i in range(images)], 'width': width, 'height': height,
+                'sampler_name': payload.get('sampler_name'), 'cfg_scale': payload.get('cfg_scale'),
+                'steps': payload.get('steps'), 'sd_model_name': self._checkpoint.split('.')[0],
+                'job_timestamp': time.strftime('%Y%m%d%H%M%S'), 'index_of_first_image': 0,
+            }),
+        })
+
+class GoogleStub(_StubServer):
+    """
+    OAuth token endpoint, the Sheets calls of `log_image` and Drive's resumable upload.
+    """
+    def __init__(self, latency_ms, jitter):
+        super().__init__(latency_ms, jitter)
+        self._state_lock = threading.Lock()
+        self._sheets = {}
+        self._uploads = 0
+
+    def _sheet(self, range_: str) -> dict:
+        return self._sheets.setdefault(range_.split('!')[0], {'sheetId': len(self._sheets) + 1, 'rows': []})
+
+    def handle(self, handler, method, body):
+        self.delay('google')
+        url = urlparse(handler.path)
+        path = unquote(url.path)
+
+        with self._state_lock:
+            if path == '/token':
+                return self.send(handler, {'access_token': 'stub-token', 'expires_in': 3600, 'token_type': 'Bearer'})
+
+            if path.startswith('/upload/drive/v3/files'):
+                if 'upload_id' not in parse_qs(url.query):
+                    self._uploads += 1
+                    location = f"{self.url}/upload/drive/v3/files?uploadType=resumable&upload_id={self._uploads}"
+                    return self.send(handler, {}, headers={'Location': location})
+                return self.send(handler, {'id': f"stub-file-{parse_qs(url.query)['upload_id'][0]}"})
+
+            match = re.match(r'/v4/spreadsheets/([^/:]+)(?::batchUpdate|/values/([^:]+)(:append)?)?$', path)
+            if not match:
+                return self.send(handler, {'error': {'code': 404, 'message': path}}, status=404)
+            _, range_, append = match.groups()
+
+            if range_ is None and method == 'GET':
+                sheets = [{'properties': {'title': title, 'sheetId': sheet['sheetId']}} for title, sheet in self._sheets.items()]
+                return self.send(handler, {'sheets': sheets})
+            if range_ is None:
+                replies = []
+                for request in json.loads(body).get('requests', []):
+                    if 'addSheet' in request:
+                        sheet = self._sheet(request['addSheet']['properties']['title'])
+                        replies.append({'addSheet': {'properties': {'sheetId': sheet['sheetId']}}})
+                    else:
+                        replies.append({})
+                return self.send(handler, {'replies': replies})
+
+            sheet = self._sheet(range_)
+            if method == 'GET':
+                return self.send(handler, {'range': range_, 'values': sheet['rows']})
+            values = json.loads(body).get('values', [])
+            if append:
+                sheet['rows'].extend(values)
+            elif values:
+                sheet['rows'][:1] = values[:1]
+            return self.send(handler, {'updates': {'updatedCells': sum(len(row) for row in values)}})
+
+def _service_account_file(directory: str, token_uri: str) -> str:
+    """
+    Writes a service account key file whose token URI is the Google stand-in.
+    """
+    try:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_key = key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode('ascii')
+    except ImportError:
+        import rsa
+        private_key = rsa.newkeys(2048)[1].save_pkcs1().decode('ascii')
+
+    path = os.path.join(directory, 'bench_service_account.json')
+    with open(path, 'w') as file:
+        json.dump({
+            'type': 'service_account', 'project_id': 'bench', 'private_key_id': 'bench',
+            'private_key': private_key, 'client_email': 'bench@bench.iam.gserviceaccount.com',
+            'client_id': '1', 'token_uri': token_uri,
+        }, file)
+    return path
+
+def _logging_available() -> bool:
+    try:
+        import googleapiclient.discovery
+        import google.oauth2.service_account
+        return True
+    except ImportError:
+        return False
+
+def _start_stubs(latency_ms: dict, jitter: float, a1111_servers: int, work_dir: str, log: bool) -> dict:
+    """
+    Starts the stand-ins and points the app at them through its environment variables.
+    Must run before the app modules are imported, they read these variables on import.
+    """
+    logo = LogoStub(latency_ms, jitter)
+    stubs = {
+        'jotform': JotFormStub(latency_ms, jitter, logo.url),
+        'logo': logo,
+        'openai': ChatCompletionsStub(latency_ms, jitter, 'openai'),
+        'groq': ChatCompletionsStub(latency_ms, jitter, 'groq'),
+    }
+    a1111 = [A1111Stub(latency_ms, jitter) for _ in range(a1111_servers)]
+    for index, stub in enumerate(a1111):
+        stubs[f'a1111-{index}'] = stub
+
+    os.environ.update({
+        'JOTFORM_API_URL': stubs['jotform'].url,
+        'JOTFORM_API_KEY': 'stub',
+        'OPENAI_BASE_URL': f"{stubs['openai'].url}/v1",
+        'OPENAI_API_KEY': 'stub',
+        'GROQ_BASE_URL': stubs['groq'].url,
+        'GROQ_API_KEY': 'stub',
+        'A1111_URLS': ','.join(stub.url for stub in a1111),
+        'LLM_CACHE': '0',
+        'TXT2IMG_CACHE': '0',
+        'PALETTE_DB_PATH': os.path.join(work_dir, 'palettes.sqlite3'),
+        'COLOR_NAMING': 'llm',
+        'STAGE_TIMING': '1',
+    })
+
+    if log:
+        stubs['google'] = GoogleStub(latency_ms, jitter)
+        os.environ.update({
+            'GOOGLE_SHEETS_API_URL': f"{stubs['google'].url}/",
+            'GOOGLE_DRIVE_API_URL': f"{stubs['google'].url}/drive/v3/",
+            'SERVICE_ACCOUNT_FILE': _service_account_file(work_dir, f"{stubs['google'].url}/token"),
+            'SHEET_ID': 'bench-sheet',
+            'FOLDER_ID': 'bench-folder',
+        })
+    return stubs
+
+def _run_level(concurrency: int, requests: int, first_form: int, forms: int, args) -> dict:
+    from app import generate_prompt, generate_image
+    from utils.log_image import log_image
+    from utils import timing
+
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    errors = []
+    image_parameters = {
+        'width': args.width, 'height': args.height, 'sampling_method': 'Euler a', 'schedule_type': 'Automatic',
+        'batch_count': 1, 'batch_size': args.batch_size, 'cfg_scale': 1, 'seed': -1, 'sampling_steps': 1,
+        'use_detailed_hands_lora': False, 'use_white_bg_lora': False, 'use_4step_lora': False, 'use_8step_lora': False,
+    }
+
+    def _request(index: int):
+        form_id = first_form + (index % forms if forms else index)
+        started = time.perf_counter()
+
+        prompt, error = None, None
+        for prompt, error in generate_prompt(args.image_type, form_id, None, args.llm_model):
+            pass
+        if error or not prompt or prompt == "Timeout":
+            raise RuntimeError(error or f"prompt generation returned {prompt!r}")
+
+        images = generate_image(args.image_type, args.img_model, prompt, '', args.remove_background, **image_parameters)
+        while True:
+            try:
+                next(images)
+            except StopIteration as finished:
+                generated_images, error = finished.value
+                break
+        if error:
+            raise RuntimeError(error)
+
+        if args.log:
+            image = generated_images[0]
+            with open(image['path'], 'rb') as image_file:
+                result = log_image(image_file.read(), image['name'], 7, image['info'], 'bench', form_id=form_id)
+            if 'error' in result.lower():
+                raise RuntimeError(result)
+        for image in generated_images:
+            os.remove(image['path'])
+        timing.record('end_to_end', time.perf_counter() - started)
+
+    def _client():
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            try:
+                _request(index)
+            except Exception as e:
+                errors.append(str(e))
+
+    timing.reset_stage_timings()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=_client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    completed = requests - len(errors)
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'completed': completed,
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:5],
+        'elapsed_seconds': elapsed,
+        'requests_per_second': completed / elapsed,
+        'stages': timing.get_stage_timings(),
+    }
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _parse_latency(value: str) -> dict:
+    latency_ms = dict(DEFAULT_LATENCY_MS)
+    for item in filter(None, value.split(',')):
+        name, _, milliseconds = item.partition('=')
+        if name not in latency_ms:
+            raise argparse.ArgumentTypeError(f"unknown latency '{name}', choose from {', '.join(latency_ms)}")
+        latency_ms[name] = float(milliseconds)
+    return latency_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,4,16', help="comma separated numbers of concurrent users")
+    parser.add_argument('--requests', type=int, default=32, help="requests per concurrency level")
+    parser.add_argument('--forms', type=int, default=0, help="distinct form IDs to cycle through, 0 for a new form per request")
+    parser.add_argument('--latency', type=_parse_latency, default=dict(DEFAULT_LATENCY_MS),
+                        help=f"injected latencies in ms, e.g. openai=800,a1111-image=2000 (defaults: "
+                             f"{', '.join(f'{key}={value:g}' for key, value in DEFAULT_LATENCY_MS.items())})")
+    parser.add_argument('--jitter', type=float, default=0.2, help="relative random variation of the latencies")
+    parser.add_argument('--a1111-servers', type=int, default=1, help="number of simulated web UIs in the pool")
+    parser.add_argument('--image-type', choices=['avatar', 'background'], default='avatar')
+    parser.add_argument('--remove-background', action='store_true', help="run rembg on avatars, needs rembg and its model")
+    parser.add_argument('--llm-model', default='gpt-3.5-turbo', help="prompt model, e.g. gpt-3.5-turbo or llama3-8b")
+    parser.add_argument('--img-model', default='sd_xl_turbo_1.0_fp16')
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--no-log', dest='log', action='store_false', help="skip logging to Sheets and Drive")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the latency jitter")
+    parser.add_argument('--output', default=None, help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.log and not _logging_available():
+        print("Google client libraries are not installed, skipping log_image.")
+        args.log = False
+
+    # the service account key and the palette database of this run
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+    atexit.register(shutil.rmtree, work_dir, ignore_errors=True)
+    stubs = _start_stubs(args.latency, args.jitter, args.a1111_servers, work_dir, args.log)
+    # the app configures logging on import
+    import app  # noqa: F401
+    logging.getLogger().setLevel(logging.WARNING)
+
+    levels = [int(level) for level in args.concurrency.split(',') if level]
+    results = []
+    for number, concurrency in enumerate(levels):
+        result = _run_level(concurrency, args.requests, first_form=(number + 1) * 1_000_000, forms=args.forms, args=args)
+        results.append(result)
+
+        print(f"\nconcurrency={concurrency}: {result['completed']}/{result['requests']} requests in "
+              f"{result['elapsed_seconds']:.1f}s, {result['requests_per_second']:.2f} requests/s")
+        for error in result['error_samples']:
+            print(f"  error: {error}")
+        print(f"  {'stage':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, stage in sorted(result['stages'].items(), key=lambda item: -item[1]['p50']):
+            print(f"  {name:<20}{stage['count']:>7}{stage['p50'] * 1000:>10.0f}{stage['p95'] * 1000:>10.0f}{stage['p99'] * 1000:>10.0f}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as file:
+            json.dump({
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'git_commit': _git_commit(),
+                'python': platform.python_version(),
+                'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                'stub_requests': {name: stub.requests for name, stub in stubs.items()},
+                'levels': results,
+            }, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
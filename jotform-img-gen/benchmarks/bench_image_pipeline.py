@@ -0,0 +1,144 @@
+"""
+Compares the decodes, encodes, peak memory and latency per generated image of the
+byte-passing image flow with the `PipelineImage` flow.
+
+The byte-passing flow is how a txt2img image used to reach the browser: base64 decode,
+background removal on bytes (decode, process, encode), re-opening the result with PIL
+for the output component, and Gradio encoding that PIL image again. The pipeline flow
+decodes at most once, hands the decoded image to background removal and encodes once.
+
+Run from inside the jotform-img-gen directory:
+
+```
+python benchmarks/bench_image_pipeline.py --runs 20 --width 832 --height 1216 --stage alpha
+```
+
+`--stage rembg` uses the real background removal and needs rembg and its model;
+`--stage alpha` stands in for it with a cheap PIL operation, so the numbers show the
+pipeline overhead only; `--stage none` measures an image without background removal.
+
+Peak memory is measured with tracemalloc and covers Python allocations such as encoded
+bytes and buffers; the pixel memory of decoded PIL images is not included, but each
+decode avoided saves width x height x channels bytes on top of it.
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+import statistics
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+import PIL.Image
+import PIL.ImageFile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.pipeline_image import PipelineImage
+
+_counts = {'decodes': 0, 'encodes': 0}
+
+def _count_codec_calls():
+    load, save = PIL.ImageFile.ImageFile.load, PIL.Image.Image.save
+
+    def _load(self, *args, **kwargs):
+        # load() is called again on an already decoded image, only count real decodes
+        if getattr(self, 'tile', None):
+            _counts['decodes'] += 1
+        return load(self, *args, **kwargs)
+
+    def _save(self, *args, **kwargs):
+        _counts['encodes'] += 1
+        return save(self, *args, **kwargs)
+
+    PIL.ImageFile.ImageFile.load = _load
+    PIL.Image.Image.save = _save
+
+def _txt2img_response_image(width: int, height: int, seed: int) -> str:
+    """
+    Returns a base64 PNG that compresses like a generated image: smooth gradients plus noise.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    pixels = np.clip(pixels + rng.integers(-12, 12, pixels.shape), 0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    PIL.Image.fromarray(pixels).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+def _alpha_stage(image: PIL.Image.Image) -> PIL.Image.Image:
+    result = image.convert('RGBA')
+    result.putalpha(image.convert('L'))
+    return result
+
+def _stage(name: str):
+    if name == 'rembg':
+        from rembg import remove
+        return remove
+    if name == 'alpha':
+        return _alpha_stage
+    return None
+
+def _bytes_flow(image_b64: str, stage) -> bytes:
+    image_bytes = base64.b64decode(image_b64)
+    if stage is not None:
+        # rembg.remove(bytes): decode, process, encode
+        image = PIL.Image.open(BytesIO(image_bytes))
+        image.load()
+        buffer = BytesIO()
+        stage(image).save(buffer, format='PNG')
+        image_bytes = buffer.getvalue()
+    # PIL.Image.open(BytesIO(...)) for the gr.Image output
+    image = PIL.Image.open(BytesIO(image_bytes))
+    image.load()
+    # Gradio encodes the PIL image again to send it to the browser
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def _pipeline_flow(image_b64: str, stage) -> bytes:
+    image = PipelineImage.from_base64(image_b64)
+    if stage is not None:
+        image = PipelineImage(image=stage(image.pil()))
+    # written to a file that Gradio serves as is
+    return image.encode('PNG')
+
+def _measure(flow, image_b64: str, stage, runs: int) -> dict:
+    timings = []
+    _counts.update(decodes=0, encodes=0)
+    for _ in range(runs):
+        start = time.perf_counter()
+        flow(image_b64, stage)
+        timings.append(time.perf_counter() - start)
+    counts = {key: value / runs for key, value in _counts.items()}
+
+    tracemalloc.start()
+    flow(image_b64, stage)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'p50_ms': statistics.median(timings) * 1000, 'peak_mb': peak / 2 ** 20, **counts}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--width', type=int, default=832)
+    parser.add_argument('--height', type=int, default=1216)
+    parser.add_argument('--stage', choices=['rembg', 'alpha', 'none'], default='alpha',
+                        help="background removal stage between txt2img and the output")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    _count_codec_calls()
+    image_b64 = _txt2img_response_image(args.width, args.height, args.seed)
+    stage = _stage(args.stage)
+    print(f"{args.width}x{args.height} PNG ({len(image_b64) * 3 // 4 / 2 ** 20:.2f} MB), stage={args.stage}, runs={args.runs}")
+
+    for name, flow in (('bytes', _bytes_flow), ('pipeline', _pipeline_flow)):
+        result = _measure(flow, image_b64, stage, args.runs)
+        print(f"{name:>8}: decodes={result['decodes']:.0f} encodes={result['encodes']:.0f} "
+              f"peak={result['peak_mb']:.1f}MB p50={result['p50_ms']:.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Measures txt2img throughput and latency with and without micro-batching of compatible
+requests (same checkpoint, size, sampler, steps, ...; different prompts and seeds).
+
+Clients submit single image requests in a closed loop through the checkpoint scheduler,
+once with every request as its own call and once with up to `--max-batch` compatible
+requests merged into one call of the "Prompts from file or textbox" script.
+
+Run from inside the jotform-img-gen directory, against a web UI:
+
+```
+python benchmarks/bench_micro_batch.py --url http://127.0.0.1:7860 --clients 8 --requests 64 --max-batch 8
+```
+
+or, without a GPU, against a simulated web UI that takes `--call-ms` per call plus
+`--image-ms` per image:
+
+```
+python benchmarks/bench_micro_batch.py --clients 8 --requests 64 --max-batch 8 --call-ms 150 --image-ms 300
+```
+
+The web UI runs the lines of the prompts script one after the other, so batching saves
+the per-call work (HTTP, payload parsing, applying and restoring override settings,
+encoding the response) and queue round trips, not sampling time.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import logging
+import argparse
+import threading
+import statistics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import micro_batch
+from utils.a1111_pool import BackendPool
+from utils.checkpoint_scheduler import CheckpointScheduler
+from utils.local_img_generation import build_txt2img_payload
+
+# smallest valid PNG, the simulated web UI does not render anything
+_PIXEL_PNG = base64.b64encode(bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082'
+)).decode('ascii')
+
+def _simulated_web_ui(call_ms: float, image_ms: float) -> str:
+    gpu = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if 'options' in self.path:
+                self._send({'sd_model_checkpoint': 'sd_xl_turbo_1.0_fp16.safetensors'})
+            else:
+                self._send({'progress': 0, 'state': {}, 'current_image': None})
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if payload.get('script_name') == micro_batch.PROMPTS_SCRIPT:
+                lines = payload['script_args'][-1].splitlines()
+            else:
+                lines = [payload.get('prompt', '')]
+            # one generation at a time, like the web UI
+            with gpu:
+                time.sleep((call_ms + image_ms * len(lines)) / 1000)
+            seeds = list(range(len(lines)))
+            self._send({
+                'images': [_PIXEL_PNG] * len(lines),
+                'info': json.dumps({'seed': 0, 'all_seeds': seeds, 'all_prompts': lines, 'infotexts': lines}),
+            })
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def _run(url: str, clients: int, requests: int, max_batch: int, window: float) -> dict:
+    pool = BackendPool([url])
+
+    def _run_batch(jobs):
+        payloads = [job.payload for job in jobs]
+        return micro_batch.split_response(pool.txt2img(micro_batch.merge_payloads(payloads)), payloads)
+
+    scheduler = CheckpointScheduler(
+        run_job=lambda job: pool.txt2img(job.payload),
+        batch_key=micro_batch.batch_key,
+        run_batch=_run_batch,
+        max_batch=max_batch,
+        batch_window=window
+    )
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    latencies = []
+
+    def _client():
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            payload = build_txt2img_payload(
+                "sd_xl_turbo_1.0_fp16", f"a mountain landscape, variation {index}", "",
+                seed=index, sampling_method="Euler a", schedule_type="Automatic", batch_size=1,
+                batch_count=1, sampling_steps=1, cfg_scale=1, width=512, height=512
+            )
+            start = time.perf_counter()
+            scheduler.submit(payload).result()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        'images_per_second': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies_ms),
+        'p95_ms': latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.95))],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help="web UI to benchmark, a simulated one is used if omitted")
+    parser.add_argument('--clients', type=int, default=8, help="number of concurrent clients")
+    parser.add_argument('--requests', type=int, default=64, help="total number of single image requests")
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--window', type=float, default=0.05, help="seconds to wait for compatible requests")
+    parser.add_argument('--call-ms', type=float, default=150, help="simulated work per call")
+    parser.add_argument('--image-ms', type=float, default=300, help="simulated work per image")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    url = args.url or _simulated_web_ui(args.call_ms, args.image_ms)
+
+    for name, max_batch in (('unbatched', 1), ('batched', args.max_batch)):
+        result = _run(url, args.clients, args.requests, max_batch, args.window)
+        print(f"{name:>9}: {result['images_per_second']:.2f} images/s "
+              f"p50={result['p50_ms']:.0f}ms p95={result['p95_ms']:.0f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Measures the throughput of batched background removal (`RembgSessionPool.remove_batch`)
+against removing the same images one at a time, as for the avatars of a txt2img batch
+of `--batch-sizes` images.
+
+For every batch size it reports the time per image of both paths and the peak resident
+memory of the process so far, which helps to choose `REMBG_MAX_BATCH_MB`: a batch is
+split into inferences of at most `max_batch` images, printed at the start (1 if the
+model has a fixed batch dimension).
+
+Run from inside the jotform-img-gen directory:
+
+```
+python benchmarks/bench_rembg_batch.py --model u2net --batch-sizes 1,2,4,8 --runs 3
+python benchmarks/bench_rembg_batch.py --model u2netp --fast --max-batch-mb 4096
+```
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rembg_sessions import RembgSessionPool, MODELS
+from benchmarks.bench_rembg_fast import _synthetic_avatar
+
+def _timed(function, runs: int) -> float:
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=list(MODELS), default='u2net')
+    parser.add_argument('--batch-sizes', default='1,2,4,8')
+    parser.add_argument('--width', type=int, default=832)
+    parser.add_argument('--height', type=int, default=1216)
+    parser.add_argument('--runs', type=int, default=3, help="runs per batch size and path, the median is reported")
+    parser.add_argument('--threads', type=int, default=0, help="ONNX Runtime threads, 0 for all cores")
+    parser.add_argument('--max-batch-mb', type=int, default=int(os.getenv('REMBG_MAX_BATCH_MB', '1024')))
+    parser.add_argument('--fast', action='store_true', help="compare remove_fast instead of remove")
+    args = parser.parse_args()
+
+    pool = RembgSessionPool(args.model, size=1, threads=args.threads, max_batch_mb=args.max_batch_mb)
+    remove = pool.remove_fast if args.fast else pool.remove
+    print(f"model={args.model}, {args.width}x{args.height}, max_batch={pool.max_batch}, "
+          f"mode={'fast' if args.fast else 'full'}, runs={args.runs}")
+    print(f"{'images':>7}{'sequential ms/img':>19}{'batched ms/img':>16}{'speedup':>9}{'peak RSS MB':>13}")
+
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        images = [_synthetic_avatar(args.width, args.height, seed) for seed in range(batch_size)]
+        sequential = _timed(lambda: [remove(image) for image in images], args.runs) / batch_size
+        batched = _timed(lambda: pool.remove_batch(images, fast=args.fast), args.runs) / batch_size
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{batch_size:>7}{sequential * 1000:>19.1f}{batched * 1000:>16.1f}"
+              f"{sequential / batched:>8.2f}x{peak_mb:>13.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compares the full resolution background removal (`rembg.remove`, `REMBG_MODE=full`)
+with the fast mode (`RembgSessionPool.remove_fast`, `REMBG_MODE=fast`), which predicts
+the mask on a downscaled image and upsamples the alpha matte with a guided filter.
+
+For every image it reports the latency of both paths and how close the fast matte is to
+the full one: the IoU of the foreground (alpha above 127) and the mean absolute alpha
+difference. Pass real avatars with `--images` to judge quality; without them, synthetic
+images with a soft edged subject on a noisy background are used, which are only
+meaningful for speed.
+
+Run from inside the jotform-img-gen directory:
+
+```
+python benchmarks/bench_rembg_fast.py --model u2net --images "avatars/*.png" --runs 5
+python benchmarks/bench_rembg_fast.py --model isnet --sizes 1024x1024,832x1216
+```
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import statistics
+
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+import PIL.ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rembg_sessions import RembgSessionPool, MODELS
+
+def _synthetic_avatar(width: int, height: int, seed: int) -> PIL.Image.Image:
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 90, (height, width, 3), dtype=np.uint8)
+    image = PIL.Image.fromarray(background, 'RGB')
+    subject = PIL.Image.new('L', (width, height), 0)
+    PIL.ImageDraw.Draw(subject).ellipse((width * 0.25, height * 0.15, width * 0.75, height * 0.95), fill=255)
+    subject = subject.filter(PIL.ImageFilter.GaussianBlur(3))
+    image.paste(PIL.Image.new('RGB', (width, height), (220, 180, 150)), mask=subject)
+    return image
+
+def _timed(function, image: PIL.Image.Image, runs: int) -> tuple:
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function(image)
+        latencies.append(time.perf_counter() - started)
+    return result, statistics.median(latencies) * 1000
+
+def _compare(full: PIL.Image.Image, fast: PIL.Image.Image) -> tuple:
+    full_alpha = np.asarray(full.getchannel('A'), dtype=np.float32)
+    fast_alpha = np.asarray(fast.getchannel('A'), dtype=np.float32)
+    full_mask, fast_mask = full_alpha > 127, fast_alpha > 127
+    union = np.logical_or(full_mask, fast_mask).sum()
+    iou = np.logical_and(full_mask, fast_mask).sum() / union if union else 1.0
+    return iou, np.abs(full_alpha - fast_alpha).mean() / 255
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=list(MODELS), default='u2net')
+    parser.add_argument('--images', default=None, help="glob of images to process, synthetic ones are used if omitted")
+    parser.add_argument('--sizes', default='1024x1024,832x1216', help="sizes of the synthetic images")
+    parser.add_argument('--runs', type=int, default=5, help="runs per image and path, the median is reported")
+    parser.add_argument('--threads', type=int, default=0, help="ONNX Runtime threads, 0 for all cores")
+    args = parser.parse_args()
+
+    if args.images:
+        images = [(os.path.basename(path), PIL.Image.open(path).convert('RGB')) for path in sorted(glob.glob(args.images))]
+    else:
+        sizes = [tuple(int(value) for value in size.split('x')) for size in args.sizes.split(',')]
+        images = [(f"synthetic {width}x{height}", _synthetic_avatar(width, height, seed))
+                  for seed, (width, height) in enumerate(sizes)]
+
+    pool = RembgSessionPool(args.model, size=1, threads=args.threads)
+    print(f"model={args.model}, runs={args.runs}")
+    print(f"{'image':>24}{'full ms':>10}{'fast ms':>10}{'speedup':>9}{'IoU':>8}{'alpha MAE':>11}")
+    speedups, ious = [], []
+    for name, image in images:
+        full, full_ms = _timed(pool.remove, image, args.runs)
+        fast, fast_ms = _timed(pool.remove_fast, image, args.runs)
+        iou, mae = _compare(full, fast)
+        speedups.append(full_ms / fast_ms)
+        ious.append(iou)
+        print(f"{name[-24:]:>24}{full_ms:>10.0f}{fast_ms:>10.0f}{full_ms / fast_ms:>8.2f}x{iou:>8.3f}{mae:>11.4f}")
+    print(f"{'median':>24}{'':>20}{statistics.median(speedups):>8.2f}x{statistics.median(ious):>8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares the background removal models by load time, per-call latency and memory, so
+quality can be traded for speed with `REMBG_MODEL`.
+
+Every model is measured in its own process: the time to create a session (download the
+model first with `rembg d <model>`, otherwise the download is included), the warm-up
+inference, the latency of `--runs` calls on an avatar sized image, and the resident
+memory before and after. `--baseline` adds the old path, `rembg.remove` without a
+session, which loads u2net again on every call.
+
+Run from inside the jotform-img-gen directory:
+
+```
+python benchmarks/bench_rembg_models.py --models u2net,u2netp,isnet,silueta --runs 10 --threads 4
+python benchmarks/bench_rembg_models.py --image avatar.png --baseline
+```
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import multiprocessing
+
+import PIL.Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _rss_mb() -> float:
+    # resident set size of this process, Linux only
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+def _load_image(path: str | None, width: int, height: int) -> PIL.Image.Image:
+    if path:
+        return PIL.Image.open(path).convert('RGB')
+    from io import BytesIO
+    from utils.image_backends import FakeBackend
+    return PIL.Image.open(BytesIO(FakeBackend.render("avatar", "", 0, width, height))).convert('RGB')
+
+def _measure(model: str, image_path: str | None, width: int, height: int, runs: int, threads: int) -> dict:
+    from rembg import remove
+    from utils.rembg_sessions import create_session, warm_up
+
+    image = _load_image(image_path, width, height)
+    rss_before = _rss_mb()
+
+    if model == 'baseline':
+        load_seconds = warm_up_seconds = 0.0
+        call = lambda: remove(image)
+    else:
+        started = time.perf_counter()
+        session = create_session(model, threads)
+        load_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        warm_up(session)
+        warm_up_seconds = time.perf_counter() - started
+        call = lambda: remove(image, session=session)
+
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+
+    return {
+        'model': model,
+        'load_s': load_seconds,
+        'warm_up_s': warm_up_seconds,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        'rss_mb': _rss_mb() - rss_before,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', default='u2net,u2netp,isnet,silueta')
+    parser.add_argument('--image', default=None, help="image to process, a synthetic one is used if omitted")
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=0, help="ONNX Runtime threads per session, 0 for the default")
+    parser.add_argument('--baseline', action='store_true', help="also measure rembg.remove without a session")
+    args = parser.parse_args()
+
+    models = [model for model in args.models.split(',') if model]
+    if args.baseline:
+        models.append('baseline')
+
+    print(f"{args.width}x{args.height}, runs={args.runs}, threads={args.threads or 'default'}")
+    print(f"{'model':>10}{'load s':>9}{'warm-up s':>11}{'p50 ms':>9}{'p95 ms':>9}{'RSS MB':>9}")
+    # a new process per model, so the memory of one model does not count towards the next
+    context = multiprocessing.get_context('spawn')
+    for model in models:
+        with context.Pool(1) as pool:
+            result = pool.apply(_measure, (model, args.image, args.width, args.height, args.runs, args.threads))
+        print(f"{result['model']:>10}{result['load_s']:>9.2f}{result['warm_up_s']:>11.2f}"
+              f"{result['p50_ms']:>9.0f}{result['p95_ms']:>9.0f}{result['rss_mb']:>9.0f}")
+
+if __name__ == "__main__":
+    main()
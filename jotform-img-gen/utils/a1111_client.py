@@ -0,0 +1,112 @@
+import os
+import logging
+import threading
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Load the .env file
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+A1111_URL = os.getenv('A1111_URL', 'http://127.0.0.1:7860')
+A1111_CONNECT_TIMEOUT = float(os.getenv('A1111_CONNECT_TIMEOUT', '5'))
+# generations with many steps or large batches can take minutes
+A1111_READ_TIMEOUT = float(os.getenv('A1111_READ_TIMEOUT', '600'))
+A1111_RETRIES = int(os.getenv('A1111_RETRIES', '3'))
+A1111_POOL_SIZE = int(os.getenv('A1111_POOL_SIZE', '8'))
+
+# responses worth retrying for requests that are safe to repeat
+_RETRY_STATUSES = (502, 503, 504)
+
+class A1111Client:
+    """
+    Client for the API of AUTOMATIC1111's stable-diffusion-webui.
+
+    Connections are kept alive in a pool and reused between requests. Failed
+    connection attempts are retried for every request, since nothing reached the
+    server yet; read errors and 502/503/504 responses are only retried for
+    idempotent requests (GET), never for a txt2img call that may already be running.
+    Retries back off exponentially with jitter.
+
+    Args:
+        base_url (str): The URL of the web UI, e.g. 'http://127.0.0.1:7860'.
+        connect_timeout (float): Seconds to wait for a connection.
+        read_timeout (float): Seconds to wait for a response.
+        retries (int): Number of retries.
+        pool_size (int): Number of keep-alive connections.
+
+    Example:
+    ```
+    client = A1111Client("http://127.0.0.1:7860")
+    response = client.txt2img({"prompt": "a cat", "steps": 4})
+    images, info = response['images'], response['info']
+    ```
+    """
+    def __init__(
+            self,
+            base_url: str = A1111_URL,
+            connect_timeout: float = A1111_CONNECT_TIMEOUT,
+            read_timeout: float = A1111_READ_TIMEOUT,
+            retries: int = A1111_RETRIES,
+            pool_size: int = A1111_POOL_SIZE
+        ):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+            status_forcelist=_RETRY_STATUSES,
+            backoff_factor=0.5,
+            backoff_jitter=0.5,
+            raise_on_status=False
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+
+    def request(self, method: str, path: str, timeout: tuple | None = None, **kwargs) -> dict:
+        """
+        Sends a request to the web UI and returns the decoded JSON response.
+
+        Raises:
+            HTTPError: If the web UI responds with an error status.
+        """
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=timeout or self.timeout, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def txt2img(self, payload: dict) -> dict:
+        return self.request('POST', '/sdapi/v1/txt2img', json=payload)
+
+    def progress(self, skip_current_image: bool = True) -> dict:
+        return self.request(
+            'GET', '/sdapi/v1/progress',
+            params={'skip_current_image': str(skip_current_image).lower()},
+            timeout=(self.timeout[0], 10)
+        )
+
+    def interrupt(self):
+        self.request('POST', '/sdapi/v1/interrupt', timeout=(self.timeout[0], 10))
+
+    def options(self) -> dict:
+        return self.request('GET', '/sdapi/v1/options', timeout=(self.timeout[0], 30))
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> A1111Client:
+    """
+    Returns the shared client for the web UI at `A1111_URL`.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = A1111Client()
+    return _client
@@ -0,0 +1,227 @@
+import os
+import time
+import logging
+import threading
+import requests
+from typing import Callable
+from dotenv import load_dotenv
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ConnectTimeoutError
+
+from utils.a1111_client import A1111Client, A1111_URL
+
+# Load the .env file
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+# comma separated web UI URLs, e.g. 'http://gpu-1:7860,http://gpu-2:7860'
+A1111_URLS = [url.strip() for url in os.getenv('A1111_URLS', A1111_URL).split(',') if url.strip()]
+A1111_HEALTH_INTERVAL = float(os.getenv('A1111_HEALTH_INTERVAL', '10'))
+A1111_DRAIN_SECONDS = float(os.getenv('A1111_DRAIN_SECONDS', '30'))
+# outstanding requests a backend with the right checkpoint loaded is preferred over
+A1111_SWAP_PENALTY = float(os.getenv('A1111_SWAP_PENALTY', '2'))
+
+def checkpoint_name(title: str | None) -> str | None:
+    """
+    Turns a checkpoint title reported by the web UI into the name used in the UI dropdown.
+
+    Example:
+    ```
+    checkpoint_name("sdxl/sd_xl_base_1.0.safetensors [31e35c80fc]")
+    # Output: 'sd_xl_base_1.0'
+    ```
+    """
+    if not title:
+        return None
+    name = title.split(' [')[0].replace('\\', '/').rsplit('/', 1)[-1]
+    for extension in ('.safetensors', '.ckpt'):
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+def _never_reached_server(error: Exception) -> bool:
+    """
+    Returns whether a request failed before it was sent, so it can safely be sent to another backend.
+    """
+    reason = error.args[0] if error.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(error, requests.ConnectTimeout) or isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+class Backend:
+    """
+    One web UI instance of a `BackendPool` and what the pool knows about it.
+    """
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.client = A1111Client(url)
+        # health checks should fail fast instead of retrying
+        self.health_client = A1111Client(url, connect_timeout=2, read_timeout=5, retries=0, pool_size=1)
+        self.outstanding = 0
+        self.healthy = True
+        self.drained_until = 0.0
+        self.checkpoint = None
+        self.errors = 0
+
+    def available(self, now: float) -> bool:
+        return self.healthy and now >= self.drained_until
+
+class BackendPool:
+    """
+    Spreads txt2img requests over several AUTOMATIC1111 web UIs.
+
+    Each request goes to the available backend with the fewest outstanding requests,
+    counting `swap_penalty` extra requests for backends that would have to load another
+    checkpoint first. Backends are health checked every `health_interval` seconds
+    through `/sdapi/v1/progress`, which also refreshes their loaded checkpoint from
+    `/sdapi/v1/options`. A backend that fails a request or a health check is drained
+    for `drain_seconds`, during which it gets no new requests. Requests that never
+    reached a backend are sent to the next one.
+
+    Args:
+        urls (list): URLs of the web UIs.
+        health_interval (float): Seconds between health checks.
+        drain_seconds (float): Seconds a failing backend is left out.
+        swap_penalty (float): Outstanding requests a checkpoint swap is considered worth.
+
+    Example:
+    ```
+    pool = BackendPool(["http://gpu-1:7860", "http://gpu-2:7860"])
+    response = pool.txt2img(payload)
+    pool.stats()
+    # Output: [{'url': 'http://gpu-1:7860', 'healthy': True, 'draining': False, 'outstanding': 0, ...}, ...]
+    ```
+    """
+    def __init__(
+            self,
+            urls: list,
+            health_interval: float = A1111_HEALTH_INTERVAL,
+            drain_seconds: float = A1111_DRAIN_SECONDS,
+            swap_penalty: float = A1111_SWAP_PENALTY
+        ):
+        if not urls:
+            raise ValueError("At least one web UI URL is required.")
+        self.backends = [Backend(url) for url in urls]
+        self.health_interval = health_interval
+        self.drain_seconds = drain_seconds
+        self.swap_penalty = swap_penalty
+        self._lock = threading.Lock()
+
+        self._health_thread = threading.Thread(target=self._check_health_forever, name='a1111-health', daemon=True)
+        self._health_thread.start()
+
+    def __len__(self):
+        return len(self.backends)
+
+    def _check_health(self, backend: Backend):
+        try:
+            backend.health_client.progress()
+            checkpoint = checkpoint_name(backend.health_client.options().get('sd_model_checkpoint'))
+        except requests.RequestException as e:
+            if backend.healthy:
+                logging.warning(f"Web UI at {backend.url} failed its health check: {str(e)}")
+            with self._lock:
+                backend.healthy = False
+            return
+
+        with self._lock:
+            if not backend.healthy:
+                logging.info(f"Web UI at {backend.url} is healthy again.")
+            backend.healthy = True
+            # a running request may be loading another checkpoint right now
+            if backend.outstanding == 0:
+                backend.checkpoint = checkpoint
+
+    def _check_health_forever(self):
+        while True:
+            for backend in self.backends:
+                self._check_health(backend)
+            time.sleep(self.health_interval)
+
+    def _drain(self, backend: Backend, error: Exception):
+        with self._lock:
+            backend.errors += 1
+            backend.drained_until = time.monotonic() + self.drain_seconds
+        logging.warning(f"Draining web UI at {backend.url} for {self.drain_seconds:.0f} seconds: {str(error)}")
+
+    def _acquire(self, checkpoint: str | None, exclude: set) -> Backend | None:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [backend for backend in self.backends if backend not in exclude]
+            available = [backend for backend in candidates if backend.available(now)]
+            # rather try a drained backend than fail while all of them are down
+            candidates = available or candidates
+            if not candidates:
+                return None
+
+            def _load(backend):
+                swap = checkpoint is not None and backend.checkpoint != checkpoint
+                return backend.outstanding + (self.swap_penalty if swap else 0)
+
+            backend = min(candidates, key=_load)
+            backend.outstanding += 1
+            return backend
+
+    def txt2img(self, payload: dict, on_backend: Callable[[Backend], None] | None = None) -> dict:
+        """
+        Sends a txt2img payload to the best backend and returns its response.
+        `on_backend` is called with every backend the request is sent to.
+
+        Raises:
+            RequestException: If the request failed on every backend it could be sent to.
+        """
+        checkpoint = payload.get('override_settings', {}).get('sd_model_checkpoint')
+        tried = set()
+        last_error = None
+        while True:
+            backend = self._acquire(checkpoint, exclude=tried)
+            if backend is None:
+                raise last_error
+            tried.add(backend)
+            if on_backend is not None:
+                on_backend(backend)
+            try:
+                response = backend.client.txt2img(payload)
+            except requests.HTTPError as e:
+                # a 4xx response means the payload is wrong, not the backend
+                if e.response is not None and e.response.status_code >= 500:
+                    self._drain(backend, e)
+                raise
+            except requests.RequestException as e:
+                self._drain(backend, e)
+                if not _never_reached_server(e):
+                    raise
+                last_error = e
+                continue
+            else:
+                with self._lock:
+                    backend.checkpoint = checkpoint or backend.checkpoint
+                return response
+            finally:
+                with self._lock:
+                    backend.outstanding -= 1
+
+    def idle_checkpoints(self) -> set:
+        """
+        Returns the checkpoints loaded on available backends without outstanding requests.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                backend.checkpoint for backend in self.backends
+                if backend.available(now) and backend.outstanding == 0 and backend.checkpoint
+            }
+
+    def stats(self) -> list:
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    'url': backend.url,
+                    'healthy': backend.healthy,
+                    'draining': now < backend.drained_until,
+                    'outstanding': backend.outstanding,
+                    'checkpoint': backend.checkpoint,
+                    'errors': backend.errors,
+                }
+                for backend in self.backends
+            ]
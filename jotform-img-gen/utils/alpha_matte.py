@@ -0,0 +1,67 @@
+# opencv comes with rembg, its filters are several times faster than numpy and PIL on float images
+import cv2
+import numpy as np
+import PIL.Image
+
+def box_filter(values: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Returns the mean of every (2 * radius + 1)^2 window of a 2D float32 array, with the
+    borders reflected.
+    """
+    return cv2.blur(values, (2 * radius + 1, 2 * radius + 1))
+
+def _gray(image: PIL.Image.Image) -> np.ndarray:
+    return np.asarray(image.convert('L'), dtype=np.float32) / 255
+
+def _resize(values: np.ndarray, size: tuple) -> np.ndarray:
+    return cv2.resize(values, size, interpolation=cv2.INTER_LINEAR)
+
+def guided_upsample(
+        mask: PIL.Image.Image,
+        guide: PIL.Image.Image,
+        full_guide: PIL.Image.Image,
+        radius: int = 2,
+        eps: float = 1e-3
+    ) -> PIL.Image.Image:
+    """
+    Upsamples a low resolution alpha mask to the size of `full_guide` with the fast
+    guided filter (He and Sun, 2015): the local linear model alpha = a * I + b is fitted
+    at low resolution, where `guide` is the image the mask was predicted from, and the
+    smoothed coefficients are upsampled and applied to the full resolution image. Edges
+    of the matte follow the edges of the image instead of the blur of a plain resize.
+
+    Args:
+        mask (PIL.Image.Image): The predicted mask ('L'), the size of `guide`.
+        guide (PIL.Image.Image): The downscaled image the mask was predicted from.
+        full_guide (PIL.Image.Image): The image at full resolution.
+        radius (int): Window radius in low resolution pixels.
+        eps (float): Regularization, larger values smooth more and follow edges less.
+
+    Returns:
+        PIL.Image.Image: The alpha matte ('L') at the size of `full_guide`.
+
+    Example:
+    ```
+    small = image.resize((320, 320))
+    alpha = guided_upsample(session.predict(small)[0], small, image)
+    image.putalpha(alpha)
+    ```
+    """
+    guide_values = _gray(guide)
+    mask_values = np.asarray(mask.convert('L'), dtype=np.float32) / 255
+
+    mean_guide = box_filter(guide_values, radius)
+    mean_mask = box_filter(mask_values, radius)
+    covariance = box_filter(guide_values * mask_values, radius) - mean_guide * mean_mask
+    variance = box_filter(guide_values * guide_values, radius) - mean_guide * mean_guide
+
+    a = covariance / (variance + eps)
+    b = mean_mask - a * mean_guide
+    mean_a = _resize(box_filter(a, radius), full_guide.size)
+    mean_b = _resize(box_filter(b, radius), full_guide.size)
+
+    alpha = mean_a * _gray(full_guide)
+    alpha += mean_b
+    alpha *= 255
+    np.clip(alpha, 0, 255, out=alpha)
+    return PIL.Image.fromarray((alpha + 0.5).astype(np.uint8), 'L')
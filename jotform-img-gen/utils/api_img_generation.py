@@ -19,6 +19,8 @@ try:
 except ValueError as e:
     logging.info(str(e))
 
+DEFAULT_NEGATIVE_PROMPT = "(deformed, distorted, disfigured:1.3), poorly drawn, bad anatomy, wrong anatomy, extra limb, missing limb, floating limbs, (mutated hands and fingers:1.4), disconnected limbs, mutation, mutated, ugly, disgusting, blurry, amputation"
+
 def generate_img(
         prompt: str,
         model: Literal["dall-e-3", "dall-e-2", "sd3", "sdxl"] = "dall-e-3",
@@ -53,7 +55,7 @@ def generate_img(
     else:
         return generate_sdxl_image(prompt)
 
-def generate_sd3_image(prompt: str):
+def generate_sd3_image(prompt: str, negative_prompt: str = DEFAULT_NEGATIVE_PROMPT, seed: int = 0):
     try:
         NVIDIA_API_KEY = os.getenv("NVIDIA_API_KEY")
     except ValueError as e:
@@ -70,9 +72,9 @@ def generate_sd3_image(prompt: str):
         "prompt": f"{prompt}",
         "cfg_scale": 5,
         "aspect_ratio": "16:9",
-        "seed": 0,
+        "seed": seed,
         "steps": 30,
-        "negative_prompt": "(deformed, distorted, disfigured:1.3), poorly drawn, bad anatomy, wrong anatomy, extra limb, missing limb, floating limbs, (mutated hands and fingers:1.4), disconnected limbs, mutation, mutated, ugly, disgusting, blurry, amputation"
+        "negative_prompt": negative_prompt
     }
 
     response = requests.post(invoke_url, headers=headers, json=payload)
@@ -84,7 +86,7 @@ def generate_sd3_image(prompt: str):
 
     return image_bytes
 
-def generate_sdxl_image(prompt: str):
+def generate_sdxl_image(prompt: str, negative_prompt: str = DEFAULT_NEGATIVE_PROMPT, seed: int = 0):
     try:
         NVIDIA_API_KEY = os.getenv("NVIDIA_API_KEY")
     except ValueError as e:
@@ -104,13 +106,13 @@ def generate_sdxl_image(prompt: str):
                 "weight": 1
             },
             {
-                "text": "(deformed, distorted, disfigured:1.3), poorly drawn, bad anatomy, wrong anatomy, extra limb, missing limb, floating limbs, (mutated hands and fingers:1.4), disconnected limbs, mutation, mutated, ugly, disgusting, blurry, amputation",
+                "text": negative_prompt,
                 "weight": -1
             }
         ],
         "cfg_scale": 5,
         "sampler": "K_DPM_2_ANCESTRAL",
-        "seed": 0,
+        "seed": seed,
         "steps": 25
     }
 
@@ -123,12 +125,21 @@ def generate_sdxl_image(prompt: str):
 
     return image_bytes
 
-def stability_ai_inference(prompt: str):
+def stability_ai_inference(prompt: str, negative_prompt: str | None = None, seed: int | None = None):
     try:
         STABILITY_API_KEY = os.getenv("STABILITY_API_KEY")
     except ValueError as e:
         logging.info(str(e))
     
+    data = {
+        "prompt": f"{prompt}",
+        "output_format": "png",
+    }
+    if negative_prompt:
+        data["negative_prompt"] = negative_prompt
+    if seed is not None:
+        data["seed"] = seed
+
     response = requests.post(
         f"https://api.stability.ai/v2beta/stable-image/generate/sd3-medium",
         headers={
@@ -136,10 +147,7 @@ def stability_ai_inference(prompt: str):
             "accept": "application/json"
         },
         files={"none": ''},
-        data={
-            "prompt": f"{prompt}",
-            "output_format": "png",
-        },
+        data=data,
     )
 
     if response.status_code == 200:
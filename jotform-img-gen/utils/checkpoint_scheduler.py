@@ -0,0 +1,326 @@
+import time
+import logging
+import itertools
+import threading
+from concurrent.futures import Future, wait
+from typing import Callable, Hashable
+
+logging.basicConfig(level=logging.INFO)
+
+class Job:
+    """
+    A txt2img request waiting in, or taken from, a `CheckpointScheduler`.
+
+    Example:
+    ```
+    job = scheduler.submit(payload)
+    while not job.wait(timeout=0.5):
+        print(scheduler.describe(job))
+    response = job.result()
+    ```
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, payload: dict):
+        self.id = next(self._ids)
+        self.payload = payload
+        self.checkpoint = payload.get('override_settings', {}).get('sd_model_checkpoint')
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        # set by `run_job` to whatever runs the job, e.g. the web UI it was sent to
+        self.backend = None
+        # set when the job is stopped while it runs, its response then only holds partial results
+        self.interrupted = False
+        # the jobs this job was run together with, itself included
+        self.batch = None
+        self.batch_key = None
+        self.future = Future()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Waits up to `timeout` seconds and returns whether the job has finished.
+        """
+        done, _ = wait([self.future], timeout=timeout)
+        return bool(done)
+
+    def result(self, timeout: float | None = None):
+        return self.future.result(timeout=timeout)
+
+class CheckpointScheduler:
+    """
+    Queue in front of the txt2img API that runs jobs for the checkpoint that is already
+    loaded back to back, so the web UI swaps multi-GB checkpoints as rarely as possible.
+
+    `workers` jobs run at the same time, one per web UI. Whenever a worker is free,
+    the next job is picked in this order:
+    1. the oldest job that has waited longer than `max_wait` seconds, so no job starves,
+    2. the oldest job for a checkpoint that is already loaded,
+    3. the oldest job.
+
+    With `max_batch` above 1, queued jobs with the same `batch_key` as the picked job are
+    run together with it through `run_batch`, waiting up to `batch_window` seconds after
+    the picked job was submitted for more of them to arrive.
+
+    Run times and swap costs are learned from finished jobs and used to report each
+    waiting job's queue position, expected wait and expected swap cost.
+
+    Args:
+        run_job (Callable[[Job], dict]): Sends the txt2img payload of a job and returns the response.
+        max_wait (float): Seconds after which a job is run regardless of its checkpoint.
+        swap_cost (float): Assumed seconds to load a checkpoint until one was measured.
+        run_time (float): Assumed seconds for a job until one was measured.
+        workers (int): Number of jobs run at the same time.
+        warm_checkpoints (Callable[[], set] | None): Returns the checkpoints that are loaded
+              right now. Defaults to the checkpoint of the last job this scheduler ran.
+        batch_key (Callable[[dict], Hashable] | None): Returns a key that is equal for payloads
+              that can run together, or None for payloads that must run alone.
+        run_batch (Callable[[list], list] | None): Runs several jobs at once and returns
+              one response per job.
+        max_batch (int): Maximum number of jobs run together.
+        batch_window (float): Seconds to wait for more jobs to run together with a new one.
+
+    Example:
+    ```
+    scheduler = CheckpointScheduler(run_job=lambda job: client.txt2img(job.payload), max_wait=60)
+    job = scheduler.submit(payload)
+    response = job.result()
+    ```
+    """
+    def __init__(
+            self,
+            run_job: Callable[[Job], dict],
+            max_wait: float = 60,
+            swap_cost: float = 20,
+            run_time: float = 10,
+            workers: int = 1,
+            warm_checkpoints: Callable[[], set] | None = None,
+            batch_key: Callable[[dict], Hashable] | None = None,
+            run_batch: Callable[[list], list] | None = None,
+            max_batch: int = 1,
+            batch_window: float = 0.05
+        ):
+        self.run_job = run_job
+        self.max_wait = max_wait
+        self.default_swap_cost = swap_cost
+        self.default_run_time = run_time
+        self._warm_checkpoints = warm_checkpoints
+        self.batch_key = batch_key
+        self.run_batch = run_batch
+        self.max_batch = max_batch if batch_key is not None and run_batch is not None else 1
+        self.batch_window = batch_window
+        self._current_checkpoint = None
+        self.workers = workers
+        self._queue: list[Job] = []
+        self._running: list[Job] = []
+        self._condition = threading.Condition()
+        # exponential moving averages per checkpoint of run times with and without a swap
+        self._warm_run_time: dict[str, float] = {}
+        self._swap_run_time: dict[str, float] = {}
+        self._swaps = 0
+        self._jobs_run = 0
+
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f'checkpoint-scheduler-{i}', daemon=True).start()
+
+    def submit(self, payload: dict) -> Job:
+        job = Job(payload)
+        if self.max_batch > 1:
+            job.batch_key = self.batch_key(payload)
+        with self._condition:
+            self._queue.append(job)
+            # a worker collecting a batch may be waiting as well
+            self._condition.notify_all()
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        """
+        Removes a job that has not started yet. Returns whether it was removed.
+        """
+        with self._condition:
+            if job in self._queue:
+                self._queue.remove(job)
+                # a cancelled future only counts as done for `wait` once waiters are notified
+                job.future.cancel()
+                job.future.set_running_or_notify_cancel()
+                return True
+        return False
+
+    def warm_checkpoints(self) -> set:
+        if self._warm_checkpoints is not None:
+            return self._warm_checkpoints()
+        return {self._current_checkpoint} if self._current_checkpoint else set()
+
+    def _pick(self, queue: list, warm: set, now: float) -> Job:
+        starving = [job for job in queue if now - job.submitted_at > self.max_wait]
+        if starving:
+            return starving[0]
+        for job in queue:
+            if job.checkpoint in warm:
+                return job
+        return queue[0]
+
+    def _take_batch(self, job: Job) -> list:
+        """
+        Takes the queued jobs that can run together with `job`. Must be called with the lock held.
+        """
+        batch = [job]
+        if self.max_batch <= 1 or job.batch_key is None:
+            return batch
+
+        deadline = job.submitted_at + self.batch_window
+        while True:
+            for other in list(self._queue):
+                if len(batch) >= self.max_batch:
+                    break
+                if other.batch_key == job.batch_key:
+                    self._queue.remove(other)
+                    other.started_at = time.monotonic()
+                    self._running.append(other)
+                    batch.append(other)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.max_batch or remaining <= 0:
+                return batch
+            self._condition.wait(remaining)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                job = self._pick(self._queue, self.warm_checkpoints(), time.monotonic())
+                self._queue.remove(job)
+                self._running.append(job)
+                job.started_at = time.monotonic()
+                batch = self._take_batch(job)
+                for member in batch:
+                    member.batch = batch
+
+            swapped = job.checkpoint not in self.warm_checkpoints()
+            try:
+                self._run_batch(batch, swapped)
+            finally:
+                with self._condition:
+                    for member in batch:
+                        self._running.remove(member)
+                    self._current_checkpoint = job.checkpoint
+
+    def _run_batch(self, batch: list, swapped: bool):
+        batch = [member for member in batch if member.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        start = time.monotonic()
+        try:
+            responses = [self.run_job(batch[0])] if len(batch) == 1 else self.run_batch(batch)
+        except BaseException as e:
+            for member in batch:
+                member.future.set_exception(e)
+            return
+
+        self._record(batch[0], swapped, time.monotonic() - start, jobs=len(batch))
+        for member, response in zip(batch, responses):
+            member.future.set_result(response)
+
+    def _record(self, job: Job, swapped: bool, duration: float, jobs: int = 1, alpha: float = 0.3):
+        with self._condition:
+            # estimates are per job, the first job of a batch carries the swap
+            if swapped:
+                duration_per_job = duration - (jobs - 1) * self.expected_run_time(job.checkpoint)
+            else:
+                duration_per_job = duration / jobs
+            averages = self._swap_run_time if swapped else self._warm_run_time
+            previous = averages.get(job.checkpoint)
+            averages[job.checkpoint] = duration_per_job if previous is None else alpha * duration_per_job + (1 - alpha) * previous
+            self._swaps += swapped
+            self._jobs_run += jobs
+        if swapped:
+            logging.info(f"Loaded checkpoint '{job.checkpoint}', job took {duration:.1f} seconds.")
+
+    def expected_run_time(self, checkpoint: str) -> float:
+        return self._warm_run_time.get(checkpoint, self.default_run_time)
+
+    def expected_swap_cost(self, checkpoint: str) -> float:
+        """
+        Returns the learned extra seconds a job for `checkpoint` takes when the
+        checkpoint has to be loaded first.
+        """
+        if checkpoint in self._swap_run_time and checkpoint in self._warm_run_time:
+            return max(0.0, self._swap_run_time[checkpoint] - self._warm_run_time[checkpoint])
+        if checkpoint in self._swap_run_time:
+            return max(0.0, self._swap_run_time[checkpoint] - self.default_run_time)
+        return self.default_swap_cost
+
+    def status(self, job: Job) -> dict:
+        """
+        Simulates the scheduling order of the current queue and returns where `job` is in it.
+
+        Returns:
+            dict: 'state' ('queued', 'running' or 'done'), 'position' (1 is next),
+                  'queue_length', 'expected_wait' in seconds, 'needs_swap' and
+                  'expected_swap_cost' in seconds.
+        """
+        with self._condition:
+            if job.future.done():
+                return {'state': 'done'}
+            if job in self._running:
+                return {'state': 'running', 'needs_swap': False, 'expected_swap_cost': 0.0}
+
+            queue = list(self._queue)
+            now = time.monotonic()
+            # [time the worker is free, checkpoints it has loaded] for every worker
+            lanes = [
+                [now + max(0.0, self.expected_run_time(running.checkpoint) - (now - running.started_at)), {running.checkpoint}]
+                for running in self._running
+            ]
+            warm = self.warm_checkpoints()
+            lanes += [[now, set(warm)] for _ in range(max(0, self.workers - len(self._running)))]
+
+            position = 0
+            while queue:
+                position += 1
+                # the next pick happens when the first worker is free
+                lane = min(lanes, key=lambda lane: lane[0])
+                clock, warm = lane
+                next_job = self._pick(queue, warm, clock)
+                queue.remove(next_job)
+                needs_swap = next_job.checkpoint not in warm
+                swap_cost = self.expected_swap_cost(next_job.checkpoint) if needs_swap else 0.0
+                if next_job is job:
+                    return {
+                        'state': 'queued',
+                        'position': position,
+                        'queue_length': len(self._queue),
+                        'expected_wait': clock - now,
+                        'needs_swap': needs_swap,
+                        'expected_swap_cost': swap_cost,
+                    }
+                lane[0] = clock + swap_cost + self.expected_run_time(next_job.checkpoint)
+                lane[1] = {next_job.checkpoint}
+
+        return {'state': 'done'}
+
+    def describe(self, job: Job) -> str:
+        """
+        Returns a short human readable status of `job` for the UI.
+        """
+        status = self.status(job)
+        if status['state'] == 'done':
+            return "Finished."
+        if status['state'] == 'running':
+            return "Generating..."
+
+        message = (f"Queue position {status['position']} of {status['queue_length']}, "
+                   f"expected wait ~{status['expected_wait']:.0f}s.")
+        if status['needs_swap']:
+            message += f" Loading '{job.checkpoint}' is expected to take ~{status['expected_swap_cost']:.0f}s more."
+        return message
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'queued': len(self._queue),
+                'running': len(self._running),
+                'jobs_run': self._jobs_run,
+                'swaps': self._swaps,
+                'current_checkpoint': self._current_checkpoint,
+            }
@@ -0,0 +1,226 @@
+import json
+import numpy as np
+
+# CSS/X11 named colors, used as the bundled table for offline color naming
+NAMED_COLORS = (
+    ('Alice Blue', (240, 248, 255)),
+    ('Antique White', (250, 235, 215)),
+    ('Aqua', (0, 255, 255)),
+    ('Aquamarine', (127, 255, 212)),
+    ('Azure', (240, 255, 255)),
+    ('Beige', (245, 245, 220)),
+    ('Bisque', (255, 228, 196)),
+    ('Black', (0, 0, 0)),
+    ('Blanched Almond', (255, 235, 205)),
+    ('Blue', (0, 0, 255)),
+    ('Blue Violet', (138, 43, 226)),
+    ('Brown', (165, 42, 42)),
+    ('Burlywood', (222, 184, 135)),
+    ('Cadet Blue', (95, 158, 160)),
+    ('Chartreuse', (127, 255, 0)),
+    ('Chocolate', (210, 105, 30)),
+    ('Coral', (255, 127, 80)),
+    ('Cornflower Blue', (100, 149, 237)),
+    ('Cornsilk', (255, 248, 220)),
+    ('Crimson', (220, 20, 60)),
+    ('Dark Blue', (0, 0, 139)),
+    ('Dark Cyan', (0, 139, 139)),
+    ('Dark Goldenrod', (184, 134, 11)),
+    ('Dark Gray', (169, 169, 169)),
+    ('Dark Green', (0, 100, 0)),
+    ('Dark Khaki', (189, 183, 107)),
+    ('Dark Magenta', (139, 0, 139)),
+    ('Dark Olive Green', (85, 107, 47)),
+    ('Dark Orange', (255, 140, 0)),
+    ('Dark Orchid', (153, 50, 204)),
+    ('Dark Red', (139, 0, 0)),
+    ('Dark Salmon', (233, 150, 122)),
+    ('Dark Sea Green', (143, 188, 143)),
+    ('Dark Slate Blue', (72, 61, 139)),
+    ('Dark Slate Gray', (47, 79, 79)),
+    ('Dark Turquoise', (0, 206, 209)),
+    ('Dark Violet', (148, 0, 211)),
+    ('Deep Pink', (255, 20, 147)),
+    ('Deep Sky Blue', (0, 191, 255)),
+    ('Dim Gray', (105, 105, 105)),
+    ('Dodger Blue', (30, 144, 255)),
+    ('Firebrick', (178, 34, 34)),
+    ('Floral White', (255, 250, 240)),
+    ('Forest Green', (34, 139, 34)),
+    ('Fuchsia', (255, 0, 255)),
+    ('Gainsboro', (220, 220, 220)),
+    ('Ghost White', (248, 248, 255)),
+    ('Gold', (255, 215, 0)),
+    ('Goldenrod', (218, 165, 32)),
+    ('Gray', (128, 128, 128)),
+    ('Green', (0, 128, 0)),
+    ('Green Yellow', (173, 255, 47)),
+    ('Honeydew', (240, 255, 240)),
+    ('Hot Pink', (255, 105, 180)),
+    ('Indian Red', (205, 92, 92)),
+    ('Indigo', (75, 0, 130)),
+    ('Ivory', (255, 255, 240)),
+    ('Khaki', (240, 230, 140)),
+    ('Lavender', (230, 230, 250)),
+    ('Lavender Blush', (255, 240, 245)),
+    ('Lawn Green', (124, 252, 0)),
+    ('Lemon Chiffon', (255, 250, 205)),
+    ('Light Blue', (173, 216, 230)),
+    ('Light Coral', (240, 128, 128)),
+    ('Light Cyan', (224, 255, 255)),
+    ('Light Goldenrod Yellow', (250, 250, 210)),
+    ('Light Gray', (211, 211, 211)),
+    ('Light Green', (144, 238, 144)),
+    ('Light Pink', (255, 182, 193)),
+    ('Light Salmon', (255, 160, 122)),
+    ('Light Sea Green', (32, 178, 170)),
+    ('Light Sky Blue', (135, 206, 250)),
+    ('Light Slate Gray', (119, 136, 153)),
+    ('Light Steel Blue', (176, 196, 222)),
+    ('Light Yellow', (255, 255, 224)),
+    ('Lime', (0, 255, 0)),
+    ('Lime Green', (50, 205, 50)),
+    ('Linen', (250, 240, 230)),
+    ('Maroon', (128, 0, 0)),
+    ('Medium Aquamarine', (102, 205, 170)),
+    ('Medium Blue', (0, 0, 205)),
+    ('Medium Orchid', (186, 85, 211)),
+    ('Medium Purple', (147, 112, 219)),
+    ('Medium Sea Green', (60, 179, 113)),
+    ('Medium Slate Blue', (123, 104, 238)),
+    ('Medium Spring Green', (0, 250, 154)),
+    ('Medium Turquoise', (72, 209, 204)),
+    ('Medium Violet Red', (199, 21, 133)),
+    ('Midnight Blue', (25, 25, 112)),
+    ('Mint Cream', (245, 255, 250)),
+    ('Misty Rose', (255, 228, 225)),
+    ('Moccasin', (255, 228, 181)),
+    ('Navajo White', (255, 222, 173)),
+    ('Navy', (0, 0, 128)),
+    ('Old Lace', (253, 245, 230)),
+    ('Olive', (128, 128, 0)),
+    ('Olive Drab', (107, 142, 35)),
+    ('Orange', (255, 165, 0)),
+    ('Orange Red', (255, 69, 0)),
+    ('Orchid', (218, 112, 214)),
+    ('Pale Goldenrod', (238, 232, 170)),
+    ('Pale Green', (152, 251, 152)),
+    ('Pale Turquoise', (175, 238, 238)),
+    ('Pale Violet Red', (219, 112, 147)),
+    ('Papaya Whip', (255, 239, 213)),
+    ('Peach Puff', (255, 218, 185)),
+    ('Peru', (205, 133, 63)),
+    ('Pink', (255, 192, 203)),
+    ('Plum', (221, 160, 221)),
+    ('Powder Blue', (176, 224, 230)),
+    ('Purple', (128, 0, 128)),
+    ('Rebecca Purple', (102, 51, 153)),
+    ('Red', (255, 0, 0)),
+    ('Rosy Brown', (188, 143, 143)),
+    ('Royal Blue', (65, 105, 225)),
+    ('Saddle Brown', (139, 69, 19)),
+    ('Salmon', (250, 128, 114)),
+    ('Sandy Brown', (244, 164, 96)),
+    ('Sea Green', (46, 139, 87)),
+    ('Seashell', (255, 245, 238)),
+    ('Sienna', (160, 82, 45)),
+    ('Silver', (192, 192, 192)),
+    ('Sky Blue', (135, 206, 235)),
+    ('Slate Blue', (106, 90, 205)),
+    ('Slate Gray', (112, 128, 144)),
+    ('Snow', (255, 250, 250)),
+    ('Spring Green', (0, 255, 127)),
+    ('Steel Blue', (70, 130, 180)),
+    ('Tan', (210, 180, 140)),
+    ('Teal', (0, 128, 128)),
+    ('Thistle', (216, 191, 216)),
+    ('Tomato', (255, 99, 71)),
+    ('Turquoise', (64, 224, 208)),
+    ('Violet', (238, 130, 238)),
+    ('Wheat', (245, 222, 179)),
+    ('White', (255, 255, 255)),
+    ('White Smoke', (245, 245, 245)),
+    ('Yellow', (255, 255, 0)),
+    ('Yellow Green', (154, 205, 50)),
+)
+
+def _srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """
+    Converts an (N, 3) array of 8-bit sRGB colors to CIELAB (D65 white point).
+    """
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+
+    # undo the sRGB gamma
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+
+    rgb_to_xyz = np.array([
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ])
+    xyz = linear @ rgb_to_xyz.T
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+
+    epsilon = 216 / 24389
+    kappa = 24389 / 27
+    f = np.where(xyz > epsilon, np.cbrt(xyz), (kappa * xyz + 16) / 116)
+
+    l = 116 * f[:, 1] - 16
+    a = 500 * (f[:, 0] - f[:, 1])
+    b = 200 * (f[:, 1] - f[:, 2])
+
+    return np.stack([l, a, b], axis=1)
+
+_NAMES = [name for name, _ in NAMED_COLORS]
+_TABLE_LAB = _srgb_to_lab(np.array([rgb for _, rgb in NAMED_COLORS]))
+
+def name_colors(colors: list) -> list:
+    """
+    Finds the closest named color for each of the given colors.
+
+    The distance is measured in CIELAB space (CIE76 delta E), which follows human 
+    perception much better than the distance between raw RGB values. All colors are 
+    matched against the table at once with a single vectorized NumPy operation.
+
+    Args:
+        colors (list): Colors in (r, g, b) format.
+
+    Returns:
+        list: The name of the closest named color for every input color.
+
+    Example:
+    ```
+    names = name_colors([(27, 56, 23), (0, 0, 120)])
+    # Output: ['Dark Slate Gray', 'Navy']
+    ```
+    """
+    if len(colors) == 0:
+        return []
+
+    lab = _srgb_to_lab(np.array(colors).reshape(-1, 3))
+
+    # (N, 1, 3) - (1, M, 3) -> (N, M) squared distances
+    distances = ((lab[:, None, :] - _TABLE_LAB[None, :, :]) ** 2).sum(axis=2)
+
+    return [_NAMES[index] for index in distances.argmin(axis=1)]
+
+def describe_colors_locally(frequent_colors: list) -> str:
+    """
+    Describes colors without calling an LLM, returning the same JSON structure 
+    as the color palette prompt.
+
+    Args:
+        frequent_colors (list): Colors in (r, g, b) format.
+
+    Returns:
+        str: JSON formatted color descriptions.
+
+    Example:
+    ```
+    descriptions = describe_colors_locally([(27, 56, 23), (87, 57, 12), (42, 106, 71)])
+    # Output: '{"1": "Dark Slate Gray", "2": "Saddle Brown", "3": "Sea Green"}'
+    ```
+    """
+    names = name_colors(frequent_colors)
+
+    return json.dumps({str(i): name for i, name in enumerate(names, start=1)})
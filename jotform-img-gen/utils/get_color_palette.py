@@ -1,17 +1,43 @@
 from Pylette import extract_colors
 from Pylette.src.palette import Palette
 
-import requests
-from collections import Counter
-import re
+import os
+import json
+import hashlib
 import logging
+import threading
+from typing import Literal
 
+from utils.color_names import describe_colors_locally
+from utils.http_session import get_session
 from utils.jotform_api import get_logo_url
 from utils.llm_inferences import openai_inference
+from utils.palette_store import PaletteStore
 from utils.prompt_reader import read_prompts_from_file
+from utils.svg_palette import extract_svg_colors
 
 logging.basicConfig(level=logging.INFO)
 
+LOGO_TIMEOUT = float(os.getenv('LOGO_TIMEOUT', '15'))
+SVG_MAX_BYTES = int(os.getenv('SVG_MAX_BYTES', str(5 * 1024 * 1024)))
+
+# 'llm' asks gpt-3.5-turbo for color descriptions, 'local' uses the bundled named color table
+COLOR_NAMING = os.getenv('COLOR_NAMING', 'llm')
+
+_palette_store = None
+_palette_store_lock = threading.Lock()
+
+def _get_palette_store() -> PaletteStore:
+    global _palette_store
+    if _palette_store is None:
+        with _palette_store_lock:
+            if _palette_store is None:
+                _palette_store = PaletteStore(
+                    db_path=os.getenv('PALETTE_DB_PATH', '.cache/palettes.sqlite3'),
+                    max_bytes=int(os.getenv('PALETTE_DB_MAX_BYTES', str(8 * 1024 * 1024)))
+                )
+    return _palette_store
+
 ### FOR JPG, PNG, etc.
 
 def get_palette_from_png_jpg(
@@ -71,16 +97,29 @@ def get_palette_from_png_jpg(
 
 ### FOR SVG
 
-def get_palette_from_svg(svg_url):
+def get_palette_from_svg(
+        svg_url: str | None = None,
+        svg_content: bytes | str | None = None,
+        weight_by_area: bool = True,
+        max_bytes: int | None = None
+    ):
     """
-    Extracts the most frequent colors from an SVG file at the given URL and 
+    Extracts the most dominant colors from an SVG file at the given URL and 
     returns them as a list of RGB tuples.
 
+    The file is streamed into an incremental parser instead of being loaded as a whole, 
+    see `utils.svg_palette.extract_svg_colors` for the supported color syntax.
+
     Args:
-        svg_url (str): The URL of the SVG file.
+        svg_url (str | None): The URL of the SVG file.
+        svg_content (bytes | str | None): The SVG document itself, used instead of fetching `svg_url`.
+        weight_by_area (bool): Weight colors by the approximate area they paint instead of 
+                               counting how often they occur.
+        max_bytes (int | None): Maximum number of bytes to read, defaults to the 
+                                `SVG_MAX_BYTES` environment variable.
 
     Returns:
-        list: A list of RGB tuples representing the most frequent colors in the SVG file.
+        list: A list of RGB tuples representing the most dominant colors in the SVG file.
 
     Example:
     ```
@@ -88,57 +127,58 @@ def get_palette_from_svg(svg_url):
     # Output: [(255, 87, 51), (34, 34, 34), ...]
     ```
     """
+    if max_bytes is None:
+        max_bytes = SVG_MAX_BYTES
 
-    def _hex_to_rgb(hex_color):
-        """
-        Converts a hexadecimal color code to an RGB tuple.
-
-        Args:
-            hex_color (str): The hexadecimal color code (e.g., '#ff5733' or 'ff5733').
-
-        Returns:
-            tuple: A tuple representing the RGB color (e.g., (255, 87, 51)).
-
-        Example:
-        ```
-        rgb = hex_to_rgb('#ff5733')
-        # Output: (255, 87, 51)
-        ```
-        """
-        # Remove the '#' if present
-        hex_color = hex_color.lstrip('#')
-        
-        # Convert 3-digit hex to 6-digit
-        if len(hex_color) == 3:
-            hex_color = ''.join([c*2 for c in hex_color])
-        
-        # Convert to RGB
-        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-
-    # Fetch the SVG content from the URL
-    response = requests.get(svg_url)
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch SVG from URL. Status code: {response.status_code}")
-    
-    svg_content = response.text
-
-    # Use regex to find all hexadecimal color codes
-    color_pattern = r'#[0-9A-Fa-f]{6}|#[0-9A-Fa-f]{3}'
-    colors = re.findall(color_pattern, svg_content)
+    if svg_content is not None:
+        if isinstance(svg_content, str):
+            svg_content = svg_content.encode('utf-8')
+        chunks = (svg_content[i:i + 65536] for i in range(0, len(svg_content), 65536))
+        return extract_svg_colors(chunks, weight_by_area=weight_by_area, max_bytes=max_bytes)
 
-    # Convert all colors to lowercase for consistency
-    colors = [color.lower() for color in colors]
+    # Stream the SVG content from the URL
+    with get_session().get(svg_url, stream=True, timeout=LOGO_TIMEOUT) as response:
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch SVG from URL. Status code: {response.status_code}")
 
-    # Convert HEX to RGB
-    rgb_colors = [_hex_to_rgb(color) for color in colors]
+        return extract_svg_colors(response.iter_content(65536), weight_by_area=weight_by_area, max_bytes=max_bytes)
 
-    # Count the frequency of each color
-    color_counts = Counter(rgb_colors)
-
-    # Sort colors by frequency, most frequent first
-    sorted_colors = sorted(color_counts.items(), key=lambda x: x[1], reverse=True)
+def _extract_logo_colors(logo_url: str, response, store: PaletteStore) -> tuple:
+    """
+    Reads a logo from a streamed response and returns its content hash and palette, 
+    most frequent colors first. The hash is None for an SVG that was not read to its end
+    (larger than `SVG_MAX_BYTES` or not parseable), since it would not cover the whole
+    logo and must not be stored.
+    """
+    content_type = response.headers.get('Content-Type', '')
+    if '.svg' in logo_url or 'svg' in content_type:
+        # SVGs are hashed while they are parsed so they never have to fit in memory
+        hasher = hashlib.sha256()
+        read_to_end = False
+
+        def _hashed_chunks():
+            nonlocal read_to_end
+            for chunk in response.iter_content(65536):
+                hasher.update(chunk)
+                yield chunk
+            read_to_end = True
+
+        # returns list of colors in (r, g, b) format
+        colors = extract_svg_colors(_hashed_chunks(), max_bytes=SVG_MAX_BYTES)
+        return (hasher.hexdigest() if read_to_end else None), colors
+
+    content = response.content
+
+    # identical logos uploaded under different URLs share the same palette
+    content_hash = PaletteStore.hash_content(content)
+    colors = store.get_palette(content_hash)
+    if colors is None:
+        # returns Palette object
+        palette: Palette = get_palette_from_png_jpg(image_bytes=content)
+        # Pylette returns numpy integers, which cannot be stored as JSON
+        colors = [[int(value) for value in color.rgb] for color in palette]
 
-    return [color for color, _ in sorted_colors]
+    return content_hash, colors
 
 def get_logo_color_palette(logo_url: str):
     """
@@ -159,14 +199,39 @@ def get_logo_color_palette(logo_url: str):
     colors = get_logo_color_palette(form_id=1234567890)
     ```
     """
-    if '.svg' in logo_url:
-        # returns list of colors in (r, g, b) format
-        colors = get_palette_from_svg(svg_url=logo_url)
-    else:
-        # returns Palette object
-        palette: Palette = get_palette_from_png_jpg(image_url=logo_url)
-
-        colors = [list(color.rgb) for color in palette]
+    store = _get_palette_store()
+    known_logo = store.get_logo(logo_url)
+
+    colors = None
+    if known_logo:
+        # revalidate the logo we have seen before instead of downloading it again
+        headers = {}
+        if known_logo['etag']:
+            headers['If-None-Match'] = known_logo['etag']
+        if known_logo['last_modified']:
+            headers['If-Modified-Since'] = known_logo['last_modified']
+
+        with get_session().get(logo_url, headers=headers, stream=True, timeout=LOGO_TIMEOUT) as response:
+            if response.status_code == 304:
+                colors = store.get_palette(known_logo['content_hash'])
+            if colors is not None:
+                logging.info("Logo not modified, using the stored palette.")
+            elif response.status_code == 200:
+                content_hash, colors = _extract_logo_colors(logo_url, response, store)
+                if content_hash is not None:
+                    store.put_palette(content_hash, colors)
+                    store.put_logo(logo_url, content_hash, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+    if colors is None:
+        # unknown logo, or the stored palette was evicted
+        with get_session().get(logo_url, stream=True, timeout=LOGO_TIMEOUT) as response:
+            if response.status_code != 200:
+                raise ValueError(f"Failed to fetch logo from URL. Status code: {response.status_code}")
+
+            content_hash, colors = _extract_logo_colors(logo_url, response, store)
+            if content_hash is not None:
+                store.put_palette(content_hash, colors)
+                store.put_logo(logo_url, content_hash, response.headers.get('ETag'), response.headers.get('Last-Modified'))
 
     # get the most frequent 3 colors
     num_colors_to_pick = min(len(colors), 3) # make sure we are not out of bounds
@@ -176,7 +241,11 @@ def get_logo_color_palette(logo_url: str):
 
     return colors
 
-def get_structured_color_descriptions(form_id: int, prompt_file_path: str) -> str:
+def get_structured_color_descriptions(
+        form_id: int,
+        prompt_file_path: str,
+        naming: Literal['llm', 'local'] | None = None
+    ) -> str:
     """
     Retrieves structured color descriptions for the logo of a JotForm form using a 
     specified prompt file and an LLM.
@@ -185,6 +254,8 @@ def get_structured_color_descriptions(form_id: int, prompt_file_path: str) -> st
         form_id (int): The ID of the JotForm form.
         prompt_file_path (str): The path to the prompt file used for generating the 
                                 structured color descriptions.
+        naming (Literal['llm', 'local'] | None): How colors are described, defaults to 
+                                the `COLOR_NAMING` environment variable.
 
     Returns:
         str: The response containing structured color descriptions.
@@ -204,17 +275,61 @@ def get_structured_color_descriptions(form_id: int, prompt_file_path: str) -> st
         return None
     frequent_colors = get_logo_color_palette(logo_url=logo_url)
 
-    system_prompt, user_prompt = read_prompts_from_file(prompt_file_path, frequent_colors=frequent_colors, len=len)
+    return describe_colors(frequent_colors=frequent_colors, prompt_file_path=prompt_file_path, naming=naming)
+
+def describe_colors(
+        frequent_colors: list,
+        prompt_file_path: str,
+        naming: Literal['llm', 'local'] | None = None
+    ) -> str:
+    """
+    Gets short descriptions of the given colors, either from an LLM using the specified 
+    prompt file or offline from the bundled named color table.
+
+    Args:
+        frequent_colors (list): Colors in (r, g, b) format, as returned by `get_logo_color_palette`.
+        prompt_file_path (str): The path to the prompt file used for generating the 
+                                structured color descriptions.
+        naming (Literal['llm', 'local'] | None): How colors are described, defaults to 
+                                the `COLOR_NAMING` environment variable.
+
+    Returns:
+        str: The response containing structured color descriptions.
+        str: "Timeout" if the request times out.
+
+    Example:
+    ```
+    descriptions = describe_colors([(27, 56, 23), (87, 57, 12)], "prompts/color_palette_prompt.txt")
+    # output: "{"1": "Dark green", "2": "Brownish-yellow"}"
+    ```
+    """
+    if (naming or COLOR_NAMING) == 'local':
+        return describe_colors_locally(frequent_colors)
+
+    model = "gpt-3.5-turbo"
+
+    store = _get_palette_store()
+    descriptions = store.get_descriptions(frequent_colors, namer=model)
+    if descriptions is not None:
+        return descriptions
+
+    system_prompt, user_prompt = read_prompts_from_file(prompt_file_path, frequent_colors=frequent_colors, num_colors=len(frequent_colors))
     try:
         response = openai_inference(
             system_prompt=system_prompt,
             user_prompt=user_prompt,
-            model="gpt-3.5-turbo",
+            model=model,
             max_tokens=50,
             temperature=0,
             timeout_seconds=30
         )
-
-        return response
     except TimeoutError:
-        return "Timeout"
\ No newline at end of file
+        return "Timeout"
+
+    try:
+        json.loads(response)
+        store.put_descriptions(frequent_colors, namer=model, descriptions=response)
+    except (TypeError, ValueError):
+        logging.info("Color descriptions are not valid JSON, not storing them.")
+
+    return response
\ No newline at end of file
@@ -0,0 +1,36 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide `requests.Session` used for outgoing HTTP calls.
+
+    The session is created on first use and keeps a pool of keep-alive
+    connections per host, so repeated calls to the same API reuse the
+    TCP connection and TLS session instead of opening a new one per request.
+    The pool size can be set with the `HTTP_POOL_MAXSIZE` environment variable.
+
+    Returns:
+        requests.Session: The shared session.
+
+    Example:
+    ```
+    response = get_session().get("https://api.jotform.com/form/1234567890/questions", timeout=10)
+    ```
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_maxsize = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
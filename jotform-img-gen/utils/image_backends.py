@@ -0,0 +1,287 @@
+import io
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import functools
+import numpy as np
+import PIL.Image
+from typing import Callable
+
+from utils.pipeline_image import PipelineImage
+
+logging.basicConfig(level=logging.INFO)
+
+class GeneratedImage:
+    """
+    One image returned by an `ImageBackend`, with the seed it was generated with (None if
+    the backend does not report one) and its generation info as a JSON string in the
+    format of the web UI's `info`, so it can be logged like any other image.
+    """
+    def __init__(self, image: PipelineImage, seed: int | None, info: str):
+        self.image = image
+        self.seed = seed
+        self.info = info
+
+def _info(backend: 'ImageBackend', prompt: str, negative_prompt: str, seed: int | None, width: int | None, height: int | None) -> str:
+    return json.dumps({
+        'prompt': prompt,
+        'negative_prompt': negative_prompt,
+        'seed': seed,
+        'width': width,
+        'height': height,
+        'sd_model_name': backend.name,
+        'job_timestamp': time.strftime('%Y%m%d%H%M%S'),
+    }, ensure_ascii=False)
+
+class ImageBackend:
+    """
+    Common async interface of the image generators.
+
+    Subclasses implement `_generate` and declare what they support with the capability
+    flags below. `generate` checks a request against those flags, so callers can rely on
+    the same behaviour from every backend: a negative prompt or seed a backend cannot
+    use is rejected instead of silently ignored, and several images from a backend
+    without batching are generated with concurrent single image calls.
+
+    Capabilities:
+        supports_batching: More than one image can be generated in one call.
+        supports_progress: `on_progress` is called with the progress (0-1) while generating.
+        supports_negative_prompt: A negative prompt is used.
+        supports_seed: The seed is used, so the same request gives the same image.
+
+    Example:
+    ```
+    backend = get_backend('fake')
+    images = await backend.generate("a mountain landscape", seed=1337, num_images=4, width=512, height=512)
+    png_bytes = images[0].image.encode('PNG')
+    ```
+    """
+    name = 'backend'
+    supports_batching = False
+    supports_progress = False
+    supports_negative_prompt = False
+    supports_seed = False
+
+    async def generate(
+            self,
+            prompt: str,
+            negative_prompt: str = '',
+            seed: int | None = None,
+            num_images: int = 1,
+            on_progress: Callable[[float], None] | None = None,
+            **parameters
+        ) -> list:
+        """
+        Generates `num_images` images for the prompt. `parameters` are backend specific,
+        e.g. width, height or the sampler of the web UI.
+
+        Raises:
+            ValueError: If the request uses something the backend does not support.
+        """
+        if negative_prompt and not self.supports_negative_prompt:
+            raise ValueError(f"{self.name} does not support negative prompts.")
+        if seed is not None and seed >= 0 and not self.supports_seed:
+            raise ValueError(f"{self.name} does not support seeds.")
+        if num_images < 1:
+            raise ValueError("num_images must be at least 1.")
+
+        if num_images == 1 or self.supports_batching:
+            return await self._generate(prompt, negative_prompt, seed, num_images, on_progress, **parameters)
+
+        seeds = [None if seed is None or seed < 0 else seed + i for i in range(num_images)]
+        results = await asyncio.gather(*(
+            self._generate(prompt, negative_prompt, image_seed, 1, None, **parameters) for image_seed in seeds
+        ))
+        return [image for images in results for image in images]
+
+    async def _generate(self, prompt: str, negative_prompt: str, seed: int | None, num_images: int,
+                        on_progress: Callable[[float], None] | None, **parameters) -> list:
+        raise NotImplementedError
+
+class A1111Backend(ImageBackend):
+    """
+    AUTOMATIC1111's web UI, through the checkpoint scheduler, backend pool and result store
+    of `local_img_generation`. `parameters` are those of `build_txt2img_payload`.
+    """
+    name = 'a1111'
+    supports_batching = True
+    supports_progress = True
+    supports_negative_prompt = True
+    supports_seed = True
+
+    def __init__(self, checkpoint: str = 'sd_xl_turbo_1.0_fp16', progress_interval: float = 1.0):
+        self.checkpoint = checkpoint
+        self.progress_interval = progress_interval
+
+    async def _generate(self, prompt, negative_prompt, seed, num_images, on_progress, **parameters):
+        from utils.local_img_generation import submit_img, job_progress, GeneratedBatch
+
+        parameters.setdefault('batch_count', 1)
+        job = submit_img(self.checkpoint, prompt, negative_prompt, seed=-1 if seed is None else seed,
+                         batch_size=num_images, **parameters)
+        future = asyncio.wrap_future(job.future)
+        while True:
+            done, _ = await asyncio.wait([future], timeout=self.progress_interval)
+            if done:
+                break
+            if on_progress is not None:
+                progress = await asyncio.to_thread(job_progress, job)
+                if progress is not None:
+                    on_progress(progress.get('progress', 0.0))
+
+        batch = GeneratedBatch(future.result())
+        return [GeneratedImage(batch.image(i), batch.seed(i), batch.image_info(i)) for i in range(len(batch))]
+
+class DallEBackend(ImageBackend):
+    """
+    OpenAI's DALL-E models. Width and height must form one of the sizes the model offers.
+    """
+    supports_negative_prompt = False
+    supports_seed = False
+
+    def __init__(self, model: str = 'dall-e-3', quality: str = 'standard', style: str = 'vivid'):
+        self.name = model
+        self.model = model
+        self.quality = quality
+        self.style = style
+
+    async def _generate(self, prompt, negative_prompt, seed, num_images, on_progress, width=1024, height=1024, **parameters):
+        from utils.api_img_generation import generate_img
+
+        image_bytes = await asyncio.to_thread(
+            generate_img, prompt, model=self.model, size=f"{width}x{height}", quality=self.quality, style=self.style
+        )
+        return [GeneratedImage(PipelineImage(encoded=image_bytes), None, _info(self, prompt, negative_prompt, None, width, height))]
+
+class NvidiaBackend(ImageBackend):
+    """
+    Stable Diffusion 3 Medium ('sd3') or SDXL ('sdxl') hosted by NVIDIA.
+    Without a negative prompt, the default one of `api_img_generation` is used.
+    """
+    supports_negative_prompt = True
+    supports_seed = True
+
+    def __init__(self, model: str = 'sdxl'):
+        if model not in ('sd3', 'sdxl'):
+            raise ValueError("model must be 'sd3' or 'sdxl'.")
+        self.name = f"nvidia-{model}"
+        self.model = model
+
+    async def _generate(self, prompt, negative_prompt, seed, num_images, on_progress, **parameters):
+        from utils.api_img_generation import generate_sd3_image, generate_sdxl_image, DEFAULT_NEGATIVE_PROMPT
+
+        generate = generate_sd3_image if self.model == 'sd3' else generate_sdxl_image
+        negative_prompt = negative_prompt or DEFAULT_NEGATIVE_PROMPT
+        # the API takes 0 as a fixed seed, so a random one is drawn like the web UI does
+        seed = random.randrange(2 ** 32) if seed is None or seed < 0 else seed
+        image_bytes = await asyncio.to_thread(generate, prompt, negative_prompt=negative_prompt, seed=seed)
+        return [GeneratedImage(PipelineImage(encoded=image_bytes), seed, _info(self, prompt, negative_prompt, seed, None, None))]
+
+class StabilityBackend(ImageBackend):
+    """
+    Stable Diffusion 3 Medium through Stability AI's API.
+    """
+    name = 'stability-sd3'
+    supports_negative_prompt = True
+    supports_seed = True
+
+    async def _generate(self, prompt, negative_prompt, seed, num_images, on_progress, **parameters):
+        from utils.api_img_generation import stability_ai_inference
+
+        seed = None if seed is None or seed < 0 else seed
+        image_bytes = await asyncio.to_thread(stability_ai_inference, prompt, negative_prompt=negative_prompt or None, seed=seed)
+        return [GeneratedImage(PipelineImage(encoded=image_bytes), seed, _info(self, prompt, negative_prompt, seed, None, None))]
+
+class FakeBackend(ImageBackend):
+    """
+    Offline backend for tests and benchmarks of schedulers, stores and load without a GPU
+    or network. Images are synthetic PNGs rendered on the CPU; the same prompt, negative
+    prompt, seed and size always give the same image. Each call takes `call_latency`
+    seconds plus `image_latency` seconds per image, scaled by up to +-`jitter`, and
+    reports progress like a sampler would.
+
+    Args:
+        call_latency (float): Seconds every call takes, e.g. HTTP and model setup.
+        image_latency (float): Seconds every image takes.
+        jitter (float): Relative random variation of the latency (0.1 for +-10%).
+        steps (int): Number of progress updates per call.
+        seed (int): Seed of the latency jitter, so runs can be repeated exactly.
+
+    Example:
+    ```
+    backend = FakeBackend(call_latency=0.15, image_latency=0.8)
+    images = await backend.generate("a cat", seed=1, num_images=2, width=256, height=256)
+    ```
+    """
+    name = 'fake'
+    supports_batching = True
+    supports_progress = True
+    supports_negative_prompt = True
+    supports_seed = True
+
+    def __init__(self, call_latency: float = 0.15, image_latency: float = 0.8, jitter: float = 0.1, steps: int = 10, seed: int = 0):
+        self.call_latency = call_latency
+        self.image_latency = image_latency
+        self.jitter = jitter
+        self.steps = steps
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    @staticmethod
+    def render(prompt: str, negative_prompt: str, seed: int, width: int, height: int) -> bytes:
+        """
+        Renders the synthetic PNG for a request: a gradient in colors derived from the
+        prompt with seeded noise on top, so it compresses like a generated image.
+        """
+        digest = hashlib.sha256(f"{prompt}\0{negative_prompt}\0{seed}".encode('utf-8')).digest()
+        rng = np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+        start, end = np.frombuffer(digest[8:11], dtype=np.uint8), np.frombuffer(digest[11:14], dtype=np.uint8)
+        ramp = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+        pixels = start * (1 - ramp) + end * ramp + rng.normal(0, 8, (height, width, 3))
+        buffer = io.BytesIO()
+        PIL.Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    async def _generate(self, prompt, negative_prompt, seed, num_images, on_progress, width=512, height=512, **parameters):
+        self.calls += 1
+        if seed is None or seed < 0:
+            seed = self._random.randrange(2 ** 32)
+        latency = (self.call_latency + self.image_latency * num_images) * (1 + self._random.uniform(-self.jitter, self.jitter))
+
+        for step in range(1, self.steps + 1):
+            await asyncio.sleep(latency / self.steps)
+            if on_progress is not None:
+                on_progress(step / self.steps)
+
+        images = []
+        for i in range(num_images):
+            image_bytes = await asyncio.to_thread(self.render, prompt, negative_prompt, seed + i, width, height)
+            images.append(GeneratedImage(
+                PipelineImage(encoded=image_bytes), seed + i, _info(self, prompt, negative_prompt, seed + i, width, height)
+            ))
+        return images
+
+_BACKENDS = {
+    'a1111': A1111Backend,
+    'dall-e-3': functools.partial(DallEBackend, 'dall-e-3'),
+    'dall-e-2': functools.partial(DallEBackend, 'dall-e-2'),
+    'nvidia-sd3': functools.partial(NvidiaBackend, 'sd3'),
+    'nvidia-sdxl': functools.partial(NvidiaBackend, 'sdxl'),
+    'stability-sd3': StabilityBackend,
+    'fake': FakeBackend,
+}
+
+def get_backend(name: str, **kwargs) -> ImageBackend:
+    """
+    Returns a new backend by name: 'a1111', 'dall-e-3', 'dall-e-2', 'nvidia-sd3',
+    'nvidia-sdxl', 'stability-sd3' or 'fake'. `kwargs` are passed to the backend.
+
+    Raises:
+        ValueError: If there is no backend with that name.
+    """
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown image backend '{name}', choose one of {', '.join(_BACKENDS)}.")
+    return _BACKENDS[name](**kwargs)
@@ -4,6 +4,9 @@ import logging
 import requests
 from dotenv import load_dotenv
 
+from utils.http_session import get_session
+from utils.lru_store import TTLLRUStore
+
 # Load the .env file
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -14,6 +17,58 @@ try:
 except ValueError as e:
     logging.info(str(e))
 
+JOTFORM_API_URL = os.getenv('JOTFORM_API_URL', 'https://api.jotform.com')
+JOTFORM_TIMEOUT = float(os.getenv('JOTFORM_TIMEOUT', '10'))
+
+# form metadata rarely changes between two clicks on "Generate", so the
+# responses of the JotForm API are kept in memory keyed by (form_id, resource)
+_form_metadata = TTLLRUStore(
+    max_size=int(os.getenv('JOTFORM_CACHE_SIZE', '256')),
+    ttl_seconds=float(os.getenv('JOTFORM_CACHE_TTL', '300'))
+)
+
+def _get_form_content(form_id: int, resource: str):
+    """
+    Returns the `content` field of `GET /form/{form_id}/{resource}`, served from
+    the in-process form metadata store when possible.
+
+    Concurrent requests for the same form and resource result in a single call
+    to the JotForm API. Failed requests are not stored.
+
+    Raises:
+        HTTPError: If the request to the JotForm API fails.
+    """
+    def _fetch():
+        url = f"{JOTFORM_API_URL}/form/{form_id}/{resource}"
+
+        params = {
+            "apiKey": JOTFORM_API_KEY
+        }
+
+        response = get_session().get(url, params=params, timeout=JOTFORM_TIMEOUT)
+
+        if response.status_code != 200:
+            # Request failed
+            logging.info(f"Request failed with status code: {response.status_code}")
+            logging.info(response.text)
+            raise requests.HTTPError(f"Request failed with status code: {response.status_code}", response=response)
+
+        return response.json()['content']
+
+    return _form_metadata.get_or_load((int(form_id), resource), _fetch)
+
+def get_form_metadata_stats() -> dict:
+    """
+    Returns hit/miss counters of the form metadata store.
+
+    Example:
+    ```
+    stats = get_form_metadata_stats()
+    # Output: {'hits': 12, 'misses': 4, 'evictions': 0, 'size': 4}
+    ```
+    """
+    return _form_metadata.stats()
+
 def get_logo_url(form_id: int):
     """
     Retrieves the logo URL from the JotForm form properties using the form ID.
@@ -25,41 +80,26 @@ def get_logo_url(form_id: int):
         str: The URL of the form's logo image if the request is successful.
         None: If the request fails or the logo URL cannot be retrieved.
 
-    Raises:
-        HTTPError: If the request to the JotForm API fails.
-
     Example:
     ```
     logo_url = get_logo(form_id=1234567890)
     ```
     """
-    url = f"https://api.jotform.com/form/{form_id}/properties"
-    
-    params = {
-        "apiKey": JOTFORM_API_KEY
-    }
-
-    response = requests.get(url, params=params)
-
-    if response.status_code == 200:
-        # Request was successful
-        data = response.json()
-
-        json_str:str = data['content']['styleJSON']
-
-        parsed_dict = ast.literal_eval(json_str.replace('\\', ''))
-
-        try:
-            logo_url = parsed_dict['@formCoverImg']
-            return logo_url
-        except:
-            logging.info("Form doesn't have a logo, continuing without color extraction..")
-            return None
-    else:
-        # Request failed
-        logging.info(f"Request failed with status code: {response.status_code}")
-        logging.info(response.text)
-    return
+    try:
+        content = _get_form_content(form_id, 'properties')
+    except requests.RequestException:
+        return
+
+    json_str:str = content['styleJSON']
+
+    parsed_dict = ast.literal_eval(json_str.replace('\\', ''))
+
+    try:
+        logo_url = parsed_dict['@formCoverImg']
+        return logo_url
+    except:
+        logging.info("Form doesn't have a logo, continuing without color extraction..")
+        return None
 
 def get_title(form_id: int):
     """
@@ -79,25 +119,8 @@ def get_title(form_id: int):
     title = get_title(form_id=1234567890)
     ```
     """
-
-    url = f"https://api.jotform.com/form/{form_id}/questions"
-
-    params = {
-        "apiKey": JOTFORM_API_KEY
-    }
-
-    # Make the GET request
-    response = requests.get(url, params=params)
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Request was successful
-        data = response.json()
-        answers:dict = data["content"]
-    else:
-        # Request failed
-        logging.info(f"Request failed with status code: {response.status_code}")
-        logging.info(response.text)
+    answers:dict = _get_form_content(form_id, 'questions')
 
     title = next(iter(answers.items()))[1]['text']
 
-    return title
\ No newline at end of file
+    return title
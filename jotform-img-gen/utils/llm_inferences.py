@@ -1,16 +1,300 @@
 import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
 import logging
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from typing import Literal
 
 from groq import Groq
 from openai import OpenAI
 
+from utils import rate_limit
+
 # Load the .env file
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 
+# clients are created once and shared, so their HTTP connection pools
+# (and TLS sessions) survive between calls
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_groq_client() -> Groq:
+    """
+    Returns the shared Groq client. The API URL can be overridden with `GROQ_BASE_URL`.
+    """
+    if 'groq' not in _clients:
+        with _clients_lock:
+            if 'groq' not in _clients:
+                _clients['groq'] = Groq(api_key=os.getenv("GROQ_API_KEY"), base_url=os.getenv("GROQ_BASE_URL"))
+    return _clients['groq']
+
+def get_openai_client() -> OpenAI:
+    """
+    Returns the shared OpenAI client. The API URL can be overridden with `OPENAI_BASE_URL`.
+    """
+    if 'openai' not in _clients:
+        with _clients_lock:
+            if 'openai' not in _clients:
+                _clients['openai'] = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
+    return _clients['openai']
+
+class ResponseStore:
+    """
+    SQLite-backed store of LLM completions keyed by everything that determines them:
+    provider, model, system prompt, user prompt, temperature and max tokens.
+
+    Deterministic calls (temperature 0) keep a single response. Sampled calls keep a
+    pool of up to `variants` responses per key; until the pool is full every call
+    asks the provider for a new completion and adds it, afterwards a random response
+    from the pool is returned, so repeated clicks still show some variety.
+
+    Responses expire `ttl` seconds after they were created, so pools are refilled with
+    fresh completions when a provider or a prompt changes. Once the stored responses
+    exceed `max_bytes`, the least recently used ones are evicted.
+
+    Args:
+        db_path (str): Path to the SQLite database file. Created if it does not exist.
+        variants (int): Number of responses kept per key for sampled calls.
+        ttl (float): Seconds a response is served after it was created.
+        max_bytes (int): Approximate upper bound for the size of the stored responses.
+
+    Example:
+    ```
+    store = ResponseStore(".cache/llm_responses.sqlite3", variants=3, ttl=7 * 24 * 3600)
+    prompt = store.get_or_create('groq', 'llama3-8b-8192', system_prompt, user_prompt, 
+                                 0.8, 200, create=lambda: call_api())
+    store.stats()
+    # Output: {'hits': 4, 'misses': 3, 'hit_rate': 0.571}
+    ```
+    """
+    def __init__(self, db_path: str, variants: int = 3, ttl: float = 7 * 24 * 3600,
+                 max_bytes: int = 16 * 1024 * 1024):
+        self.db_path = db_path
+        self.variants = variants
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_key ON responses (key)")
+
+    @contextmanager
+    def _connect(self):
+        # commits (or rolls back) and closes the connection when the block ends
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(provider, model, system_prompt, user_prompt, temperature, max_tokens) -> str:
+        key = json.dumps([provider, model, system_prompt, user_prompt, float(temperature), max_tokens])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _pool_size(self, temperature) -> int:
+        return 1 if temperature == 0 else self.variants
+
+    def lookup(self, provider, model, system_prompt, user_prompt, temperature, max_tokens) -> str | None:
+        """
+        Returns a stored response once the pool of unexpired responses for the call is
+        full, otherwise None.
+        """
+        key = self.make_key(provider, model, system_prompt, user_prompt, temperature, max_tokens)
+
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT rowid, response FROM responses WHERE key = ? AND created >= ?", (key, time.time() - self.ttl)
+            ).fetchall()
+            if len(rows) < self._pool_size(temperature):
+                self._misses += 1
+                return None
+            rowid, response = random.choice(rows)
+            conn.execute("UPDATE responses SET last_used = ? WHERE rowid = ?", (time.time(), rowid))
+            self._hits += 1
+            return response
+
+    def add(self, provider, model, system_prompt, user_prompt, temperature, max_tokens, response: str):
+        if not response:
+            return
+        key = self.make_key(provider, model, system_prompt, user_prompt, temperature, max_tokens)
+        now = time.time()
+
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            count = conn.execute("SELECT COUNT(*) FROM responses WHERE key = ?", (key,)).fetchone()[0]
+            if count < self._pool_size(temperature):
+                conn.execute(
+                    "INSERT INTO responses (key, response, created, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, response, now, len(key) + len(response), now)
+                )
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """
+        Deletes the least recently used responses until the stored ones fit into `max_bytes`.
+        """
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for rowid, size in conn.execute("SELECT rowid, size FROM responses ORDER BY last_used ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE rowid = ?", (rowid,))
+            total -= size
+        logging.info(f"Evicted LLM responses, {total} bytes remaining.")
+
+    def get_or_create(self, provider, model, system_prompt, user_prompt, temperature, max_tokens, create) -> str:
+        """
+        Returns a stored response for the call, or calls `create()` and stores its result.
+        """
+        response = self.lookup(provider, model, system_prompt, user_prompt, temperature, max_tokens)
+        if response is None:
+            response = create()
+            self.add(provider, model, system_prompt, user_prompt, temperature, max_tokens, response)
+        return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 3) if total else 0.0,
+            }
+
+_response_store = None
+_response_store_lock = threading.Lock()
+
+def _get_response_store() -> ResponseStore | None:
+    """
+    Returns the shared response store, or None if it is disabled with `LLM_CACHE=0`.
+    """
+    global _response_store
+    if os.getenv('LLM_CACHE', '1') == '0':
+        return None
+    if _response_store is None:
+        with _response_store_lock:
+            if _response_store is None:
+                _response_store = ResponseStore(
+                    db_path=os.getenv('LLM_CACHE_PATH', '.cache/llm_responses.sqlite3'),
+                    variants=int(os.getenv('LLM_CACHE_VARIANTS', '3')),
+                    ttl=float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600))),
+                    max_bytes=int(os.getenv('LLM_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+                )
+    return _response_store
+
+# whether the last completion of each thread came from the response store
+_call_state = threading.local()
+
+def served_from_cache() -> bool:
+    """
+    Returns whether the last completion requested by the calling thread was served from
+    the response store instead of the provider, e.g. to leave it out of latency statistics.
+    """
+    return getattr(_call_state, 'cached', False)
+
+def _cached_completion(provider, model, system_prompt, user_prompt, temperature, max_tokens, create) -> str:
+    """
+    Serves the completion from the response store unless `LLM_CACHE=0`.
+    """
+    store = _get_response_store()
+    response = None
+    if store is not None:
+        response = store.lookup(provider, model, system_prompt, user_prompt, temperature, max_tokens)
+    _call_state.cached = response is not None
+    if response is None:
+        response = create()
+        if store is not None:
+            store.add(provider, model, system_prompt, user_prompt, temperature, max_tokens, response)
+    return response
+
+def _stream_completion(provider, client, model, system_prompt, user_prompt, temperature, max_tokens, timeout_seconds):
+    """
+    Yields the completion in pieces as the provider generates them. A stored response
+    is yielded as a single piece; a streamed one is stored once it is complete.
+    """
+    store = _get_response_store()
+    if store is not None:
+        response = store.lookup(provider, model, system_prompt, user_prompt, temperature, max_tokens)
+        if response is not None:
+            _call_state.cached = True
+            yield response
+            return
+
+    _call_state.cached = False
+    rate_limit.acquire(provider, timeout=timeout_seconds)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {'role': 'user', 'content': user_prompt}
+    ]
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        timeout=timeout_seconds,
+        stream=True
+    )
+
+    pieces = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            pieces.append(delta)
+            yield delta
+
+    if store is not None:
+        store.add(provider, model, system_prompt, user_prompt, temperature, max_tokens, ''.join(pieces))
+
+def get_response_cache_stats() -> dict:
+    """
+    Returns hit/miss counters of the LLM response store since startup.
+
+    Example:
+    ```
+    get_response_cache_stats()
+    # Output: {'hits': 4, 'misses': 3, 'hit_rate': 0.571}
+    ```
+    """
+    if _response_store is None:
+        return {'hits': 0, 'misses': 0, 'hit_rate': 0.0}
+    return _response_store.stats()
+
+def _groq_model_name(model: str) -> str:
+    model_mapping = {
+        'llama3-8b': 'llama3-8b-8192',
+        'llama3-70b': 'llama3-70b-8192',
+    }
+
+    return model_mapping.get(model, 'mixtral-8x7b-32768')
+
 def groq_inference(
         system_prompt: str, 
         user_prompt: str, 
@@ -20,17 +304,9 @@ def groq_inference(
         timeout_seconds: int = 30
     ) -> str:
 
-    try:
-        groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    except ValueError as e:
-        logging.info(str(e))
-
-    model_mapping = {
-        'llama3-8b': 'llama3-8b-8192',
-        'llama3-70b': 'llama3-70b-8192',
-    }
+    groq_client = get_groq_client()
 
-    model = model_mapping.get(model, 'mixtral-8x7b-32768')
+    model = _groq_model_name(model)
     
     try:
         messages = [
@@ -38,15 +314,21 @@ def groq_inference(
             {'role': 'user', 'content': user_prompt}
         ]
         
-        chat_completion = groq_client.chat.completions.create(
-            model=model,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            timeout=timeout_seconds
-        )
+        def _create():
+            rate_limit.acquire('groq', timeout=timeout_seconds)
+            chat_completion = groq_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=timeout_seconds
+            )
+            return chat_completion.choices[0].message.content
 
-        return chat_completion.choices[0].message.content
+        return _cached_completion('groq', model, system_prompt, user_prompt, temperature, max_tokens, _create)
+    except rate_limit.RateLimitTimeout:
+        # nothing was sent, let the caller time out instead of returning an error as the prompt
+        raise
     except TimeoutError as e:
         logging.info(str(e))
         return "An error occurred during prompt generation."
@@ -59,22 +341,62 @@ def openai_inference(system_prompt: str,
         timeout_seconds: int = 30
     ) -> str:
 
-    try:
-        openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    except ValueError as e:
-        logging.info(str(e))
-    
+    openai_client = get_openai_client()
+
     messages = [
         {"role": "system", "content": system_prompt},
         {'role': 'user', 'content': user_prompt}
     ]
     
-    chat_completion = openai_client.chat.completions.create(
-        model=model,
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=temperature,
-        timeout=timeout_seconds
-    )
+    def _create():
+        rate_limit.acquire('openai', timeout=timeout_seconds)
+        chat_completion = openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=timeout_seconds
+        )
+        return chat_completion.choices[0].message.content
+
+    return _cached_completion('openai', model, system_prompt, user_prompt, temperature, max_tokens, _create)
+
+def groq_inference_stream(
+        system_prompt: str, 
+        user_prompt: str, 
+        model: Literal['llama3-8b', 'llama3-70b', "mixtral-8x7b"], 
+        max_tokens: int = 200, 
+        temperature: float = 0.8, 
+        timeout_seconds: int = 30
+    ):
+    """
+    Same as `groq_inference`, but yields the completion piece by piece while it is generated.
+
+    Example:
+    ```
+    for piece in groq_inference_stream(system_prompt, user_prompt, model='llama3-8b'):
+        print(piece, end='')
+    ```
+    """
+    yield from _stream_completion('groq', get_groq_client(), _groq_model_name(model), system_prompt,
+                                  user_prompt, temperature, max_tokens, timeout_seconds)
+
+def openai_inference_stream(
+        system_prompt: str, 
+        user_prompt: str, 
+        model: Literal['gpt-3.5-turbo', 'gpt-4'], 
+        max_tokens: int = 200, 
+        temperature: float = 0.8, 
+        timeout_seconds: int = 30
+    ):
+    """
+    Same as `openai_inference`, but yields the completion piece by piece while it is generated.
 
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+    Example:
+    ```
+    for piece in openai_inference_stream(system_prompt, user_prompt, model='gpt-3.5-turbo'):
+        print(piece, end='')
+    ```
+    """
+    yield from _stream_completion('openai', get_openai_client(), model, system_prompt,
+                                  user_prompt, temperature, max_tokens, timeout_seconds)
@@ -0,0 +1,245 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from utils.llm_inferences import (
+    groq_inference, openai_inference, groq_inference_stream, openai_inference_stream, served_from_cache
+)
+
+logging.basicConfig(level=logging.INFO)
+
+# models offered in the "Prompt Model" dropdown and the provider serving them
+MODEL_PROVIDERS = {
+    'gpt-3.5-turbo': 'openai',
+    'llama3-8b': 'groq',
+    'llama3-70b': 'groq',
+    'mixtral-8x7b': 'groq',
+}
+
+_INFERENCE_FUNCTIONS = {
+    'openai': openai_inference,
+    'groq': groq_inference,
+}
+
+_STREAM_FUNCTIONS = {
+    'openai': openai_inference_stream,
+    'groq': groq_inference_stream,
+}
+
+class ModelStats:
+    """
+    Rolling latency and error statistics over the last `window` calls of a model.
+    """
+    def __init__(self, window: int = 50):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._errors = deque(maxlen=window)
+
+    def record(self, latency: float, error: bool):
+        with self._lock:
+            if not error:
+                self._latencies.append(latency)
+            self._errors.append(error)
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        """
+        Returns the given percentile (0-1) of successful call latencies in seconds,
+        or None if there are no samples yet.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(percentile * len(latencies)))
+        return latencies[index]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._errors:
+                return 0.0
+            return sum(self._errors) / len(self._errors)
+
+    def samples(self) -> int:
+        with self._lock:
+            return len(self._errors)
+
+class LLMRouter:
+    """
+    Routes prompt generation to the models in `MODEL_PROVIDERS` and keeps rolling
+    latency and error rates for each of them.
+
+    With hedging enabled, the requested model is called first; if it has not answered
+    after its `hedge_percentile` latency (or `hedge_delay` seconds while there are
+    fewer than `min_samples` calls to base the percentile on), the healthiest other
+    model is called as well and whichever answers first wins.
+
+    Args:
+        hedge (bool): Whether slow calls are hedged with a second model.
+        hedge_percentile (float): Latency percentile (0-1) of the primary model after
+                                  which the secondary model is called.
+        hedge_delay (float): Hedge delay in seconds used until enough samples exist.
+        min_samples (int): Number of calls needed before the percentile is trusted.
+        window (int): Number of recent calls the statistics are computed over.
+
+    Example:
+    ```
+    router = LLMRouter(hedge=True, hedge_percentile=0.9)
+    prompt = router.infer(system_prompt, user_prompt, model='llama3-8b')
+    router.stats()
+    # Output: {'llama3-8b': {'provider': 'groq', 'p50': 0.41, 'p95': 0.9, 'error_rate': 0.0, 'samples': 12}, ...}
+    ```
+    """
+    def __init__(
+            self,
+            hedge: bool = False,
+            hedge_percentile: float = 0.9,
+            hedge_delay: float = 2.0,
+            min_samples: int = 5,
+            window: int = 50
+        ):
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self._stats = {model: ModelStats(window) for model in MODEL_PROVIDERS}
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='llm-router')
+
+    def _call(self, model: str, **kwargs) -> str:
+        provider = MODEL_PROVIDERS[model]
+        start = time.perf_counter()
+        try:
+            response = _INFERENCE_FUNCTIONS[provider](model=model, **kwargs)
+        except Exception:
+            self._stats[model].record(time.perf_counter() - start, error=True)
+            raise
+        # responses from the cache say nothing about the provider and would drag the hedge percentile down
+        if not served_from_cache():
+            self._stats[model].record(time.perf_counter() - start, error=False)
+        return response
+
+    def _hedge_delay_for(self, model: str) -> float:
+        stats = self._stats[model]
+        percentile = stats.latency_percentile(self.hedge_percentile)
+        if percentile is None or stats.samples() < self.min_samples:
+            return self.hedge_delay
+        return percentile
+
+    def pick_secondary(self, primary: str) -> str | None:
+        """
+        Returns the model to hedge `primary` with: the one with the lowest error rate,
+        then the lowest median latency, preferring a different provider.
+        """
+        def _score(model):
+            stats = self._stats[model]
+            median = stats.latency_percentile(0.5)
+            same_provider = MODEL_PROVIDERS[model] == MODEL_PROVIDERS[primary]
+            return (stats.error_rate(), same_provider, median if median is not None else self.hedge_delay)
+
+        candidates = [model for model in MODEL_PROVIDERS if model != primary]
+        if not candidates:
+            return None
+        return min(candidates, key=_score)
+
+    def infer(
+            self,
+            system_prompt: str,
+            user_prompt: str,
+            model: str,
+            max_tokens: int = 200,
+            temperature: float = 0.8,
+            timeout_seconds: int = 30,
+            hedge: bool | None = None
+        ) -> str:
+        """
+        Gets a completion for the prompts from `model`, hedging it if enabled.
+
+        Raises:
+            Exception: The error of the primary model if every called model failed.
+        """
+        kwargs = dict(
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout_seconds=timeout_seconds
+        )
+        if not (self.hedge if hedge is None else hedge):
+            return self._call(model, **kwargs)
+
+        primary = self._executor.submit(self._call, model, **kwargs)
+        done, _ = wait([primary], timeout=self._hedge_delay_for(model))
+        if primary in done and primary.exception() is None:
+            return primary.result()
+
+        secondary_model = self.pick_secondary(model)
+        if secondary_model is None:
+            return primary.result()
+
+        logging.info(f"'{model}' is slow or failing, hedging with '{secondary_model}'.")
+        secondary = self._executor.submit(self._call, secondary_model, **kwargs)
+
+        pending = {primary, secondary}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+
+        # both failed, report the error of the requested model
+        return primary.result()
+
+    def stream(
+            self,
+            system_prompt: str,
+            user_prompt: str,
+            model: str,
+            max_tokens: int = 200,
+            temperature: float = 0.8,
+            timeout_seconds: int = 30
+        ):
+        """
+        Yields the completion of `model` piece by piece and records how long the whole
+        stream took. Streams are never hedged, since the first pieces are already shown.
+        """
+        provider = MODEL_PROVIDERS[model]
+        start = time.perf_counter()
+        cached = None
+        try:
+            for piece in _STREAM_FUNCTIONS[provider](
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout_seconds=timeout_seconds
+            ):
+                # read in the thread that produced the first piece, later pieces may be pulled from other threads
+                if cached is None:
+                    cached = served_from_cache()
+                yield piece
+        except Exception:
+            self._stats[model].record(time.perf_counter() - start, error=True)
+            raise
+        if not cached:
+            self._stats[model].record(time.perf_counter() - start, error=False)
+
+    def stats(self) -> dict:
+        return {
+            model: {
+                'provider': MODEL_PROVIDERS[model],
+                'p50': stats.latency_percentile(0.5),
+                'p95': stats.latency_percentile(0.95),
+                'error_rate': stats.error_rate(),
+                'samples': stats.samples(),
+            }
+            for model, stats in self._stats.items()
+        }
+
+router = LLMRouter(
+    hedge=os.getenv('LLM_HEDGE', '0') == '1',
+    hedge_percentile=float(os.getenv('LLM_HEDGE_PERCENTILE', '0.9')),
+    hedge_delay=float(os.getenv('LLM_HEDGE_DELAY', '2.0'))
+)
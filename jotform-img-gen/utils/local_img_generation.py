@@ -1,20 +1,175 @@
+import os
+import json
+import asyncio
 import logging
 import base64
+import threading
 import requests
+from concurrent.futures import Future, InvalidStateError
 from typing import Tuple
+from dotenv import load_dotenv
 
+from utils.a1111_pool import BackendPool, A1111_URLS
+from utils.checkpoint_scheduler import CheckpointScheduler, Job
+from utils.txt2img_store import Txt2ImgStore, payload_key
+from utils.pipeline_image import PipelineImage
+from utils import micro_batch
+
+# Load the .env file
+load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
-def generate_img(
+# seconds after which a queued job runs even if another checkpoint is loaded
+A1111_MAX_QUEUE_WAIT = float(os.getenv('A1111_MAX_QUEUE_WAIT', '60'))
+# assumed seconds to load a checkpoint until the first swap has been measured
+A1111_SWAP_COST = float(os.getenv('A1111_SWAP_COST', '20'))
+# maximum number of compatible single image requests sent as one call, 1 turns micro-batching off
+A1111_MICRO_BATCH = int(os.getenv('A1111_MICRO_BATCH', '1'))
+# seconds a request waits for compatible requests to batch it with
+A1111_MICRO_BATCH_WINDOW = float(os.getenv('A1111_MICRO_BATCH_WINDOW', '0.05'))
+
+_pool = None
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+_store = None
+_store_lock = threading.Lock()
+
+# identical payloads that are queued or running share one job
+_inflight: dict[str, Job] = {}
+# number of handles waiting for each shared job, by job id
+_subscribers: dict[int, int] = {}
+_inflight_lock = threading.Lock()
+
+class JobHandle:
+    """
+    One caller's view of a txt2img job, possibly shared by identical payloads. The handle
+    has its own future that resolves with the job's, so a caller can stop waiting without
+    affecting the others or the job; every other attribute (`backend`, `payload`, ...)
+    is the job's.
+
+    Example:
+    ```
+    handle = submit_img(img_model, prompt, negative_prompt, seed=42, **parameters)
+    cancel_img(handle)  # only this caller stops waiting while others still share the job
+    ```
+    """
+    def __init__(self, job: Job):
+        self.job = job
+        self.future = Future()
+        # set once `cancel_img` has let go of the job for this caller
+        self.detached = False
+        job.future.add_done_callback(self._resolve)
+
+    def _resolve(self, job_future: Future):
+        # the handle may have been cancelled already
+        try:
+            if job_future.cancelled():
+                self.cancel()
+            elif job_future.exception() is not None:
+                self.future.set_exception(job_future.exception())
+            else:
+                self.future.set_result(job_future.result())
+        except InvalidStateError:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self.job, name)
+
+    def cancel(self):
+        # a cancelled future only counts as done for `wait` once waiters are notified
+        if not self.future.done() and self.future.cancel():
+            self.future.set_running_or_notify_cancel()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return Job.wait(self, timeout)
+
+    def result(self, timeout: float | None = None):
+        return self.future.result(timeout=timeout)
+
+def _get_store() -> Txt2ImgStore | None:
+    """
+    Returns the shared txt2img result store, or None if it is disabled with `TXT2IMG_CACHE=0`.
+    """
+    global _store
+    if os.getenv('TXT2IMG_CACHE', '1') == '0':
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = Txt2ImgStore(
+                    db_path=os.getenv('TXT2IMG_CACHE_PATH', '.cache/txt2img.sqlite3'),
+                    max_bytes=int(os.getenv('TXT2IMG_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+                )
+    return _store
+
+def get_txt2img_store_stats() -> dict | None:
+    store = _get_store()
+    return store.stats() if store is not None else None
+
+def get_pool() -> BackendPool:
+    """
+    Returns the shared pool of the web UIs in `A1111_URLS`.
+    """
+    get_scheduler()
+    return _pool
+
+def _store_result(job: Job, response: dict):
+    key, store = payload_key(job.payload), _get_store()
+    if key is not None and store is not None and not job.interrupted:
+        store.put(key, response)
+
+def _run_job(job: Job) -> dict:
+    response = _pool.txt2img(job.payload, on_backend=lambda backend: setattr(job, 'backend', backend))
+    _store_result(job, response)
+    return response
+
+def _run_batch(jobs: list) -> list:
+    """
+    Runs compatible single image jobs as one call of the web UI's prompts script and
+    splits the response back into one response per job.
+    """
+    def _on_backend(backend):
+        for job in jobs:
+            job.backend = backend
+
+    payloads = [job.payload for job in jobs]
+    logging.info(f"Sending {len(jobs)} compatible txt2img requests as one call.")
+    response = _pool.txt2img(micro_batch.merge_payloads(payloads), on_backend=_on_backend)
+    responses = micro_batch.split_response(response, payloads)
+    for job, job_response in zip(jobs, responses):
+        _store_result(job, job_response)
+    return responses
+
+def get_scheduler() -> CheckpointScheduler:
+    """
+    Returns the shared scheduler that orders txt2img jobs by checkpoint, with one worker per web UI.
+    """
+    global _pool, _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _pool = BackendPool(A1111_URLS)
+                _scheduler = CheckpointScheduler(
+                    run_job=_run_job,
+                    max_wait=A1111_MAX_QUEUE_WAIT,
+                    swap_cost=A1111_SWAP_COST,
+                    workers=len(_pool),
+                    warm_checkpoints=_pool.idle_checkpoints,
+                    batch_key=micro_batch.batch_key,
+                    run_batch=_run_batch,
+                    max_batch=A1111_MICRO_BATCH,
+                    batch_window=A1111_MICRO_BATCH_WINDOW
+                )
+    return _scheduler
+
+def build_txt2img_payload(
         img_model: str,
         prompt: str,
         negative_prompt: str,
         **kwargs
-    ) -> Tuple[bytes, str]:
-    
-    """ Take image Stable Diffusion parameters and make API call to sd-auto Docker endpoint"""
-
-    url = "http://127.0.0.1:7860"
+    ) -> dict:
+    """ Turn the UI's Stable Diffusion parameters into a txt2img payload for the sd-auto API"""
 
     # Check for Lora
     use_detailed_hands_lora = kwargs.get('use_detailed_hands_lora', False)
@@ -23,10 +178,10 @@ def generate_img(
     use_sdxl_lightning_8step_lora = kwargs.get('use_8step_lora', False)
 
     if use_detailed_hands_lora:
-        prompt += " <lora:detailed_hands:1>" # you can change 1, it needs to be between 0-1
+        prompt += " <lora:detailed_hands:1>" # you can change 1, it needs to be between 0-1
         logging.info("Using 'Detailed Hands Lora'")
     if use_white_bg_lora:
-        prompt += " <lora:white_1_0:1>" # you can change 1, it needs to be between 0-1
+        prompt += " <lora:white_1_0:1>" # you can change 1, it needs to be between 0-1
         logging.info("Using 'White Background Lora'")
     if use_sdxl_lightning_4step_lora:
         prompt += " <lora:sdxl_lightning_4step_lora:1>"
@@ -42,7 +197,7 @@ def generate_img(
         "sampler_name": kwargs.get('sampling_method'),
         "scheduler": kwargs.get('schedule_type'),
         "batch_size": kwargs.get('batch_size'),
-        "n_iter": kwargs.get('batch_count'), # ToDo: This may not be related to batch count
+        "n_iter": kwargs.get('batch_count'), # ToDo: This may not be related to batch count
         "steps": kwargs.get('sampling_steps'),
         "cfg_scale": kwargs.get('cfg_scale'),
         "width": kwargs.get('width'),
@@ -53,15 +208,211 @@ def generate_img(
     }
     logging.info(f"Payload: {payload}")
 
-    response = requests.post(url=f'{url}/sdapi/v1/txt2img', json=payload)
+    return payload
+
+class GeneratedBatch:
+    """
+    All images of a txt2img response (batch count x batch size) with their own seed and
+    generation info. Images stay base64 encoded until one is requested, so large batches
+    are never held decoded all at once.
+
+    Example:
+    ```
+    batch = batch_from_job(job)
+    for i in range(len(batch)):
+        image, info = batch.image(i), batch.image_info(i)
+    ```
+    """
+    def __init__(self, r: dict):
+        self._images = r['images']
+        self.info: str = r['info'] # string of dictionary containing parameters and generation info
+        self._info = json.loads(self.info.replace("\n", "\\n"))
+        # with "Return grid" enabled the web UI puts a grid of the whole batch first
+        self._first = self._info.get('index_of_first_image', 0)
+
+    def __len__(self):
+        return len(self._images) - self._first
 
-    r = response.json()
+    def _nth(self, key: str, index: int, aligned_with_images: bool = False):
+        values = self._info.get(key) or []
+        position = self._first + index if aligned_with_images else index
+        return values[position] if position < len(values) else None
 
-    response.raise_for_status()
+    def image_bytes(self, index: int) -> bytes:
+        return base64.b64decode(self._images[self._first + index])
 
-    image = r['images'][0]
-    info:str = r['info'] # string of dictionary containing parameters and generation info
+    def image(self, index: int) -> PipelineImage:
+        return PipelineImage(encoded=self.image_bytes(index))
+
+    def seed(self, index: int) -> int | None:
+        seed = self._nth('all_seeds', index)
+        return self._info.get('seed') if seed is None else seed
+
+    def image_info(self, index: int) -> str:
+        """
+        Returns the generation info of one image, in the format of the web UI's `info`
+        but with that image's seed, subseed, prompts and infotext.
+        """
+        info = dict(self._info)
+        info['batch_index'] = index
+        for key, per_image_key in (('seed', 'all_seeds'), ('subseed', 'all_subseeds'),
+                                   ('prompt', 'all_prompts'), ('negative_prompt', 'all_negative_prompts')):
+            value = self._nth(per_image_key, index)
+            if value is not None:
+                info[key] = value
+        infotext = self._nth('infotexts', index, aligned_with_images=len(self._info.get('infotexts') or []) == len(self._images))
+        if infotext is not None:
+            info['infotexts'] = [infotext]
+        return json.dumps(info, ensure_ascii=False)
+
+def _first_image(r: dict) -> Tuple[bytes, str]:
+    batch = GeneratedBatch(r)
+
+    return batch.image_bytes(0), batch.info
+
+def submit_img(
+        img_model: str,
+        prompt: str,
+        negative_prompt: str,
+        **kwargs
+    ) -> Job:
     
-    image_bytes = base64.b64decode(image)
+    """ Queue a txt2img job, use `describe_job` for its queue status and `job.result()` for the response.
+    With a fixed seed, stored results are returned without using the GPU and identical
+    payloads that are already queued or running share their job"""
+
+    payload = build_txt2img_payload(img_model, prompt, negative_prompt, **kwargs)
+
+    key, store = payload_key(payload), _get_store()
+    if key is None or store is None:
+        return JobHandle(get_scheduler().submit(payload))
+
+    response = store.get(key)
+    if response is not None:
+        logging.info("Using the stored result of an identical txt2img payload.")
+        job = Job(payload)
+        job.future.set_result(response)
+        return job
+
+    with _inflight_lock:
+        job = _inflight.get(key)
+        if job is not None:
+            _subscribers[job.id] += 1
+            logging.info("Waiting for the identical txt2img job that is already queued or running.")
+            return JobHandle(job)
+        job = get_scheduler().submit(payload)
+        _inflight[key] = job
+        _subscribers[job.id] = 1
+
+    def _forget(_):
+        with _inflight_lock:
+            _inflight.pop(key, None)
+            _subscribers.pop(job.id, None)
+
+    job.future.add_done_callback(_forget)
+    return JobHandle(job)
+
+def describe_job(job: Job | JobHandle) -> str:
+    return get_scheduler().describe(job.job if isinstance(job, JobHandle) else job)
+
+def job_progress(job: Job | JobHandle) -> dict | None:
+    """ Return the web UI's progress for a running job, including a base64 `current_image` preview once the web UI has one"""
+
+    if job.backend is None or job.future.done():
+        return None
+    try:
+        # polls should fail fast instead of retrying
+        return job.backend.health_client.progress(skip_current_image=False)
+    except requests.RequestException as e:
+        logging.info(f"Could not get progress from {job.backend.url}: {str(e)}")
+        return None
+
+def describe_progress(progress: dict) -> str:
+    state = progress.get('state') or {}
+    message = f"Generating... {progress.get('progress', 0) * 100:.0f}%"
+    if state.get('sampling_steps'):
+        message += f", step {state.get('sampling_step', 0)}/{state['sampling_steps']}"
+    if state.get('job_count', 0) > 1:
+        message += f", image {state.get('job_no', 0) + 1}/{state['job_count']}"
+    if progress.get('eta_relative'):
+        message += f", ~{progress['eta_relative']:.0f}s left"
+    return message + "."
+
+def cancel_img(job: Job | JobHandle) -> bool:
+    """ Take a job out of the queue, or interrupt it on its web UI if it is already running.
+    Cancelling the handle of a shared job only stops that caller from waiting; the job itself
+    is cancelled once no handle is left. A job running in a micro-batch, or sent to a web UI
+    that has other requests as well, is not interrupted, since that could stop other jobs;
+    its caller only stops waiting"""
+
+    if isinstance(job, JobHandle):
+        handle, job = job, job.job
+        with _inflight_lock:
+            if handle.future.done() or handle.detached:
+                return False
+            handle.detached = True
+            # only shared jobs are counted, any other handle is the job's only one
+            last = True
+            if job.id in _subscribers:
+                _subscribers[job.id] -= 1
+                last = _subscribers[job.id] <= 0
+        if not last or not _cancel_job(job):
+            handle.cancel()
+        return True
+    return _cancel_job(job)
+
+def _cancel_job(job: Job) -> bool:
+    if get_scheduler().cancel(job):
+        return True
+    if job.batch is not None and len(job.batch) > 1:
+        return False
+    if job.backend is not None and not job.future.done():
+        # the web UI runs its requests one after another and an interrupt stops whichever
+        # runs right now, which is only known to be this job if no other one was sent there
+        if job.backend.outstanding != 1:
+            return False
+        job.interrupted = True
+        try:
+            job.backend.client.interrupt()
+        except requests.RequestException as e:
+            logging.info(f"Could not interrupt the job on {job.backend.url}: {str(e)}")
+            job.interrupted = False
+            return False
+        return True
+    return False
+
+def image_from_job(job: Job) -> Tuple[bytes, str]:
+    """ Wait for a job from `submit_img` and return its first image and generation info"""
+
+    return _first_image(job.result())
+
+def batch_from_job(job: Job) -> GeneratedBatch:
+    """ Wait for a job from `submit_img` and return all of its images"""
+
+    return GeneratedBatch(job.result())
+
+def generate_img(
+        img_model: str,
+        prompt: str,
+        negative_prompt: str,
+        **kwargs
+    ) -> Tuple[bytes, str]:
+    
+    """ Take image Stable Diffusion parameters and make API call to sd-auto Docker endpoint"""
+
+    job = submit_img(img_model, prompt, negative_prompt, **kwargs)
+
+    return image_from_job(job)
+
+async def agenerate_img(
+        img_model: str,
+        prompt: str,
+        negative_prompt: str,
+        **kwargs
+    ) -> Tuple[bytes, str]:
+    
+    """ Async version of `generate_img` for async Gradio event handlers"""
+
+    job = submit_img(img_model, prompt, negative_prompt, **kwargs)
 
-    return image_bytes, info
\ No newline at end of file
+    return _first_image(await asyncio.wrap_future(job.future))
@@ -1,5 +1,7 @@
+from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
 
@@ -7,12 +9,22 @@ import io
 import os
 import logging
 import json
+import threading
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
+from utils import timing
+
 logging.basicConfig(level=logging.INFO)
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
 
+def _client_options(api_url_variable: str) -> dict | None:
+    # e.g. GOOGLE_DRIVE_API_URL=http://127.0.0.1:8080/drive/v3/ to talk to a local stand-in
+    load_dotenv()
+    api_url = os.getenv(api_url_variable)
+    return {'api_endpoint': api_url} if api_url else None
+
 def find_file(filename):
     for root, dirs, files in os.walk('.'):
         if filename in files:
@@ -24,11 +36,109 @@ def load_env_variables():
     try:
         FOLDER_ID = os.getenv("FOLDER_ID")
         SHEET_ID = os.getenv("SHEET_ID")
-        SERVICE_ACCOUNT_FILE = find_file(str(os.getenv("SERVICE_ACCOUNT_FILE")))
+        SERVICE_ACCOUNT_FILE = str(os.getenv("SERVICE_ACCOUNT_FILE"))
+        # a path is used as is, a bare file name is looked for below the working directory
+        if os.path.isfile(SERVICE_ACCOUNT_FILE):
+            SERVICE_ACCOUNT_FILE = os.path.abspath(SERVICE_ACCOUNT_FILE)
+        else:
+            SERVICE_ACCOUNT_FILE = find_file(SERVICE_ACCOUNT_FILE)
         return (FOLDER_ID, SHEET_ID, SERVICE_ACCOUNT_FILE)
     except ValueError as e:
         logging.info(str(e))
 
+_discovery_documents = {}
+_discovery_documents_lock = threading.Lock()
+
+def _discovery_document(service_name: str, version: str) -> dict:
+    """
+    Returns the discovery document of an API bundled with google-api-python-client,
+    parsed on the first call only, so building a service neither fetches nor parses it.
+
+    Raises:
+        ValueError: If no discovery document is bundled for the API.
+    """
+    key = (service_name, version)
+    if key not in _discovery_documents:
+        with _discovery_documents_lock:
+            if key not in _discovery_documents:
+                document = get_static_doc(service_name, version)
+                if document is None:
+                    raise ValueError(f"No bundled discovery document for {service_name} {version}.")
+                _discovery_documents[key] = json.loads(document)
+    return _discovery_documents[key]
+
+def _build_service(service_name: str, version: str, credentials: Credentials, api_url_variable: str):
+    document = _discovery_document(service_name, version)
+    client_options = _client_options(api_url_variable)
+    if client_options:
+        # media uploads keep the scheme of the document's root URL, so it has to point to
+        # the same server as the API URL, e.g. a local stand-in without TLS
+        api_url = urlparse(client_options['api_endpoint'])
+        document = {**document, 'rootUrl': f"{api_url.scheme}://{api_url.netloc}/"}
+    return build_from_document(document, credentials=credentials, client_options=client_options)
+
+class GoogleClients:
+    """
+    The Sheets and Drive services `log_image` writes with, set up once and shared by
+    every request instead of for every logged image.
+
+    The service account credentials are loaded once and their access token is refreshed
+    under a lock when it expires, so concurrent requests neither fetch a token each nor
+    refresh it at the same time. The services are built from the bundled discovery
+    documents, so no discovery document is fetched. Each thread builds its own services
+    once, because their HTTP connections must not be used by two threads at a time.
+
+    Args:
+        folder_id (str | None): Drive folder the images are uploaded to.
+        spreadsheet_id (str): Spreadsheet the rows are appended to.
+        service_account_file (str): Path of the service account key file.
+
+    Example:
+    ```
+    clients = GoogleClients(*load_env_variables())
+    sheets_service, drive_service = clients.services()
+    ```
+    """
+    def __init__(self, folder_id: str | None, spreadsheet_id: str, service_account_file: str):
+        self.folder_id = folder_id
+        self.spreadsheet_id = spreadsheet_id
+        self.credentials = Credentials.from_service_account_file(service_account_file, scopes=SCOPES)
+        self._token_lock = threading.Lock()
+        self._token_request = Request()
+        self._local = threading.local()
+
+    def _refresh_token(self):
+        with self._token_lock:
+            if not self.credentials.valid:
+                self.credentials.refresh(self._token_request)
+
+    def services(self) -> tuple:
+        """
+        Returns the Sheets and Drive services of the calling thread with a valid access token.
+        """
+        self._refresh_token()
+        if not hasattr(self._local, 'services'):
+            self._local.services = (
+                _build_service('sheets', 'v4', self.credentials, 'GOOGLE_SHEETS_API_URL'),
+                _build_service('drive', 'v3', self.credentials, 'GOOGLE_DRIVE_API_URL'),
+            )
+        return self._local.services
+
+_google_clients = None
+_google_clients_lock = threading.Lock()
+
+def get_google_clients() -> GoogleClients:
+    """
+    Returns the shared `GoogleClients` configured by `FOLDER_ID`, `SHEET_ID` and
+    `SERVICE_ACCOUNT_FILE`, creating them on first use.
+    """
+    global _google_clients
+    if _google_clients is None:
+        with _google_clients_lock:
+            if _google_clients is None:
+                _google_clients = GoogleClients(*load_env_variables())
+    return _google_clients
+
 def upload_image_bytes_to_drive(drive_service, image_bytes, image_name, folder_id, mime_type='image/png'):
     image_name += '.png'
     file_metadata = {'name': image_name}
@@ -67,7 +177,7 @@ def get_or_create_sheet(sheets_service, spreadsheet_id, sheet_name):
         raise
 
 def append_image_to_sheet(sheets_service, drive_service, spreadsheet_id, sheet_name, 
-                          image_bytes, image_name, rating, info, folder_id, user):
+                          image_bytes, image_name, rating, info, folder_id, user, sheet_id=None):
     info = json.loads(info.replace("\n", "\\n"))
     assert type(info) == dict, f"info must be of type dict not {type(info)}"
 
@@ -146,15 +256,18 @@ def append_image_to_sheet(sheets_service, drive_service, spreadsheet_id, sheet_n
         adjust_cell_size(sheets_service=sheets_service, spreadsheet_id=spreadsheet_id, 
                          sheet_name=sheet_name, row_index=next_row, 
                          column_index=headers.index('Image'),
-                         is_empty_sheet=is_empty_sheet
+                         is_empty_sheet=is_empty_sheet, sheet_id=sheet_id
         )
 
         logging.info(f"Data appended to row {next_row}. {result.get('updates').get('updatedCells')} cells updated.")
     except HttpError as err:
         logging.info(f"An error occurred: {err}")
 
-def adjust_cell_size(sheets_service, spreadsheet_id, sheet_name, row_index, column_index, is_empty_sheet):
+def adjust_cell_size(sheets_service, spreadsheet_id, sheet_name, row_index, column_index, is_empty_sheet, sheet_id=None):
     try:
+        if sheet_id is None:
+            sheet_id = get_sheet_id(sheets_service, spreadsheet_id, sheet_name)
+
         # Set row height and column width (adjust the size as needed)
         row_height = 300  # in pixels
         column_width = 300  # in pixels
@@ -165,7 +278,7 @@ def adjust_cell_size(sheets_service, spreadsheet_id, sheet_name, row_index, colu
             {
                 "updateDimensionProperties": {
                     "range": {
-                        "sheetId": get_sheet_id(sheets_service, spreadsheet_id, sheet_name),
+                        "sheetId": sheet_id,
                         "dimension": "ROWS",
                         "startIndex": row_index - 1,
                         "endIndex": row_index
@@ -179,7 +292,7 @@ def adjust_cell_size(sheets_service, spreadsheet_id, sheet_name, row_index, colu
             {
                 "updateDimensionProperties": {
                     "range": {
-                        "sheetId": get_sheet_id(sheets_service, spreadsheet_id, sheet_name),
+                        "sheetId": sheet_id,
                         "dimension": "COLUMNS",
                         "startIndex": column_index,
                         "endIndex": column_index + 1
@@ -222,29 +335,26 @@ def log_image(
         user: str,
         form_id: int
     ):
-    folder_id, spreadsheet_id, service_account_file = load_env_variables()
+    with timing.stage('log_image'):
+        return _log_image(image_bytes, image_name, rating, info, user, form_id)
 
-    # Use service account credentials
-    creds = Credentials.from_service_account_file(
-        service_account_file,
-        scopes=SCOPES
-    )
+def _log_image(image_bytes, image_name, rating, info, user, form_id):
+    clients = get_google_clients()
 
     try:
-        # Create Google Sheets and Drive service
-        sheets_service = build('sheets', 'v4', credentials=creds)
-        drive_service = build('drive', 'v3', credentials=creds)
+        # Google Sheets and Drive services of this thread
+        sheets_service, drive_service = clients.services()
 
         # Determine the sheet name based on form_id
         sheet_name = f"Form_{form_id}" if form_id else "Logs"
 
         # Ensure the sheet exists
-        get_or_create_sheet(sheets_service, spreadsheet_id, sheet_name)
+        sheet_id = get_or_create_sheet(sheets_service, clients.spreadsheet_id, sheet_name)
 
         # Append the image and data to the sheet
-        append_image_to_sheet(sheets_service, drive_service, spreadsheet_id, 
+        append_image_to_sheet(sheets_service, drive_service, clients.spreadsheet_id, 
                               sheet_name, image_bytes, image_name, rating, 
-                              info, folder_id, user)
+                              info, clients.folder_id, user, sheet_id=sheet_id)
 
         return f"The image and associated data were successfully logged to sheet '{sheet_name}'."
 
@@ -0,0 +1,133 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls for the same key.
+
+    While a call for a key is running, other callers asking for the same key
+    wait for that call and receive its result (or its exception) instead of
+    starting their own.
+
+    Example:
+    ```
+    flight = SingleFlight()
+    title = flight.do(form_id, lambda: fetch_title(form_id))
+    ```
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+        return future.result()
+
+class TTLLRUStore:
+    """
+    Thread-safe in-memory key/value store with a time-to-live per entry,
+    least-recently-used eviction once `max_size` entries are stored and
+    single-flight loading of missing keys.
+
+    Args:
+        max_size (int): Maximum number of entries kept in memory.
+        ttl_seconds (float): Number of seconds an entry stays valid.
+
+    Example:
+    ```
+    store = TTLLRUStore(max_size=256, ttl_seconds=300)
+    properties = store.get_or_load((form_id, 'properties'), lambda: fetch_properties(form_id))
+    print(store.stats())
+    # Output: {'hits': 3, 'misses': 1, 'evictions': 0, 'size': 1}
+    ```
+    """
+    def __init__(self, max_size: int = 256, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._flight = SingleFlight()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+            self._misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Returns the stored value for `key`, calling `loader` to fill it on a miss.
+        Concurrent misses for the same key share a single `loader` call.
+        Exceptions raised by `loader` are propagated and nothing is stored.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+
+        def _load():
+            # another caller may have filled the entry while we were waiting
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    return entry[1]
+            loaded = loader()
+            self.set(key, loaded)
+            return loaded
+
+        return self._flight.do(key, _load)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'size': len(self._entries),
+            }
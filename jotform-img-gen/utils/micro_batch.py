@@ -0,0 +1,82 @@
+import copy
+import json
+import shlex
+
+# the web UI script that runs one generation per line of its textbox
+PROMPTS_SCRIPT = 'prompts from file or textbox'
+
+# payload fields every request of a micro-batch can set on its own
+_PER_REQUEST_FIELDS = ('prompt', 'negative_prompt', 'seed')
+
+def batch_key(payload: dict) -> str | None:
+    """
+    Returns a key that is equal for txt2img payloads that can be sent together as one
+    micro-batch, or None if the payload cannot be batched.
+
+    Payloads are compatible when everything but the prompt, negative prompt and seed
+    is equal (checkpoint, size, sampler, scheduler, steps, CFG scale, ...). Payloads
+    producing more than one image or already using a script are never batched.
+
+    Example:
+    ```
+    batch_key({"prompt": "a cat", "seed": 1, "steps": 30, "batch_size": 1, "n_iter": 1})
+    # Output: '{"batch_size":1,"n_iter":1,"steps":30}'
+    ```
+    """
+    if (payload.get('batch_size') or 1) != 1 or (payload.get('n_iter') or 1) != 1:
+        return None
+    if payload.get('script_name'):
+        return None
+    shared = {key: value for key, value in payload.items() if key not in _PER_REQUEST_FIELDS}
+    return json.dumps(shared, sort_keys=True, separators=(',', ':'))
+
+def _prompt_line(payload: dict) -> str:
+    line = f"--prompt {shlex.quote(payload.get('prompt') or '')}"
+    if payload.get('negative_prompt'):
+        line += f" --negative_prompt {shlex.quote(payload['negative_prompt'])}"
+    if payload.get('seed') is not None:
+        line += f" --seed {int(payload['seed'])}"
+    return line
+
+def merge_payloads(payloads: list) -> dict:
+    """
+    Merges compatible payloads (see `batch_key`) into one txt2img payload that runs the
+    web UI's "Prompts from file or textbox" script with one line per payload, so every
+    request keeps its own prompt, negative prompt and seed.
+    """
+    merged = copy.deepcopy(payloads[0])
+    merged['prompt'] = ''
+    merged['negative_prompt'] = ''
+    merged['script_name'] = PROMPTS_SCRIPT
+    # iterate seed, iterate seed per line, prompt position, prompt lines
+    merged['script_args'] = [False, False, 'start', '\n'.join(_prompt_line(payload) for payload in payloads)]
+    return merged
+
+def split_response(response: dict, payloads: list) -> list:
+    """
+    Splits the response of a merged payload into one txt2img response per payload,
+    each with its own image and an `info` describing only that image.
+
+    Raises:
+        ValueError: If the response does not hold exactly one image per payload.
+    """
+    images = response['images']
+    if len(images) != len(payloads):
+        raise ValueError(f"Expected {len(payloads)} images from the micro-batch, got {len(images)}.")
+
+    info = json.loads(response['info'].replace("\n", "\\n"))
+    responses = []
+    for index, payload in enumerate(payloads):
+        image_info = dict(info)
+        image_info['prompt'] = payload.get('prompt')
+        image_info['negative_prompt'] = payload.get('negative_prompt')
+        for key, per_image_key in (('seed', 'all_seeds'), ('subseed', 'all_subseeds'), ('prompt', 'all_prompts'),
+                                   ('negative_prompt', 'all_negative_prompts'), (None, 'infotexts')):
+            values = info.get(per_image_key) or []
+            if index < len(values):
+                image_info[per_image_key] = [values[index]]
+                if key is not None:
+                    image_info[key] = values[index]
+        image_info['index_of_first_image'] = 0
+        responses.append({'images': [images[index]], 'info': json.dumps(image_info, ensure_ascii=False)})
+    return responses
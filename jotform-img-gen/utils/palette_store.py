@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO)
+
+class PaletteStore:
+    """
+    SQLite-backed store for logo color palettes and their structured color descriptions.
+
+    Palettes are content-addressed: they are stored under the SHA-256 hash of the logo
+    file, and the logo URL only points to that hash together with the `ETag` and
+    `Last-Modified` headers needed to revalidate it. Color descriptions are stored per
+    palette and per naming method, so the same colors are never described twice.
+
+    Once the stored rows exceed `max_bytes`, the least recently used palettes are evicted.
+
+    Args:
+        db_path (str): Path to the SQLite database file. Created if it does not exist.
+        max_bytes (int): Approximate upper bound for the size of the stored rows.
+
+    Example:
+    ```
+    store = PaletteStore(".cache/palettes.sqlite3")
+    content_hash = PaletteStore.hash_content(logo_bytes)
+    store.put_palette(content_hash, [(255, 87, 51), (34, 34, 34)])
+    store.get_palette(content_hash)
+    # Output: [[255, 87, 51], [34, 34, 34]]
+    ```
+    """
+    def __init__(self, db_path: str, max_bytes: int = 8 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS logos (
+                    url TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT
+                );
+                CREATE TABLE IF NOT EXISTS palettes (
+                    content_hash TEXT PRIMARY KEY,
+                    palette TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS descriptions (
+                    palette TEXT NOT NULL,
+                    namer TEXT NOT NULL,
+                    descriptions TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (palette, namer)
+                );
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # commits (or rolls back) and closes the connection when the block ends
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _palette_json(palette: list) -> str:
+        # palette extractors return numpy integers, which JSON cannot encode
+        return json.dumps([[int(value) for value in color] for color in palette])
+
+    @staticmethod
+    def hash_content(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def get_logo(self, url: str) -> dict | None:
+        """
+        Returns the stored validators of a logo URL as a dict with the keys
+        `content_hash`, `etag` and `last_modified`, or None if the URL is unknown.
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT content_hash, etag, last_modified FROM logos WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'content_hash': row[0], 'etag': row[1], 'last_modified': row[2]}
+
+    def put_logo(self, url: str, content_hash: str, etag: str | None, last_modified: str | None):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO logos (url, content_hash, etag, last_modified) VALUES (?, ?, ?, ?)",
+                (url, content_hash, etag, last_modified)
+            )
+
+    def get_palette(self, content_hash: str) -> list | None:
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT palette FROM palettes WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE palettes SET last_used = ? WHERE content_hash = ?", (time.time(), content_hash)
+            )
+        return json.loads(row[0])
+
+    def put_palette(self, content_hash: str, palette: list):
+        palette_json = self._palette_json(palette)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO palettes (content_hash, palette, size, last_used) VALUES (?, ?, ?, ?)",
+                (content_hash, palette_json, len(content_hash) + len(palette_json), time.time())
+            )
+            self._evict(conn)
+
+    def get_descriptions(self, palette: list, namer: str) -> str | None:
+        palette_json = self._palette_json(palette)
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT descriptions FROM descriptions WHERE palette = ? AND namer = ?", (palette_json, namer)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE descriptions SET last_used = ? WHERE palette = ? AND namer = ?",
+                (time.time(), palette_json, namer)
+            )
+        return row[0]
+
+    def put_descriptions(self, palette: list, namer: str, descriptions: str):
+        palette_json = self._palette_json(palette)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO descriptions (palette, namer, descriptions, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (palette_json, namer, descriptions, len(palette_json) + len(namer) + len(descriptions), time.time())
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """
+        Deletes the least recently used palettes and descriptions until the stored rows
+        fit into `max_bytes`. Logo URLs pointing to an evicted palette are removed too.
+        """
+        total = conn.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM palettes) + (SELECT COALESCE(SUM(size), 0) FROM descriptions)"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = conn.execute("""
+            SELECT 'palettes', content_hash, NULL, size, last_used FROM palettes
+            UNION ALL
+            SELECT 'descriptions', palette, namer, size, last_used FROM descriptions
+            ORDER BY last_used ASC
+        """).fetchall()
+        for table, key, namer, size, _ in rows:
+            if total <= self.max_bytes:
+                break
+            if table == 'palettes':
+                conn.execute("DELETE FROM palettes WHERE content_hash = ?", (key,))
+                conn.execute("DELETE FROM logos WHERE content_hash = ?", (key,))
+            else:
+                conn.execute("DELETE FROM descriptions WHERE palette = ? AND namer = ?", (key, namer))
+            total -= size
+        logging.info(f"Evicted palette store entries, {total} bytes remaining.")
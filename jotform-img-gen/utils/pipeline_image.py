@@ -0,0 +1,73 @@
+import base64
+import PIL.Image
+from io import BytesIO
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+class PipelineImage:
+    """
+    An image handed between the stages of image generation (txt2img, background removal,
+    the Gradio output and logging) that is decoded at most once and encoded lazily.
+
+    An image made from encoded bytes hands out those same bytes for as long as no stage
+    needs pixels, so a PNG from the web UI can be saved or logged without ever being
+    decoded. Once a stage asks for `pil()`, the decoded image is kept and reused by every
+    later stage. Encodings are produced only for the formats consumers ask for, and each
+    format is encoded only once.
+
+    Args:
+        encoded (bytes | None): The encoded image, e.g. a PNG from the txt2img API.
+        image (PIL.Image.Image | None): The decoded image. One of the two is required.
+
+    Example:
+    ```
+    image = PipelineImage.from_base64(response['images'][0])
+    png_bytes = image.encode('PNG')  # the bytes from the web UI, nothing is decoded
+    image = PipelineImage(image=remove(image.pil()))  # decoded once for rembg
+    png_bytes = image.encode('PNG')  # encoded once for the browser and logging
+    ```
+    """
+    def __init__(self, encoded: bytes | None = None, image: PIL.Image.Image | None = None):
+        if encoded is None and image is None:
+            raise ValueError("Either encoded bytes or a decoded image is required.")
+        self._image = image
+        self._encodings: dict[str, bytes] = {}
+        if encoded is not None:
+            self._encodings[self._detect_format(encoded)] = encoded
+        self.decodes = 0
+        self.encodes = 0
+
+    @classmethod
+    def from_base64(cls, data: str) -> 'PipelineImage':
+        return cls(encoded=base64.b64decode(data))
+
+    @staticmethod
+    def _detect_format(encoded: bytes) -> str:
+        if encoded.startswith(_PNG_SIGNATURE):
+            return 'PNG'
+        with PIL.Image.open(BytesIO(encoded)) as image:
+            return image.format
+
+    def pil(self) -> PIL.Image.Image:
+        """
+        Returns the decoded image, decoding it on the first call only.
+        Stages must not modify it in place; they return a new `PipelineImage` instead.
+        """
+        if self._image is None:
+            encoded = next(iter(self._encodings.values()))
+            self._image = PIL.Image.open(BytesIO(encoded))
+            self._image.load()
+            self.decodes += 1
+        return self._image
+
+    def encode(self, format: str = 'PNG') -> bytes:
+        """
+        Returns the image encoded as `format`, encoding it on the first request for that format only.
+        """
+        format = format.upper()
+        if format not in self._encodings:
+            buffer = BytesIO()
+            self.pil().save(buffer, format=format)
+            self._encodings[format] = buffer.getvalue()
+            self.encodes += 1
+        return self._encodings[format]
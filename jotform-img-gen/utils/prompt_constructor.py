@@ -1,87 +1,251 @@
+import os
 import json
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal
 from dotenv import load_dotenv
 
-from utils.get_color_palette import get_structured_color_descriptions
-from utils.llm_inferences import groq_inference, openai_inference
+from utils.get_color_palette import get_logo_color_palette, describe_colors
+from utils.llm_router import router
 from utils.prompt_reader import read_prompts_from_file
-from utils.jotform_api import get_title
+from utils.jotform_api import get_title, get_logo_url
+from utils import timing, rate_limit
 
 # Load the .env file
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
+# upper bound in seconds for each stage of prompt construction
+STAGE_TIMEOUTS = {
+    'title': 15,
+    'logo_url': 15,
+    'color_palette': 30,
+    'color_descriptions': 30,
+}
+
+# parameters of the prompt generation call
+LLM_PARAMETERS = {
+    'temperature': 0.8,
+    'max_tokens': 200,
+    'timeout_seconds': 30,
+}
+
+# shared by all requests, the stages are network-bound so threads are enough
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('PROMPT_STAGE_WORKERS', '16')),
+    thread_name_prefix='prompt-stage'
+)
+
+def set_stage_workers(workers: int):
+    """
+    Replaces the stage executor with one of `workers` threads, e.g. two per form that is
+    processed at the same time (its title and its logo chain), so no stage spends its
+    timeout queued behind the stages of other forms.
+    """
+    global _executor
+    previous, _executor = _executor, ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prompt-stage')
+    previous.shutdown(wait=False)
+
+def _run_stage(name: str, timeouts: dict, fn, *args, **kwargs):
+    """
+    Runs `fn` on the stage executor and waits at most `timeouts[name]` seconds for it.
+    Time `fn` spends waiting for a rate limit is not counted, that wait is bounded by
+    the timeout of the call it is made for.
+
+    Raises:
+        TimeoutError: If the stage does not finish in time.
+    """
+    tracker = rate_limit.WaitTracker()
+    future = _executor.submit(tracker.run, fn, *args, **kwargs)
+    started = time.perf_counter()
+    try:
+        with timing.stage(name):
+            while True:
+                remaining = timeouts[name] + tracker.seconds() - (time.perf_counter() - started)
+                try:
+                    return future.result(timeout=max(0, remaining))
+                except TimeoutError:
+                    # the stage's own TimeoutError, or it was still waiting for a rate limit
+                    if future.done() or timeouts[name] + tracker.seconds() - (time.perf_counter() - started) <= 0:
+                        raise
+    except TimeoutError:
+        logging.info(f"Stage '{name}' timed out after {timeouts[name]} seconds.")
+        raise
+
+def _get_color_descriptions(form_id: int, prompt_file_path: str, timeouts: dict):
+    """
+    Runs the logo chain (logo URL -> color palette -> color descriptions), where
+    every stage depends on the previous one.
+
+    Returns:
+        dict: The structured color descriptions, e.g. {"1": "Dark Blue", "2": "Orange"}.
+        None: If the form has no logo.
+
+    Raises:
+        Exception: If any stage fails or times out, or the descriptions are not JSON.
+    """
+    logo_url = _run_stage('logo_url', timeouts, get_logo_url, form_id=form_id)
+    if not logo_url:
+        return None
+    frequent_colors = _run_stage('color_palette', timeouts, get_logo_color_palette, logo_url=logo_url)
+    colors = _run_stage('color_descriptions', timeouts, describe_colors,
+                        frequent_colors=frequent_colors, prompt_file_path=prompt_file_path)
+    return json.loads(colors)
+
+def _build_llm_prompts(prompt_file_path: str, form_id: int, timeouts: dict) -> tuple:
+    """
+    Collects the form title and logo colors concurrently and fills them into the 
+    prompt file, returning the system and user prompts for the LLM and whether the
+    logo colors are in them: True if they are, None if the form has no logo, and False
+    if the logo chain failed or timed out and the prompts were made without them.
+
+    Raises:
+        TimeoutError: If the form title could not be fetched in time.
+    """
+    # Get title of the form while the logo colors are being extracted
+    title_started = time.perf_counter()
+    title_future = _executor.submit(get_title, form_id=form_id)
+    title_future.add_done_callback(
+        lambda future: timing.record('title', time.perf_counter() - title_started, future.exception() is not None)
+    )
+
+    # Get colors of the logo
+    try:
+        colors_json = _get_color_descriptions(form_id, "prompts/color_palette_prompt.txt", timeouts)
+        colors = True if colors_json else None
+    except Exception as e:
+        logging.info(f"Continuing without color extraction: {str(e)}")
+        colors_json, colors = None, False
+
+    try:
+        # the title has been loading while the logo colors were extracted
+        heading = title_future.result(timeout=max(0, timeouts['title'] - (time.perf_counter() - title_started)))
+    except TimeoutError:
+        logging.info(f"Stage 'title' timed out after {timeouts['title']} seconds.")
+        raise
+
+    if colors_json:
+        colors_string = ", ".join(colors_json.values())
+
+        logging.info(f"Color descriptions of logo: {colors_string}")
+
+        # Read pre-defined prompt
+        # either 'avatar image' or 'background image' prompt file can be used here
+        return *read_prompts_from_file(file_path=prompt_file_path, heading=heading, colors_string=colors_string), colors
+
+    # logo form doesn't exist, so we cannot extract colors
+    # we read the prompt that doesn't require colors as input
+    prompt_file_name = prompt_file_path.split('.')[0]
+    new_file_path = prompt_file_name + '_wo_color' + '.txt'
+    return *read_prompts_from_file(file_path=new_file_path, heading=heading), colors
+
 def get_prompt_for_image_gen(
         prompt_file_path: str,
         form_id: int, 
-        model: Literal['llama3-8b', 'llama3-70b', 'mixtral-8x7b', 'gpt-3.5-turbo'] = 'llama3-8b'
+        model: Literal['llama3-8b', 'llama3-70b', 'mixtral-8x7b', 'gpt-3.5-turbo'] = 'llama3-8b',
+        stage_timeouts: dict | None = None
     ):
     """
     Generates a prompt for image generation using structured color descriptions and 
     form details from a JotForm form.
 
+    The form title and the logo chain (logo URL, color palette, color descriptions) 
+    don't depend on each other, so they run concurrently and are only joined right 
+    before the final prompt is requested from the LLM.
+
     Args:
         form_id (int): The ID of the JotForm form.
         model (Literal['llama3-8b', 'llama3-70b', 'mixtral-8x7b']): The model to be used 
               for generating the prompt. Defaults to 'llama3-8b'.
+        stage_timeouts (dict | None): Per-stage timeouts in seconds overriding 
+              `STAGE_TIMEOUTS`. A timed out logo chain falls back to the prompt 
+              without colors.
 
     Returns:
         str: The generated prompt for image generation.
         str: "Timeout" if the request times out.
 
-    Raises:
-        TimeoutError: If the request times out.
-
     Example:
     ```
     prompt = get_prompt_for_image_gen(form_id=1234567890, model='llama3-70b')
     ```
     """
-    # some parameters
-    temperature = 0.8
-    max_tokens = 200
-    timeout_seconds = 30
+    return get_prompt_and_colors_for_image_gen(prompt_file_path, form_id, model, stage_timeouts)[0]
 
-    # Get title of the form
-    heading = get_title(form_id=form_id)
+def get_prompt_and_colors_for_image_gen(
+        prompt_file_path: str,
+        form_id: int, 
+        model: Literal['llama3-8b', 'llama3-70b', 'mixtral-8x7b', 'gpt-3.5-turbo'] = 'llama3-8b',
+        stage_timeouts: dict | None = None
+    ) -> tuple:
+    """
+    Same as `get_prompt_for_image_gen`, but also returns whether the logo colors made it
+    into the prompt, e.g. so a batch can retry forms whose logo chain timed out.
 
-    # Get colors of the logo
-    colors = get_structured_color_descriptions(form_id=form_id, prompt_file_path="prompts/color_palette_prompt.txt")
-    if colors:
-        colors_json = json.loads(colors)
-        colors_string = ", ".join(colors_json.values())
+    Returns:
+        tuple: The prompt (or "Timeout") and True if the logo colors are in it, None if
+               the form has no logo, or False if the logo chain failed or timed out.
 
-        logging.info(f"Color descriptions of logo: {colors_string}")
+    Example:
+    ```
+    prompt, colors = get_prompt_and_colors_for_image_gen("prompts/background_img_prompt.txt", form_id=1234567890)
+    ```
+    """
+    try:
+        system_prompt, user_prompt, colors = _build_llm_prompts(
+            prompt_file_path, form_id, {**STAGE_TIMEOUTS, **(stage_timeouts or {})}
+        )
 
-        # Read pre-defined prompt
-        # either 'avatar image' or 'background image' prompt file can be used here
-        system_prompt, user_prompt = read_prompts_from_file(file_path=prompt_file_path, heading=heading, colors_string=colors_string, len=len)
-    else:
-        # logo form doesn't exist, so we cannot extract colors
-        # we read the prompt that doesn't require colors as input
-        prompt_file_name = prompt_file_path.split('.')[0]
-        new_file_path = prompt_file_name + '_wo_color' + '.txt'
-        system_prompt, user_prompt = read_prompts_from_file(file_path=new_file_path, heading=heading, len=len)
-
-    # Get prompt via LLM for image generation
+        # Get prompt via LLM for image generation
+        with timing.stage('prompt'):
+            generated_prompt = router.infer(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                model=model,
+                **LLM_PARAMETERS
+            )
+
+        return generated_prompt, colors
+    except TimeoutError:
+        return "Timeout", None
+
+def stream_prompt_for_image_gen(
+        prompt_file_path: str,
+        form_id: int, 
+        model: Literal['llama3-8b', 'llama3-70b', 'mixtral-8x7b', 'gpt-3.5-turbo'] = 'llama3-8b',
+        stage_timeouts: dict | None = None
+    ):
+    """
+    Same as `get_prompt_for_image_gen`, but yields the prompt generated so far every 
+    time the LLM produces new tokens, so it can be shown while it is being written.
+
+    Yields:
+        str: The prompt generated so far, or "Timeout" if the request times out.
+
+    Example:
+    ```
+    for partial_prompt in stream_prompt_for_image_gen("prompts/avatar_img_prompt.txt", form_id=1234567890):
+        print(partial_prompt)
+    ```
+    """
     try:
-        generated_prompt = groq_inference(
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            model=model,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            timeout_seconds=timeout_seconds
-        ) if model != 'gpt-3.5-turbo' else openai_inference(
+        system_prompt, user_prompt, _ = _build_llm_prompts(
+            prompt_file_path, form_id, {**STAGE_TIMEOUTS, **(stage_timeouts or {})}
+        )
+
+        generated_prompt = ""
+        started = time.perf_counter()
+        for piece in router.stream(
             system_prompt=system_prompt,
             user_prompt=user_prompt,
             model=model,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            timeout_seconds=timeout_seconds
-        )
-
-        return generated_prompt
+            **LLM_PARAMETERS
+        ):
+            if not generated_prompt:
+                timing.record('prompt_first_token', time.perf_counter() - started)
+            generated_prompt += piece
+            yield generated_prompt
+        timing.record('prompt', time.perf_counter() - started)
     except TimeoutError:
-        return "Timeout"
\ No newline at end of file
+        yield "Timeout"
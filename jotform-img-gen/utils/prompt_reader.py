@@ -1,15 +1,170 @@
+import os
+import time
+import string
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO)
+
+class PromptTemplate:
+    """
+    A prompt file parsed into its system prompt and a pre-compiled user prompt.
+
+    The user prompt is split once into literal text and `{placeholder}` fields, so
+    rendering is only a join over the parts. Placeholders must be plain names,
+    optionally with a format spec (e.g. `{heading}` or `{ratio:.2f}`); attribute
+    access, indexing and expressions are rejected when the file is loaded.
+
+    Args:
+        file_path (str): The path to the .txt file containing the prompts.
+
+    Raises:
+        FileNotFoundError: If the specified file path does not exist.
+        ValueError: If the prompts are not properly formatted in the file.
+
+    Example:
+    ```
+    template = PromptTemplate('prompts/avatar_img_prompt.txt')
+    template.fields
+    # Output: frozenset({'heading'})
+    system_prompt, user_prompt = template.render(heading='Doctor Appointment Request Form')
+    ```
+    """
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+        with open(file_path, 'r') as file:
+            content = file.read()
+
+        self.system_prompt = self._extract(content, 'SYSTEM_PROMPT')
+        user_prompt = self._extract(content, 'USER_PROMPT')
+
+        # a backslash at the end of a line joins it with the next one
+        user_prompt = user_prompt.replace('\\\n', '')
+
+        self._parts = []
+        fields = set()
+        try:
+            parsed = list(string.Formatter().parse(user_prompt))
+        except ValueError as e:
+            raise ValueError(f"Invalid placeholder in {file_path}: {str(e)}")
+
+        for literal, field, format_spec, conversion in parsed:
+            if field is not None and not field.isidentifier():
+                raise ValueError(f"Invalid placeholder '{{{field}}}' in {file_path}, only plain names are allowed.")
+            if field is not None:
+                fields.add(field)
+            self._parts.append((literal, field, format_spec or '', conversion))
+
+        self.fields = frozenset(fields)
+
+    @staticmethod
+    def _extract(content: str, name: str) -> str:
+        marker = f'{name}="""'
+        start = content.find(marker)
+        if start == -1:
+            raise ValueError(f"{name} is missing from the prompt file.")
+        start += len(marker)
+        end = content.find('"""', start)
+        if end == -1:
+            raise ValueError(f"{name} is not closed with triple quotes.")
+        return content[start:end]
+
+    def render(self, **kwargs) -> tuple:
+        """
+        Returns the system prompt and the user prompt with the placeholders filled in.
+        Keyword arguments that are not used by the template are ignored.
+
+        Raises:
+            ValueError: If a placeholder of the template has no value.
+        """
+        missing = self.fields - kwargs.keys()
+        if missing:
+            raise ValueError(f"Missing values for {sorted(missing)} in {self.file_path}.")
+
+        rendered = []
+        for literal, field, format_spec, conversion in self._parts:
+            rendered.append(literal)
+            if field is None:
+                continue
+            value = kwargs[field]
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            elif conversion == 's':
+                value = str(value)
+            rendered.append(format(value, format_spec))
+
+        return self.system_prompt, ''.join(rendered)
+
+class PromptRegistry:
+    """
+    Keeps one compiled `PromptTemplate` per prompt file and reloads a file only when
+    its modification time changes. The modification time is checked at most once
+    every `check_interval` seconds per file.
+
+    Example:
+    ```
+    registry = PromptRegistry()
+    registry.preload('prompts')
+    template = registry.get('prompts/avatar_img_prompt.txt')
+    ```
+    """
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # absolute path -> (mtime, last check, template)
+        self._templates: dict[str, tuple[float, float, PromptTemplate]] = {}
+
+    def get(self, file_path: str) -> PromptTemplate:
+        path = os.path.abspath(file_path)
+        now = time.monotonic()
+
+        entry = self._templates.get(path)
+        if entry is not None and now - entry[1] < self.check_interval:
+            return entry[2]
+
+        mtime = os.stat(path).st_mtime
+        with self._lock:
+            entry = self._templates.get(path)
+            if entry is not None and entry[0] == mtime:
+                self._templates[path] = (mtime, now, entry[2])
+                return entry[2]
+
+            template = PromptTemplate(path)
+            self._templates[path] = (mtime, now, template)
+            if entry is not None:
+                logging.info(f"Reloaded prompt template {file_path}")
+            return template
+
+    def preload(self, directory: str):
+        """
+        Compiles every .txt file in `directory`, so invalid templates fail at startup.
+        """
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith('.txt'):
+                self.get(os.path.join(directory, file_name))
+
+_registry = PromptRegistry(check_interval=float(os.getenv('PROMPT_RELOAD_INTERVAL', '1.0')))
+
+def preload_prompts(directory: str = 'prompts'):
+    _registry.preload(directory)
+
 def read_prompts_from_file(file_path, **kwargs):
     """
     Reads and extracts the system and user prompts from a .txt file and
-    dynamically inserts values into the user prompt using f-string formatting.
+    dynamically inserts values into the user prompt's `{placeholder}` fields.
+
+    Files are compiled once and kept in memory until they change on disk.
 
     Args:
         file_path (str): The path to the .txt file containing the prompts.
-        **kwargs: Additional keyword arguments to be used for dynamic content 
+        **kwargs: Additional keyword arguments to be used for dynamic content
                   insertion into the user prompt.
 
     Returns:
-        tuple: A tuple containing the system prompt and the user prompt with 
+        tuple: A tuple containing the system prompt and the user prompt with
                dynamic content inserted.
 
     Raises:
@@ -19,23 +174,8 @@ def read_prompts_from_file(file_path, **kwargs):
     Example:
     ```
     system_prompt, user_prompt = read_prompts_from_file(
-        'prompts.txt', frequent_colors="(27, 56, 23)\n(87, 57, 12)\n(42, 106, 71)", len=len
+        'prompts.txt', frequent_colors="(27, 56, 23)\n(87, 57, 12)\n(42, 106, 71)", num_colors=3
     )
     ```
     """
-    with open(file_path, 'r') as file:
-        content = file.read()
-    
-    # Extract SYSTEM_PROMPT and USER_PROMPT from the file content
-    system_prompt_start = content.find('SYSTEM_PROMPT="""') + len('SYSTEM_PROMPT="""')
-    system_prompt_end = content.find('"""', system_prompt_start)
-    system_prompt = content[system_prompt_start:system_prompt_end]
-    
-    user_prompt_start = content.find('USER_PROMPT="""') + len('USER_PROMPT="""')
-    user_prompt_end = content.find('"""', user_prompt_start)
-    user_prompt = content[user_prompt_start:user_prompt_end]
-    
-    # Use eval to dynamically insert values into the USER_PROMPT
-    user_prompt = eval(f"f'''{user_prompt}'''", {}, kwargs)
-    
-    return system_prompt, user_prompt
\ No newline at end of file
+    return _registry.get(file_path).render(**kwargs)
@@ -0,0 +1,131 @@
+import time
+import threading
+import contextvars
+
+class RateLimitTimeout(TimeoutError):
+    """
+    Raised when a call is not allowed by the rate limit in time.
+    """
+
+class TokenBucket:
+    """
+    Blocking token bucket allowing `rate` acquisitions per second on average and
+    bursts of up to `capacity`.
+
+    Example:
+    ```
+    bucket = TokenBucket(rate=30 / 60, capacity=5)  # 30 requests per minute
+    bucket.acquire()
+    ```
+    """
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate must be positive and capacity at least 1.")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1, timeout: float | None = None) -> bool:
+        """
+        Blocks until `tokens` are available and takes them. With a `timeout`, returns
+        False without taking any token as soon as they cannot be available in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait_seconds = (tokens - self._tokens) / self.rate
+            if deadline is not None and now + wait_seconds > deadline:
+                return False
+            time.sleep(wait_seconds)
+
+class WaitTracker:
+    """
+    Adds up the time the calls made inside `run` spent waiting for a rate limit, so the
+    caller can leave it out of its own timeout and give the wait its own budget.
+
+    Example:
+    ```
+    tracker = WaitTracker()
+    future = executor.submit(tracker.run, describe_colors, frequent_colors, prompt_file_path)
+    tracker.seconds()
+    # Output: 4.2
+    ```
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waited = 0.0
+        self._since = None
+
+    def run(self, fn, *args, **kwargs):
+        token = _tracker.set(self)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _tracker.reset(token)
+
+    def seconds(self) -> float:
+        """
+        Returns the seconds waited so far, including a wait that is still going on.
+        """
+        with self._lock:
+            if self._since is None:
+                return self._waited
+            return self._waited + time.monotonic() - self._since
+
+    def _start(self):
+        with self._lock:
+            self._since = time.monotonic()
+
+    def _stop(self):
+        with self._lock:
+            self._waited += time.monotonic() - self._since
+            self._since = None
+
+# the tracker of the calls made by the current `WaitTracker.run`, if any
+_tracker = contextvars.ContextVar('rate_limit_tracker', default=None)
+
+_buckets: dict[str, TokenBucket] = {}
+
+def set_rate_limit(provider: str, requests_per_minute: float | None, burst: int = 1):
+    """
+    Limits the calls made to `provider`. None removes the limit.
+
+    Example:
+    ```
+    set_rate_limit('groq', requests_per_minute=30, burst=5)
+    ```
+    """
+    if requests_per_minute is None:
+        _buckets.pop(provider, None)
+    else:
+        _buckets[provider] = TokenBucket(rate=requests_per_minute / 60, capacity=burst)
+
+def acquire(provider: str, timeout: float | None = None):
+    """
+    Blocks until a call to `provider` is allowed. Returns immediately if it is not limited.
+
+    Raises:
+        RateLimitTimeout: If the call is not allowed within `timeout` seconds. No request
+                          is counted against the limit then.
+    """
+    bucket = _buckets.get(provider)
+    if bucket is None:
+        return
+    tracker = _tracker.get()
+    if tracker is not None:
+        tracker._start()
+    try:
+        acquired = bucket.acquire(timeout=timeout)
+    finally:
+        if tracker is not None:
+            tracker._stop()
+    if not acquired:
+        raise RateLimitTimeout(f"Rate limit of '{provider}' not cleared within {timeout} seconds.")
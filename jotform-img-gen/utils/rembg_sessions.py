@@ -0,0 +1,244 @@
+import os
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import onnxruntime as ort
+import PIL.Image
+from rembg import remove
+from rembg.bg import naive_cutout
+from rembg.sessions import sessions_class
+from rembg.sessions.base import BaseSession
+
+from utils.alpha_matte import guided_upsample
+
+logging.basicConfig(level=logging.INFO)
+
+# models offered for background removal and their rembg session names
+MODELS = {
+    'u2net': 'u2net',
+    'u2netp': 'u2netp',
+    'isnet': 'isnet-general-use',
+    'silueta': 'silueta',
+}
+
+# side of the square every model resizes its input to
+MODEL_INPUT_SIZES = {
+    'u2net': 320,
+    'u2netp': 320,
+    'isnet': 1024,
+    'silueta': 320,
+}
+
+# mean and standard deviation every model normalizes its input with
+MODEL_NORMALIZATION = {
+    'u2net': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+    'u2netp': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+    'isnet': ((0.485, 0.456, 0.406), (1.0, 1.0, 1.0)),
+    'silueta': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+}
+
+# the activations of these networks take roughly a hundred times the memory of their input
+_ACTIVATION_FACTOR = 100
+
+REMBG_MODEL = os.getenv('REMBG_MODEL', 'u2net')
+# 'full' removes the background at full resolution like rembg, 'fast' predicts the
+# mask at the model's resolution and upsamples it with a guided filter
+REMBG_MODE = os.getenv('REMBG_MODE', 'full')
+if REMBG_MODE not in ('full', 'fast'):
+    raise ValueError(f"Unknown background removal mode '{REMBG_MODE}', choose 'full' or 'fast'.")
+REMBG_SESSIONS = int(os.getenv('REMBG_SESSIONS', '1'))
+# ONNX Runtime threads per session, 0 for one session's share of the CPU cores
+REMBG_THREADS = int(os.getenv('REMBG_THREADS', '0'))
+# memory one batched inference may use, which limits how many images go into one call
+REMBG_MAX_BATCH_MB = int(os.getenv('REMBG_MAX_BATCH_MB', '1024'))
+
+def create_session(model: str = 'u2net', threads: int = 0) -> BaseSession:
+    """
+    Creates a rembg session for `model` (one of `MODELS`) whose ONNX Runtime session uses
+    `threads` threads for an operator, or ONNX Runtime's default with 0.
+
+    `rembg.new_session` only reads the thread count from `OMP_NUM_THREADS`, which would
+    apply to every session of the process, so the session class is created directly.
+
+    Raises:
+        ValueError: If the model is not one of `MODELS`.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown background removal model '{model}', choose one of {', '.join(MODELS)}.")
+    session_class = next(session for session in sessions_class if session.name() == MODELS[model])
+
+    session_options = ort.SessionOptions()
+    if threads > 0:
+        session_options.intra_op_num_threads = threads
+        session_options.inter_op_num_threads = 1
+    return session_class(MODELS[model], session_options, ['CPUExecutionProvider'])
+
+def warm_up(session: BaseSession):
+    """
+    Runs one inference so that ONNX Runtime allocates its buffers and picks its kernels
+    before the first request instead of during it.
+    """
+    remove(PIL.Image.new('RGB', (64, 64), (127, 127, 127)), session=session)
+
+class RembgSessionPool:
+    """
+    A fixed number of warmed-up rembg sessions of one model, shared by all requests.
+
+    Each call checks a session out for the duration of the inference, so at most `size`
+    images are processed at the same time, each with `threads` threads, instead of
+    every concurrent request competing for all cores.
+
+    Args:
+        model (str): One of `MODELS`.
+        size (int): Number of sessions.
+        threads (int): ONNX Runtime threads per session, 0 for the CPU cores divided by `size`.
+        max_batch_mb (int): Memory one batched inference of `remove_batch` may use.
+
+    Example:
+    ```
+    pool = RembgSessionPool('u2netp', size=2)
+    cutout = pool.remove(PIL.Image.open('avatar.png'))
+    ```
+    """
+    def __init__(self, model: str = 'u2net', size: int = 1, threads: int = 0, max_batch_mb: int = 1024):
+        self.model = model
+        self.size = max(1, size)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.size)
+        self.max_batch_mb = max_batch_mb
+        self._sessions = queue.Queue()
+
+        started = time.perf_counter()
+        for _ in range(self.size):
+            session = create_session(model, self.threads)
+            warm_up(session)
+            self._sessions.put(session)
+        logging.info(f"Loaded {self.size} background removal session(s) of '{model}' with "
+                     f"{self.threads} thread(s) each in {time.perf_counter() - started:.1f} seconds.")
+        self.max_batch = self._max_batch(session)
+
+    @contextmanager
+    def session(self):
+        session = self._sessions.get()
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+    def remove(self, image: PIL.Image.Image | bytes, **kwargs) -> PIL.Image.Image | bytes:
+        """
+        Removes the background of `image` with `rembg.remove`, which returns the same type
+        it is given; `kwargs` are passed to it.
+        """
+        with self.session() as session:
+            return remove(image, session=session, **kwargs)
+
+    def _max_batch(self, session: BaseSession) -> int:
+        # a model exported with a fixed batch dimension only takes one image per call
+        batch_dimension = session.inner_session.get_inputs()[0].shape[0]
+        if isinstance(batch_dimension, int):
+            return batch_dimension
+        image_mb = 3 * MODEL_INPUT_SIZES[self.model] ** 2 * 4 * _ACTIVATION_FACTOR / 2 ** 20
+        return max(1, int(self.max_batch_mb // image_mb))
+
+    def _downscale(self, image: PIL.Image.Image) -> PIL.Image.Image:
+        small = image.copy()
+        small.thumbnail((MODEL_INPUT_SIZES[self.model],) * 2, PIL.Image.Resampling.BILINEAR, reducing_gap=2.0)
+        return small
+
+    def _predict(self, session: BaseSession, images: list[PIL.Image.Image]) -> list[PIL.Image.Image]:
+        """
+        Predicts the masks of `images` with one inference, each mask the size of its image
+        and scaled to 0-255 on its own, as `session.predict` does for a single image.
+        """
+        size = MODEL_INPUT_SIZES[self.model]
+        mean, std = MODEL_NORMALIZATION[self.model]
+        inputs = [session.normalize(image, mean, std, (size, size)) for image in images]
+        input_name = next(iter(inputs[0]))
+        predictions = session.inner_session.run(
+            None, {input_name: np.concatenate([tensor[input_name] for tensor in inputs])}
+        )[0][:, 0, :, :]
+
+        masks = []
+        for image, prediction in zip(images, predictions):
+            prediction = (prediction - prediction.min()) / (prediction.max() - prediction.min())
+            mask = PIL.Image.fromarray((prediction * 255).astype(np.uint8), 'L')
+            masks.append(mask.resize(image.size, PIL.Image.Resampling.LANCZOS))
+        return masks
+
+    def _fast_cutout(self, image: PIL.Image.Image, small: PIL.Image.Image, mask: PIL.Image.Image) -> PIL.Image.Image:
+        alpha = mask if small.size == image.size else guided_upsample(mask, small, image)
+        cutout = image.convert('RGBA')
+        cutout.putalpha(alpha)
+        return cutout
+
+    def remove_fast(self, image: PIL.Image.Image) -> PIL.Image.Image:
+        """
+        Removes the background of `image` without working on it at full resolution.
+
+        The model resizes its input to a small square anyway, so the image is downscaled
+        to that size first, the mask is predicted for the small image, and the alpha matte
+        is upsampled with `guided_upsample` using the full image as the guide. This skips
+        rembg's full resolution mask resize and cutout compositing and keeps the edges of
+        the matte on the edges of the image.
+
+        Returns:
+            PIL.Image.Image: The RGBA image with the predicted alpha.
+        """
+        image = image.convert('RGB')
+        small = self._downscale(image)
+
+        with self.session() as session:
+            mask = session.predict(small)[0]
+
+        return self._fast_cutout(image, small, mask)
+
+    def remove_batch(self, images: list[PIL.Image.Image], fast: bool = False) -> list[PIL.Image.Image]:
+        """
+        Removes the backgrounds of `images` with one inference per `max_batch` images
+        instead of one per image, e.g. for the avatars of one txt2img batch.
+
+        The images are normalized one by one and stacked along the batch dimension of the
+        model's input, and the masks are split out of its output again. The cutouts are
+        the ones `remove` (or `remove_fast` if `fast`) would make of each image. Models
+        with a fixed batch dimension of one get one call per image.
+
+        Returns:
+            list[PIL.Image.Image]: The RGBA cutouts, in the order of `images`.
+
+        Example:
+        ```
+        pool = RembgSessionPool('u2net', max_batch_mb=1024)
+        cutouts = pool.remove_batch([PIL.Image.open(path) for path in paths])
+        ```
+        """
+        images = [image.convert('RGB') for image in images]
+        inputs = [self._downscale(image) for image in images] if fast else images
+
+        masks = []
+        with self.session() as session:
+            for start in range(0, len(inputs), self.max_batch):
+                masks.extend(self._predict(session, inputs[start:start + self.max_batch]))
+
+        if fast:
+            return [self._fast_cutout(image, small, mask) for image, small, mask in zip(images, inputs, masks)]
+        return [naive_cutout(image, mask) for image, mask in zip(images, masks)]
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+def get_session_pool() -> RembgSessionPool:
+    """
+    Returns the shared pool of `REMBG_SESSIONS` sessions of `REMBG_MODEL` with
+    `REMBG_THREADS` threads each and batches of at most `REMBG_MAX_BATCH_MB`, creating
+    it on first use.
+    """
+    global _session_pool
+    if _session_pool is None:
+        with _session_pool_lock:
+            if _session_pool is None:
+                _session_pool = RembgSessionPool(REMBG_MODEL, REMBG_SESSIONS, REMBG_THREADS, REMBG_MAX_BATCH_MB)
+    return _session_pool
@@ -0,0 +1,266 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import PIL.Image
+
+from utils.rembg_sessions import RembgSessionPool, REMBG_MODEL, REMBG_THREADS, REMBG_MAX_BATCH_MB
+
+logging.basicConfig(level=logging.INFO)
+
+# worker processes for background removal, 0 runs it in the calling thread
+REMBG_PROCESSES = int(os.getenv('REMBG_PROCESSES', '1'))
+# images that may be queued or running at once, further ones are rejected right away
+REMBG_MAX_PENDING = int(os.getenv('REMBG_MAX_PENDING', '4'))
+REMBG_TIMEOUT = float(os.getenv('REMBG_TIMEOUT', '60'))
+
+class BackgroundRemovalBusy(RuntimeError):
+    """
+    Raised instead of queueing a job when `max_pending` images are already queued or running.
+    """
+
+# the session of a worker process, created by `_init_worker`
+_worker_sessions = None
+
+def _init_worker(model: str, threads: int, max_batch_mb: int):
+    global _worker_sessions
+    _worker_sessions = RembgSessionPool(model, size=1, threads=threads, max_batch_mb=max_batch_mb)
+
+def _ready() -> tuple[int, int]:
+    return os.getpid(), _worker_sessions.max_batch
+
+def _remove_shared(images: list[tuple[str, tuple, str]], fast: bool):
+    """
+    Runs in a worker: for every (source name, shape, target name) of `images`, reads the
+    RGB pixels from the shared memory block `source name` and writes the RGBA cutout of
+    the same size to `target name`. All images are processed in one batch.
+    """
+    blocks = [(SharedMemory(name=source_name), shape, SharedMemory(name=target_name))
+              for source_name, shape, target_name in images]
+    try:
+        pixels = [np.ndarray(shape, dtype=np.uint8, buffer=source.buf) for source, shape, _ in blocks]
+        results = _worker_sessions.remove_batch([PIL.Image.fromarray(image, 'RGB') for image in pixels], fast=fast)
+        for (_, shape, target), result in zip(blocks, results):
+            np.ndarray((shape[0], shape[1], 4), dtype=np.uint8, buffer=target.buf)[:] = np.asarray(result)
+        # the views must be gone before the blocks can be closed
+        del pixels, results
+    finally:
+        for source, _, target in blocks:
+            source.close()
+            target.close()
+
+def _release_shared(*blocks: SharedMemory):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+class BackgroundRemovalWorkers:
+    """
+    Runs background removal in `processes` worker processes, each with its own warmed-up
+    session, so the CPU-bound inference never holds the GIL of the app's process.
+
+    Images are handed over through shared memory: the caller copies the decoded pixels
+    into a block the worker reads, and the worker writes the cutout into a second block,
+    so no image is pickled. A job is one image or, with `remove_batch`, up to `max_batch`
+    images processed by one worker in one batched inference. At most `max_pending` images
+    are queued or running; a job that does not fit raises `BackgroundRemovalBusy` at once
+    instead of waiting behind them.
+
+    Args:
+        processes (int): Number of worker processes.
+        max_pending (int): Maximum number of images queued or running.
+        timeout (float): Seconds a caller waits for each job.
+        model (str): Background removal model, see `utils.rembg_sessions.MODELS`.
+        threads (int): ONNX Runtime threads per worker, 0 for the CPU cores divided by `processes`.
+        max_batch_mb (int): Memory one batched inference of a worker may use.
+
+    Example:
+    ```
+    workers = BackgroundRemovalWorkers(processes=2, max_pending=4, timeout=60)
+    cutout = workers.remove(PIL.Image.open('avatar.png'))
+    ```
+    """
+    def __init__(self, processes: int = 1, max_pending: int = 4, timeout: float = 60,
+                 model: str = 'u2net', threads: int = 0, max_batch_mb: int = 1024):
+        self.processes = max(1, processes)
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout
+        self.model = model
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.processes)
+        self.max_batch_mb = max_batch_mb
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+        self._max_batch = None
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn, the app's threads and locks must not be copied into the workers; a spawned
+        # worker imports the main module again, which is why app.py only builds its UI and
+        # launches under __main__
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.model, self.threads, self.max_batch_mb)
+        )
+
+    def warm_up(self):
+        """
+        Starts every worker process and waits until each has loaded its session.
+        """
+        with self._lock:
+            futures = [self._executor.submit(_ready) for _ in range(self.processes)]
+        pids, max_batches = zip(*[future.result() for future in futures])
+        self._max_batch = min(max_batches)
+        logging.info(f"Started {len(set(pids))} background removal worker(s).")
+
+    @property
+    def max_batch(self) -> int:
+        """
+        The number of images `remove_batch` takes at once: what one batched inference of a
+        worker holds, but no more than `max_pending`. Starts the workers if needed.
+        """
+        if self._max_batch is None:
+            self.warm_up()
+        return min(self._max_batch, self.max_pending)
+
+    def remove(self, image: PIL.Image.Image, fast: bool = False) -> PIL.Image.Image:
+        """
+        Returns the RGBA cutout of `image`, made with `RembgSessionPool.remove_fast` if `fast`.
+
+        Raises:
+            BackgroundRemovalBusy: If the job's images do not fit into the free `max_pending` slots.
+            TimeoutError: If the job did not finish within `timeout` seconds. The workers
+                          are restarted then, which fails the other jobs they were running.
+        """
+        return self.remove_batch([image], fast=fast)[0]
+
+    def remove_batch(self, images: list[PIL.Image.Image], fast: bool = False) -> list[PIL.Image.Image]:
+        """
+        Returns the RGBA cutouts of `images` made by one worker with
+        `RembgSessionPool.remove_batch`, as one job taking one slot per image. Larger
+        batches are split into calls of at most `max_batch` images by the caller, so
+        each call waits for its own job and gets its own timeout.
+
+        Raises:
+            BackgroundRemovalBusy: If the job's images do not fit into the free `max_pending` slots.
+            TimeoutError: If the job did not finish within `timeout` seconds. The workers
+                          are restarted then, which fails the other jobs they were running.
+            ValueError: If there are more `images` than `max_pending`.
+        """
+        if not images:
+            return []
+        if len(images) > self.max_pending:
+            raise ValueError(f"A job takes at most {self.max_pending} images, got {len(images)}.")
+        self._acquire_slots(len(images))
+
+        blocks = []
+        try:
+            try:
+                shapes = []
+                for image in images:
+                    pixels = np.asarray(image.convert('RGB'))
+                    source = SharedMemory(create=True, size=pixels.nbytes)
+                    blocks.append(source)
+                    blocks.append(SharedMemory(create=True, size=pixels.shape[0] * pixels.shape[1] * 4))
+                    np.ndarray(pixels.shape, dtype=np.uint8, buffer=source.buf)[:] = pixels
+                    shapes.append(pixels.shape)
+                    del pixels
+                jobs = [(source.name, shape, target.name)
+                        for source, target, shape in zip(blocks[::2], blocks[1::2], shapes)]
+                with self._lock:
+                    executor = self._executor
+                    future = executor.submit(_remove_shared, jobs, fast)
+            except BaseException:
+                _release_shared(*blocks)
+                raise
+        except BaseException:
+            self._release_slots(len(images))
+            raise
+        released = threading.Lock()
+        def _release_job_slots(_=None):
+            # the slots are freed either when the job is done or when its worker is killed
+            if released.acquire(blocking=False):
+                self._release_slots(len(images))
+        future.add_done_callback(_release_job_slots)
+
+        try:
+            future.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            # a running job cannot be cancelled, its worker is killed so it stops using the blocks
+            self._replace_executor(executor, terminate=True)
+            _release_shared(*blocks)
+            _release_job_slots()
+            raise TimeoutError(f"Background removal took longer than {self.timeout:g} seconds.") from None
+        except BrokenProcessPool:
+            _release_shared(*blocks)
+            self._replace_executor(executor)
+            raise
+        except BaseException:
+            _release_shared(*blocks)
+            raise
+
+        try:
+            return [
+                PIL.Image.fromarray(
+                    np.ndarray((shape[0], shape[1], 4), dtype=np.uint8, buffer=target.buf).copy(), 'RGBA'
+                )
+                for target, shape in zip(blocks[1::2], shapes)
+            ]
+        finally:
+            _release_shared(*blocks)
+
+    def _acquire_slots(self, count: int):
+        # under the lock, so two jobs never hold part of the slots they need and both fail
+        with self._lock:
+            for acquired in range(count):
+                if not self._slots.acquire(blocking=False):
+                    self._release_slots(acquired)
+                    raise BackgroundRemovalBusy(
+                        f"Background removal is busy with {self.max_pending} images, please try again in a moment."
+                    )
+
+    def _release_slots(self, count: int):
+        for _ in range(count):
+            self._slots.release()
+
+    def _replace_executor(self, broken: ProcessPoolExecutor, terminate: bool = False):
+        # a worker died (e.g. out of memory) or, with `terminate`, hangs on a timed out
+        # job and is killed; new workers are started for the next jobs
+        with self._lock:
+            if self._executor is broken:
+                logging.info("A background removal worker died or timed out, restarting the workers.")
+                self._executor = self._create_executor()
+        # the processes are forgotten by shutdown, and the jobs still queued on them fail
+        # with BrokenProcessPool once they are killed
+        processes = list((broken._processes or {}).values()) if terminate else []
+        broken.shutdown(wait=False, cancel_futures=not terminate)
+        for process in processes:
+            process.terminate()
+            process.join()
+
+    def shutdown(self):
+        with self._lock:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+_workers = None
+_workers_lock = threading.Lock()
+
+def get_workers() -> BackgroundRemovalWorkers:
+    """
+    Returns the shared background removal workers configured by `REMBG_PROCESSES`,
+    `REMBG_MAX_PENDING`, `REMBG_TIMEOUT`, `REMBG_MODEL`, `REMBG_THREADS` and
+    `REMBG_MAX_BATCH_MB`.
+    """
+    global _workers
+    if _workers is None:
+        with _workers_lock:
+            if _workers is None:
+                _workers = BackgroundRemovalWorkers(REMBG_PROCESSES, REMBG_MAX_PENDING, REMBG_TIMEOUT,
+                                                    REMBG_MODEL, REMBG_THREADS, REMBG_MAX_BATCH_MB)
+    return _workers
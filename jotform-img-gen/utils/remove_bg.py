@@ -1,11 +1,64 @@
-from rembg import remove
+import os
+from io import BytesIO
+
+import PIL.Image
+
+from utils.pipeline_image import PipelineImage
+from utils.rembg_sessions import get_session_pool, REMBG_MODE
+from utils.rembg_workers import get_workers, BackgroundRemovalBusy, REMBG_PROCESSES
+
+def _remove(image: PIL.Image.Image) -> PIL.Image.Image:
+    # in the worker processes unless `REMBG_PROCESSES=0`, at low resolution with `REMBG_MODE=fast`
+    fast = REMBG_MODE == 'fast'
+    if REMBG_PROCESSES > 0:
+        return get_workers().remove(image, fast=fast)
+    if fast:
+        return get_session_pool().remove_fast(image)
+    return get_session_pool().remove(image)
+
+def _remove_batch(images: list[PIL.Image.Image]) -> list[PIL.Image.Image]:
+    fast = REMBG_MODE == 'fast'
+    if REMBG_PROCESSES > 0:
+        return get_workers().remove_batch(images, fast=fast)
+    return get_session_pool().remove_batch(images, fast=fast)
+
+def background_removal_batch_size() -> int:
+    """
+    Returns how many images `remove_backgrounds` should be given at once: as many as one
+    batched inference takes and, with worker processes, as fit into `REMBG_MAX_PENDING`.
+    Loads the model if it is not loaded yet.
+
+    Example:
+    ```
+    batch_size = background_removal_batch_size()
+    for start in range(0, len(images), batch_size):
+        save(remove_backgrounds(images[start:start + batch_size]))
+    ```
+    """
+    if REMBG_PROCESSES > 0:
+        return get_workers().max_batch
+    return get_session_pool().max_batch
+
+def preload_background_removal():
+    """
+    Starts the background removal workers (or loads the in-process sessions with
+    `REMBG_PROCESSES=0`), so the first avatar after a restart does not wait for the
+    model to load. Skipped with `REMBG_PRELOAD=0`.
+    """
+    if os.getenv('REMBG_PRELOAD', '1') == '0':
+        return
+    if REMBG_PROCESSES > 0:
+        get_workers().warm_up()
+    else:
+        get_session_pool()
 
 def get_bg_removed_img(image_bytes: bytes) -> bytes:
     """
     Remove the background of an image provided as bytes and return the processed image as bytes.
 
     This function takes an image in the form of bytes, removes its background using the `rembg` 
-    library, and returns the resulting image as bytes.
+    library, and returns the resulting image as PNG bytes. The work is done by the shared 
+    background removal workers of `utils.rembg_workers`.
 
     Args:
         image_bytes (bytes): The image to process in bytes format.
@@ -14,6 +67,7 @@ def get_bg_removed_img(image_bytes: bytes) -> bytes:
         bytes: The processed image with the background removed.
 
     Raises:
+        BackgroundRemovalBusy: If too many images are already waiting for background removal.
         Exception: If the image cannot be processed, an exception is raised with an appropriate message.
 
     Example:
@@ -30,7 +84,75 @@ def get_bg_removed_img(image_bytes: bytes) -> bytes:
     """
 
     try:
-        output_image = remove(image_bytes)
-        return output_image
+        output_image = BytesIO()
+        _remove(PIL.Image.open(BytesIO(image_bytes))).save(output_image, format='PNG')
+        return output_image.getvalue()
+    except BackgroundRemovalBusy:
+        raise
     except Exception as e:
         raise Exception(f"Failed to process image. Error: {e}")
+
+def remove_background(image: PipelineImage) -> PipelineImage:
+    """
+    Remove the background of a pipeline image.
+
+    Unlike `get_bg_removed_img`, the image is handed to `rembg` decoded, so it is not
+    decoded again if an earlier stage already did, and the result is only encoded
+    once a later stage asks for it.
+
+    Args:
+        image (PipelineImage): The image to process.
+
+    Returns:
+        PipelineImage: The processed image with the background removed.
+
+    Raises:
+        BackgroundRemovalBusy: If too many images are already waiting for background removal.
+        Exception: If the image cannot be processed.
+
+    Example:
+    ```
+    image = PipelineImage.from_base64(response['images'][0])
+    png_bytes = remove_background(image).encode('PNG')
+    ```
+    """
+
+    try:
+        return PipelineImage(image=_remove(image.pil()))
+    except BackgroundRemovalBusy:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to process image. Error: {e}")
+
+def remove_backgrounds(images: list[PipelineImage]) -> list[PipelineImage]:
+    """
+    Remove the backgrounds of several pipeline images, e.g. every avatar of a txt2img batch.
+
+    The images are processed as one job with a batched inference (see
+    `RembgSessionPool.remove_batch`) instead of one job and one inference per image.
+    All of them are decoded at once, so larger batches should be split into calls of at
+    most `background_removal_batch_size()` images, each finished before the next.
+
+    Args:
+        images (list[PipelineImage]): The images to process.
+
+    Returns:
+        list[PipelineImage]: The processed images, in the order of `images`.
+
+    Raises:
+        BackgroundRemovalBusy: If too many images are already waiting for background removal.
+        Exception: If the images cannot be processed.
+
+    Example:
+    ```
+    images = [batch.image(index) for index in range(background_removal_batch_size())]
+    images = remove_backgrounds(images)
+    ```
+    """
+
+    try:
+        return [PipelineImage(image=image) for image in _remove_batch([image.pil() for image in images])]
+    except BackgroundRemovalBusy:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to process images. Error: {e}")
@@ -0,0 +1,421 @@
+import re
+import math
+import logging
+import colorsys
+import xml.etree.ElementTree as ET
+from collections import Counter
+from typing import Iterable
+
+from utils.color_names import NAMED_COLORS
+
+logging.basicConfig(level=logging.INFO)
+
+# CSS color keywords, e.g. 'darkslategray' -> (47, 79, 79)
+_CSS_COLORS = {name.lower().replace(' ', ''): rgb for name, rgb in NAMED_COLORS}
+_CSS_COLORS.update({
+    'cyan': _CSS_COLORS['aqua'],
+    'magenta': _CSS_COLORS['fuchsia'],
+    **{name.replace('gray', 'grey'): rgb for name, rgb in _CSS_COLORS.items() if 'gray' in name},
+})
+
+# elements whose content is only painted when referenced from elsewhere
+_NON_RENDERED = {'defs', 'clipPath', 'mask', 'symbol', 'pattern', 'marker', 'linearGradient', 'radialGradient'}
+_SHAPES = {'rect', 'circle', 'ellipse', 'polygon', 'polyline', 'path', 'line', 'text'}
+# properties that are inherited from parent elements
+_INHERITED = ('fill', 'stroke', 'stroke-width', 'fill-opacity', 'stroke-opacity', 'color')
+_PROPERTIES = _INHERITED + ('opacity', 'stop-color', 'stop-opacity', 'font-size')
+
+_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_PATH_TOKEN = re.compile(r'[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_CSS_RULE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_HEX_COLOR = re.compile(r'#[0-9A-Fa-f]{6}|#[0-9A-Fa-f]{3}')
+_URL_REF = re.compile(r'url\(\s*[\'"]?#([^\'")\s]+)[\'"]?\s*\)')
+
+def parse_color(value: str) -> tuple | None:
+    """
+    Parses a CSS/SVG color value into an (r, g, b) tuple.
+
+    Supports hex colors (`#rgb`, `#rgba`, `#rrggbb`, `#rrggbbaa`), `rgb()`/`rgba()` with
+    integer or percentage components, `hsl()`/`hsla()` and CSS color keywords.
+
+    Args:
+        value (str): The color value.
+
+    Returns:
+        tuple: The (r, g, b) color.
+        None: If the value is not a color, e.g. 'none', 'transparent' or 'url(#gradient)'.
+
+    Example:
+    ```
+    parse_color('rgb(100%, 50%, 0)')
+    # Output: (255, 128, 0)
+    ```
+    """
+    value = value.strip().lower()
+    if not value:
+        return None
+
+    if value.startswith('#'):
+        digits = value[1:]
+        if len(digits) in (3, 4) and all(c in '0123456789abcdef' for c in digits):
+            return tuple(int(c * 2, 16) for c in digits[:3])
+        if len(digits) in (6, 8) and all(c in '0123456789abcdef' for c in digits):
+            return tuple(int(digits[i:i+2], 16) for i in (0, 2, 4))
+        return None
+
+    if value.startswith(('rgb(', 'rgba(')):
+        parts = re.split(r'[\s,/]+', value[value.index('(') + 1:].rstrip(')').strip())
+        if len(parts) < 3:
+            return None
+        channels = []
+        for part in parts[:3]:
+            try:
+                channel = float(part[:-1]) * 255 / 100 if part.endswith('%') else float(part)
+            except ValueError:
+                return None
+            # CSS rounds halves up, e.g. 50% is 128
+            channels.append(min(255, max(0, int(channel + 0.5))))
+        return tuple(channels)
+
+    if value.startswith(('hsl(', 'hsla(')):
+        parts = re.split(r'[\s,/]+', value[value.index('(') + 1:].rstrip(')').strip())
+        if len(parts) < 3:
+            return None
+        try:
+            hue = float(parts[0].rstrip('deg')) / 360 % 1
+            saturation = float(parts[1].rstrip('%')) / 100
+            lightness = float(parts[2].rstrip('%')) / 100
+        except ValueError:
+            return None
+        r, g, b = colorsys.hls_to_rgb(hue, lightness, saturation)
+        return (round(r * 255), round(g * 255), round(b * 255))
+
+    return _CSS_COLORS.get(value)
+
+def _number(value: str | None, default: float = 0.0) -> float:
+    """
+    Reads the leading number of a length such as '12.5px', ignoring the unit.
+    """
+    if value is None:
+        return default
+    match = _NUMBER.match(value.strip())
+    return float(match.group()) if match else default
+
+def _parse_declarations(declarations: str) -> dict:
+    """
+    Parses 'fill: #fff; stroke: red' into {'fill': '#fff', 'stroke': 'red'}.
+    """
+    properties = {}
+    for declaration in declarations.split(';'):
+        if ':' in declaration:
+            name, value = declaration.split(':', 1)
+            name = name.strip().lower()
+            if name in _PROPERTIES:
+                properties[name] = value.replace('!important', '').strip()
+    return properties
+
+def _path_points(d: str) -> list:
+    """
+    Converts path data into a list of subpaths, each a list of absolute (x, y) points.
+    Curves are approximated by their control points and arcs by their end points.
+    """
+    tokens = _PATH_TOKEN.findall(d)
+    subpaths, points = [], []
+    x = y = start_x = start_y = 0.0
+    command = None
+    i = 0
+
+    # number of arguments of every command
+    arity = {'m': 2, 'l': 2, 'h': 1, 'v': 1, 'c': 6, 's': 4, 'q': 4, 't': 2, 'a': 7, 'z': 0}
+
+    while i < len(tokens):
+        token = tokens[i]
+        if token.isalpha():
+            command = token
+            i += 1
+            if command in 'Zz':
+                x, y = start_x, start_y
+                if points:
+                    subpaths.append(points)
+                points = []
+                continue
+        elif command is None:
+            break
+
+        n = arity[command.lower()]
+        args = tokens[i:i + n]
+        if len(args) < n or any(arg.isalpha() for arg in args):
+            break
+        args = [float(arg) for arg in args]
+        i += n
+
+        relative = command.islower()
+        lower = command.lower()
+        if lower == 'h':
+            x = x + args[0] if relative else args[0]
+            points.append((x, y))
+        elif lower == 'v':
+            y = y + args[0] if relative else args[0]
+            points.append((x, y))
+        elif lower == 'a':
+            x, y = (x + args[5], y + args[6]) if relative else (args[5], args[6])
+            points.append((x, y))
+        else:
+            base_x, base_y = (x, y) if relative else (0.0, 0.0)
+            for j in range(0, n, 2):
+                points.append((base_x + args[j], base_y + args[j + 1]))
+            x, y = points[-1]
+            if lower == 'm':
+                if len(points) > 1:
+                    subpaths.append(points[:-1])
+                points = [(x, y)]
+                start_x, start_y = x, y
+                # implicit commands after a moveto are linetos
+                command = 'l' if relative else 'L'
+
+    if points:
+        subpaths.append(points)
+    return subpaths
+
+def _polygon_area(points: list) -> float:
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2
+
+def _polyline_length(points: list, closed: bool) -> float:
+    segments = zip(points, points[1:] + (points[:1] if closed else []))
+    return sum(math.dist(a, b) for a, b in segments)
+
+def _shape_geometry(tag: str, attrib: dict, text: str | None, font_size: float) -> tuple:
+    """
+    Returns the approximate (area, perimeter) of a shape in user units.
+    """
+    if tag == 'rect':
+        width, height = _number(attrib.get('width')), _number(attrib.get('height'))
+        return width * height, 2 * (width + height)
+    if tag == 'circle':
+        r = _number(attrib.get('r'))
+        return math.pi * r * r, 2 * math.pi * r
+    if tag == 'ellipse':
+        rx, ry = _number(attrib.get('rx')), _number(attrib.get('ry'))
+        return math.pi * rx * ry, math.pi * (rx + ry)
+    if tag == 'line':
+        start = (_number(attrib.get('x1')), _number(attrib.get('y1')))
+        end = (_number(attrib.get('x2')), _number(attrib.get('y2')))
+        return 0.0, math.dist(start, end)
+    if tag in ('polygon', 'polyline'):
+        numbers = [float(n) for n in _NUMBER.findall(attrib.get('points', ''))]
+        points = list(zip(numbers[::2], numbers[1::2]))
+        return _polygon_area(points), _polyline_length(points, closed=tag == 'polygon')
+    if tag == 'path':
+        subpaths = _path_points(attrib.get('d', ''))
+        area = sum(_polygon_area(points) for points in subpaths)
+        perimeter = sum(_polyline_length(points, closed=False) for points in subpaths)
+        return area, perimeter
+    if tag == 'text':
+        # roughly half an em wide and one em high per character
+        characters = len((text or '').strip())
+        return characters * font_size * font_size * 0.5, 0.0
+    return 0.0, 0.0
+
+def _local_name(tag) -> str:
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+class _SVGColorCollector:
+    """
+    Walks the events of an incrementally parsed SVG document and accumulates the
+    weight of every painted color.
+    """
+    def __init__(self, weight_by_area: bool):
+        self.weight_by_area = weight_by_area
+        self.weights = Counter()
+        self.css_rules = []
+        self.gradients = {}
+        self.gradient_links = {}
+        self.pending_gradients = []
+        self.current_gradient = None
+        # one entry per open element: (element, computed properties, non-rendered depth)
+        self.stack = []
+
+    def _computed_properties(self, tag: str, attrib: dict) -> dict:
+        parent = self.stack[-1][1] if self.stack else {}
+        properties = {name: parent[name] for name in _INHERITED if name in parent}
+        properties['opacity'] = parent.get('opacity', 1.0)
+
+        # presentation attributes < stylesheet rules < style attribute
+        own = {name: attrib[name] for name in _PROPERTIES if name in attrib}
+        classes = attrib.get('class', '').split()
+        element_id = attrib.get('id')
+        for selector, declarations in self.css_rules:
+            if (selector == tag or selector == '*'
+                    or (selector.startswith('.') and selector[1:] in classes)
+                    or (selector.startswith('#') and selector[1:] == element_id)):
+                own.update(declarations)
+        own.update(_parse_declarations(attrib.get('style', '')))
+
+        for name, value in own.items():
+            if value.strip() == 'inherit':
+                continue
+            if name == 'opacity':
+                properties['opacity'] *= _number(value, 1.0)
+            else:
+                properties[name] = value
+        return properties
+
+    def _add_paint(self, paint: str | None, properties: dict, weight: float):
+        if weight <= 0 or paint is None:
+            return
+        paint = paint.strip()
+        if paint.lower() == 'currentcolor':
+            paint = properties.get('color', 'black')
+
+        reference = _URL_REF.match(paint)
+        if reference:
+            # gradients can be defined after they are used, resolve them at the end
+            self.pending_gradients.append((reference.group(1), weight))
+            return
+
+        color = parse_color(paint)
+        if color is not None:
+            self.weights[color] += weight
+
+    def start(self, element: ET.Element):
+        tag = _local_name(element.tag)
+        properties = self._computed_properties(tag, element.attrib)
+        non_rendered = (self.stack[-1][2] if self.stack else 0) + (tag in _NON_RENDERED)
+        self.stack.append((element, properties, non_rendered))
+
+        if tag in ('linearGradient', 'radialGradient'):
+            self.current_gradient = element.attrib.get('id')
+            self.gradients.setdefault(self.current_gradient, [])
+            href = element.attrib.get('href') or element.attrib.get('{http://www.w3.org/1999/xlink}href')
+            if href and href.startswith('#'):
+                self.gradient_links[self.current_gradient] = href[1:]
+        elif tag == 'stop' and self.current_gradient is not None:
+            color = parse_color(properties.get('stop-color', 'black'))
+            if color is not None and _number(properties.get('stop-opacity'), 1.0) > 0:
+                self.gradients[self.current_gradient].append(color)
+
+    def end(self, element: ET.Element):
+        tag = _local_name(element.tag)
+        _, properties, non_rendered = self.stack.pop()
+
+        if tag == 'style' and element.text:
+            css = _CSS_COMMENT.sub('', element.text)
+            for selectors, declarations in _CSS_RULE.findall(css):
+                parsed = _parse_declarations(declarations)
+                for selector in selectors.split(','):
+                    self.css_rules.append((selector.strip(), parsed))
+        elif tag in ('linearGradient', 'radialGradient'):
+            self.current_gradient = None
+        elif tag in _SHAPES and not non_rendered:
+            self._paint_shape(tag, element, properties)
+
+        # drop the finished element from the tree to keep memory bounded
+        element.clear()
+        if self.stack:
+            parent = self.stack[-1][0]
+            if len(parent) and parent[-1] is element:
+                del parent[-1]
+
+    def _paint_shape(self, tag: str, element: ET.Element, properties: dict):
+        opacity = properties.get('opacity', 1.0)
+        if self.weight_by_area:
+            font_size = _number(properties.get('font-size'), 16.0)
+            area, perimeter = _shape_geometry(tag, element.attrib, element.text, font_size)
+            fill_weight = area
+            stroke_weight = perimeter * _number(properties.get('stroke-width'), 1.0)
+        else:
+            fill_weight = stroke_weight = 1.0
+
+        fill_opacity = _number(properties.get('fill-opacity'), 1.0)
+        stroke_opacity = _number(properties.get('stroke-opacity'), 1.0)
+
+        if tag != 'line':
+            # the initial value of fill is black
+            self._add_paint(properties.get('fill', 'black'), properties, fill_weight * opacity * fill_opacity)
+        self._add_paint(properties.get('stroke'), properties, stroke_weight * opacity * stroke_opacity)
+
+    def _gradient_stops(self, gradient_id: str) -> list:
+        seen = set()
+        while gradient_id not in seen:
+            seen.add(gradient_id)
+            stops = self.gradients.get(gradient_id)
+            if stops:
+                return stops
+            gradient_id = self.gradient_links.get(gradient_id)
+        return []
+
+    def result(self) -> list:
+        for gradient_id, weight in self.pending_gradients:
+            stops = self._gradient_stops(gradient_id)
+            for color in stops:
+                self.weights[color] += weight / len(stops)
+
+        ordered = sorted(self.weights.items(), key=lambda x: x[1], reverse=True)
+        return [color for color, weight in ordered if weight > 0]
+
+def extract_svg_colors(
+        chunks: Iterable[bytes],
+        weight_by_area: bool = True,
+        max_bytes: int | None = 5 * 1024 * 1024
+    ) -> list:
+    """
+    Extracts the painted colors of an SVG document while it is being read.
+
+    The document is parsed incrementally and every element is discarded as soon as it
+    is closed, so memory stays bounded by the nesting depth rather than the file size.
+    Colors are read from `fill`, `stroke` and `stop-color` presentation attributes,
+    `style` attributes and `<style>` sheets (class, id and tag selectors), including
+    inherited values and gradients referenced with `url(#id)`.
+
+    Args:
+        chunks (Iterable[bytes]): The SVG document in chunks, e.g. `response.iter_content(65536)`.
+        weight_by_area (bool): Weight colors by the approximate painted area of the shapes
+                               using them, instead of counting occurrences.
+        max_bytes (int | None): Stop reading after this many bytes and use the colors
+                                found so far. None reads the whole document.
+
+    Returns:
+        list: A list of RGB tuples, the most dominant color first.
+
+    Example:
+    ```
+    with open('logo.svg', 'rb') as file:
+        colors = extract_svg_colors(iter(lambda: file.read(65536), b''))
+    # Output: [(255, 87, 51), (34, 34, 34), ...]
+    ```
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    collector = _SVGColorCollector(weight_by_area=weight_by_area)
+    bytes_read = 0
+    # kept in case the document is not well-formed XML
+    raw = bytearray()
+
+    try:
+        for chunk in chunks:
+            if max_bytes is not None and bytes_read + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - bytes_read]
+            bytes_read += len(chunk)
+            if len(raw) < 1024 * 1024:
+                raw += chunk[:1024 * 1024 - len(raw)]
+
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    collector.start(element)
+                else:
+                    collector.end(element)
+
+            if max_bytes is not None and bytes_read >= max_bytes:
+                logging.info(f"SVG is larger than {max_bytes} bytes, using the colors found so far.")
+                break
+    except ET.ParseError as e:
+        logging.info(f"Failed to parse SVG ({str(e)}), falling back to scanning hex colors.")
+        if not collector.weights and not collector.pending_gradients:
+            colors = Counter(parse_color(color) for color in _HEX_COLOR.findall(raw.decode('utf-8', errors='replace')))
+            return [color for color, _ in colors.most_common()]
+
+    return collector.result()
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import base64
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO)
+
+def payload_key(payload: dict) -> str | None:
+    """
+    Returns the canonical hash of a txt2img payload, or None if the payload has a random
+    seed (missing or -1) and its result can therefore not be reused.
+
+    The hash covers the whole payload, including the LoRA tags in the prompt and the
+    checkpoint in `override_settings`, with keys sorted so that equal payloads always
+    hash the same.
+
+    Example:
+    ```
+    payload_key({"prompt": "a cat <lora:white_1_0:1>", "seed": 1337, "override_settings": {"sd_model_checkpoint": "sd_xl_base_1.0"}})
+    # Output: '5f1c...'
+    ```
+    """
+    seed = payload.get('seed')
+    if seed is None or int(seed) < 0:
+        return None
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class Txt2ImgStore:
+    """
+    SQLite-backed store for txt2img responses, so a payload with a fixed seed is only
+    ever run on the GPU once.
+
+    Responses are stored under `payload_key` of their payload. The images themselves
+    are content-addressed by their SHA-256 hash, so an image produced by several
+    payloads (e.g. with a different batch count) is stored once. Once the stored
+    images and infos exceed `max_bytes`, the least recently used responses are evicted
+    together with the images no other response refers to.
+
+    Args:
+        db_path (str): Path to the SQLite database file. Created if it does not exist.
+        max_bytes (int): Approximate upper bound for the size of the stored images and infos.
+
+    Example:
+    ```
+    store = Txt2ImgStore(".cache/txt2img.sqlite3")
+    key = payload_key(payload)
+    response = store.get(key)
+    if response is None:
+        response = client.txt2img(payload)
+        store.put(key, response)
+    ```
+    """
+    def __init__(self, db_path: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS images (
+                    content_hash TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    info TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS result_images (
+                    key TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    PRIMARY KEY (key, position)
+                );
+                CREATE INDEX IF NOT EXISTS result_images_by_hash ON result_images (content_hash);
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # commits (or rolls back) and closes the connection when the block ends
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> dict | None:
+        """
+        Returns the stored response in the format of the txt2img API (base64 encoded
+        `images` and the `info` string), or None if `key` is not stored.
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT info FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            images = conn.execute("""
+                SELECT images.data FROM result_images JOIN images USING (content_hash)
+                WHERE result_images.key = ? ORDER BY result_images.position
+            """, (key,)).fetchall()
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._hits += 1
+        return {
+            'images': [base64.b64encode(data).decode('ascii') for (data,) in images],
+            'info': row[0],
+        }
+
+    def put(self, key: str, response: dict):
+        images = [base64.b64decode(image) for image in response['images']]
+        hashes = [hashlib.sha256(image).hexdigest() for image in images]
+        info = response['info']
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM result_images WHERE key = ?", (key,))
+            for position, (content_hash, image) in enumerate(zip(hashes, images)):
+                conn.execute(
+                    "INSERT OR IGNORE INTO images (content_hash, data, size) VALUES (?, ?, ?)",
+                    (content_hash, image, len(image))
+                )
+                conn.execute(
+                    "INSERT INTO result_images (key, position, content_hash) VALUES (?, ?, ?)",
+                    (key, position, content_hash)
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, info, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, info, len(key) + len(info), time.time())
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """
+        Deletes the least recently used responses and the images only they refer to
+        until the stored rows fit into `max_bytes`.
+        """
+        total = conn.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM images) + (SELECT COALESCE(SUM(size), 0) FROM results)"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        keys = conn.execute("SELECT key FROM results ORDER BY last_used ASC").fetchall()
+        evicted = 0
+        for (key,) in keys:
+            if total <= self.max_bytes:
+                break
+            hashes = [row[0] for row in conn.execute("SELECT content_hash FROM result_images WHERE key = ?", (key,))]
+            total -= conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("DELETE FROM result_images WHERE key = ?", (key,))
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            for content_hash in set(hashes):
+                still_used = conn.execute(
+                    "SELECT 1 FROM result_images WHERE content_hash = ? LIMIT 1", (content_hash,)
+                ).fetchone()
+                if still_used is None:
+                    total -= conn.execute("SELECT size FROM images WHERE content_hash = ?", (content_hash,)).fetchone()[0]
+                    conn.execute("DELETE FROM images WHERE content_hash = ?", (content_hash,))
+            evicted += 1
+        logging.info(f"Evicted {evicted} txt2img results, {total} bytes remaining.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+            }